@@ -7,10 +7,21 @@ Created on 2022-05-04
 @author = Cameron Bracken (cameron.bracken@pnnl.gov)
 """
 
+import argparse
+import os
+import shutil
+
+# joblib allows for parallel threads
+from joblib import Parallel, delayed
+from netCDF4 import Dataset
 import numpy as np
 import pandas as pd
-from statsmodels.distributions.empirical_distribution import ECDF as ecdf
 from utils.disc import disc
+from utils.netcdf import spatial_tiles
+from utils.encoding import CF_ENCODINGS
+from utils.profiles import find_profiles, profiles_encoding, read_profiles, write_profiles
+from utils.qmap import quantile_map, quantile_table
+from utils.reference_store import open_reference_store, reference_columns, update_reference_store
 from utils.sza import solar_zenith_and_azimuth_angle as sza_saa
 from tqdm import tqdm
 
@@ -20,44 +31,157 @@ wrf_years = list(range(1980, 2022+1))  # [1998]
 # years to build the quantile mapping
 nsrdb_years = list(range(1998, 2020+1))
 
-in_csv_template = 'data/tgw-gen/solar/historical/solar_gen_cf_{year}.csv'
-out_csv_template = 'data/tgw-gen/solar/historical_bc/solar_gen_cf_{year}_bc.csv'
+# profiles from rev_solar.py points in any --output-format, the corrected
+# profiles are written in the same format and --encoding
+in_template = 'data/tgw-gen/solar/historical/solar_gen_cf_{year}'
+out_template = 'data/tgw-gen/solar/historical_bc/solar_gen_cf_{year}_bc'
 config_fn = 'data/tgw-gen/solar/eia_solar_configs.csv'
+nsrdb_csv_template = './validation/valid_data/nsrdb_eia_power_{year}.csv'
+# nsrdb generation from the csvs above in one file, years are added as needed
+reference_fn = 'data/tgw-gen/solar/nsrdb_gen.h5'
+# nsrdb quantiles of each plant, built from the reference store the first time
+quantile_fn = 'data/tgw-gen/solar/nsrdb_quantiles_{n}.npz'
+
+# gridded capacity factor from rev_solar.py grid, and the reference on the
+# same grid for each of nsrdb_years
+grid_in_template = 'data/tgw-gen/solar/grid/solar_gen_cf_{year}.nc'
+grid_out_template = 'data/tgw-gen/solar/grid_bc/solar_gen_cf_{year}_bc.nc'
+grid_reference_template = 'data/tgw-gen/solar/grid_reference/solar_gen_cf_{year}.nc'
+# quantiles of the reference for every cell
+grid_quantile_fn = 'data/tgw-gen/solar/grid_quantiles_{n}_{y0}_{y1}.npy'
 
 # metadata with lat/lon sites, generated from meta.py
 configs = pd.read_csv(config_fn)
-n_points = configs.shape[0]
-
-print('Reading data')
-# pull in all the power data
-for year in nsrdb_years:
-
-  print(year)
-
-  csv = pd.read_csv(f'./validation/valid_data/nsrdb_eia_power_{year}.csv', index_col='index', parse_dates=True)
-
-  if year == nsrdb_years[0]:
-    nsrdb_gen = csv
+plant_codes = configs.plant_code.astype(str).tolist()
+
+
+def load_quantile_table(n, chunk_size=256):
+  """
+  Table of the NSRDB generation quantiles of every plant for series of
+  length n, see utils.qmap. Saved to quantile_fn and only rebuilt when the
+  years or plants change.
+  """
+  fn = quantile_fn.format(n=n)
+  if os.path.exists(fn):
+    with np.load(fn) as saved:
+      if saved['years'].tolist() == nsrdb_years and saved['plant_codes'].tolist() == plant_codes:
+        return saved['table']
+
+  # the nsrdb csvs are only parsed once, into the reference store
+  update_reference_store(reference_fn, nsrdb_csv_template, nsrdb_years, plant_codes)
+  _, nsrdb_gen = open_reference_store(reference_fn, nsrdb_years)
+
+  print('Building quantile table')
+  table = np.empty((n + 1, len(plant_codes)), dtype=np.float32)
+  for c0 in tqdm(range(0, len(plant_codes), chunk_size)):
+    c1 = min(len(plant_codes), c0 + chunk_size)
+    table[:, c0:c1] = quantile_table(reference_columns(nsrdb_gen, c0, c1), n)
+  tmp_fn = f'{fn}.tmp.npz'
+  np.savez(tmp_fn, table=table, years=nsrdb_years, plant_codes=plant_codes)
+  os.replace(tmp_fn, fn)
+  return table
+
+
+def bias_correct_year(year, table, encoding=None):
+  # input file for this year, csv, parquet or h5, packed as uint16 or not.
+  # unless encoding is given the output is stored the same way
+  input_fn = find_profiles(in_template.format(year=year))
+  output_format = os.path.splitext(input_fn)[1][1:]
+  if encoding is None:
+    encoding = profiles_encoding(input_fn)
+
+  solar_gen = read_profiles(input_fn)
+  if table.shape[0] != len(solar_gen) + 1:
+    table = load_quantile_table(len(solar_gen))
+
+  # map every plant at once, each value goes to the nsrdb value at the same
+  # quantile of the plant's own distribution
+  mapped = quantile_map(solar_gen[plant_codes].to_numpy(), table)
+  solar_gen[plant_codes] = np.round(mapped.astype(np.float64), 3)
+
+  write_profiles(solar_gen, out_template.format(year=year), output_format, encoding)
+  return year
+
+
+def build_grid_quantile_table(n, tile=16):
+  """
+  Quantiles of the gridded reference of every cell for series of length n,
+  see utils.qmap, with dimensions (n + 1, *grid). Built one tile of cells at
+  a time straight to a .npy file, so memory use doesn't depend on the size
+  of the grid. Returns the file name.
+  """
+  fn = grid_quantile_fn.format(n=n, y0=nsrdb_years[0], y1=nsrdb_years[-1])
+  if os.path.exists(fn):
+    return fn
+
+  refs = [Dataset(grid_reference_template.format(year=year)) for year in nsrdb_years]
+  for r in refs:
+    r.set_auto_mask(False)
+  var = refs[0]['capacity_factor']
+  tmp_fn = f'{fn}.tmp'
+  table = np.lib.format.open_memmap(tmp_fn, mode='w+', dtype=np.float32, shape=(n + 1,) + var.shape[1:])
+  print('Building grid quantile table')
+  for index in tqdm(list(spatial_tiles(var.dimensions[1:], var.shape[1:], tile))):
+    ref = np.concatenate([r['capacity_factor'][(slice(None),) + index] for r in refs])
+    cells = ref.shape[1:]
+    table[(slice(None),) + index] = quantile_table(ref.reshape((len(ref), -1)), n).reshape((n + 1,) + cells)
+  table.flush()
+  del table
+  for r in refs:
+    r.close()
+  os.replace(tmp_fn, fn)
+  return fn
+
+
+def bias_correct_grid_year(year, table_fn, tile=16):
+  """
+  Bias correct the gridded capacity factor of one year, one tile of cells at
+  a time. The output starts as a copy of the input and the corrected values
+  are written over it in place.
+  """
+  input_nc = grid_in_template.format(year=year)
+  output_nc = grid_out_template.format(year=year)
+  shutil.copyfile(input_nc, output_nc)
+
+  table = np.load(table_fn, mmap_mode='r')
+  with Dataset(input_nc) as nc_in, Dataset(output_nc, 'a') as nc_out:
+    nc_in.set_auto_mask(False)
+    var = nc_in['capacity_factor']
+    if table.shape[1:] != var.shape[1:]:
+      raise ValueError(f'{input_nc} has grid shape {var.shape[1:]}, the reference is {table.shape[1:]}')
+    for index in spatial_tiles(var.dimensions[1:], var.shape[1:], tile):
+      index = (slice(None),) + index
+      cf = var[index]
+      mapped = quantile_map(cf.reshape((len(cf), -1)), table[index].reshape((len(table), -1)))
+      nc_out['capacity_factor'][index] = np.round(mapped.astype(np.float64), 3).reshape(cf.shape)
+  return year
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Bias correct solar generation with NSRDB.')
+  # points: plant csvs from rev_solar.py points, grid: netCDFs from
+  # rev_solar.py grid mapped against a reference on the same grid
+  parser.add_argument('mode', nargs='?', choices=['points', 'grid'], default='points')
+  # number of years corrected at once
+  parser.add_argument('--tasks', type=int, default=8)
+  # grid mode works on blocks of tile x tile cells
+  parser.add_argument('--tile', type=int, default=16)
+  # points mode, store the corrected profiles with this encoding instead of
+  # the one of the input, see utils.encoding. grid mode keeps the input's
+  parser.add_argument('--encoding', choices=CF_ENCODINGS, default=None)
+  args = parser.parse_args()
+
+  if args.mode == 'grid':
+    with Dataset(grid_in_template.format(year=wrf_years[0])) as nc:
+      n = nc['capacity_factor'].shape[0]
+    table_fn = build_grid_quantile_table(n, args.tile)
+    tasks = (delayed(bias_correct_grid_year)(year, table_fn, args.tile) for year in wrf_years)
   else:
-    nsrdb_gen = pd.concat([nsrdb_gen, csv])
-
-print('Bias correcting')
-for year in wrf_years:
-
-  print(year)
-
-  # output file for this year
-  input_csv = in_csv_template.format(year=year)
-  output_csv = out_csv_template.format(year=year)
-
-  # open existing csv file
-  solar_gen = pd.read_csv(input_csv, index_col='datetime', parse_dates=True)
-
-  # read validation data csvs, files were written by R so have index starting at 1
-  for i, plant_code in tqdm(configs.plant_code.items(), total=n_points):
-
-    plant_code = str(plant_code)
-    q = ecdf(solar_gen[plant_code])(solar_gen[plant_code])
-    solar_gen[plant_code] = np.round(np.percentile(nsrdb_gen[plant_code], 100*q), 3)
-
-  solar_gen.to_csv(output_csv)
+    # every year has the same length so one table works for all of them
+    n = len(read_profiles(find_profiles(in_template.format(year=wrf_years[0])), columns=plant_codes[:1]))
+    table = load_quantile_table(n)
+    tasks = (delayed(bias_correct_year)(year, table, args.encoding) for year in wrf_years)
+
+  print('Bias correcting')
+  for year in Parallel(n_jobs=args.tasks, return_as='generator')(tasks):
+    print(year)
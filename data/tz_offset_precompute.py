@@ -1,8 +1,18 @@
+import argparse
+
 import xarray as xr
 from utils import tz
 
+# standard UTC offset of every grid cell, offset in hours as used by the reV
+# scripts and offset_seconds. quick enough to rebuild for a new WRF domain
+parser = argparse.ArgumentParser(description='Timezone offsets on the WRF grid.')
+parser.add_argument('grid_fn', nargs='?', default='data/grid.nc')
+parser.add_argument('out_fn', nargs='?', default='data/offset.nc')
+args = parser.parse_args()
 
-grid = xr.open_dataset('data/grid.nc')
-offset = tz.get_tz_offset_grid(grid.XLAT, grid.XLONG)
-grid_with_offset = grid.assign(offset=offset)
-grid_with_offset.to_netcdf('data/offset.nc')
+grid = xr.open_dataset(args.grid_fn)
+seconds = tz.tz_offsets(grid.XLAT, grid.XLONG)
+grid_with_offset = grid.assign(
+    offset=(grid.XLAT.dims, (seconds/3600).astype('float32'), {'units': 'hours'}),
+    offset_seconds=(grid.XLAT.dims, seconds, {'units': 'seconds'}))
+grid_with_offset.to_netcdf(args.out_fn)
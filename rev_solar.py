@@ -15,14 +15,21 @@ import glob
 import warnings
 import logging
 import tempfile
-import sys
-
-from joblib import Parallel, delayed
+import argparse
 
 from reV.config.project_points import ProjectPoints
 from reV.generation.generation import Gen
 
-from utils.misc import dedup_names
+from utils.cells import cell_view, grid_indexes, grid_view, is_compressed
+from utils.checkpoint import Checkpoint, file_digest, imap_checkpointed
+from utils.encoding import CF_ENCODINGS, netcdf_encoding
+from utils.generation_store import GenerationStore
+from utils.executor import RecyclingPool, SharedArrays, attach_shared, tasks_per_worker
+from utils.misc import cell_selector, dedup_names, dedup_simulations, group_by_cell, tolerance_report
+from utils.profiles import OUTPUT_FORMATS, check_output_format, write_profiles
+from utils.sam import pvwattsv5_cf_profile
+from utils.pvwatts import pvwattsv5
+from utils.solar_geometry import SolarGeometryCache
 
 # make reV and rex shut up
 warnings.filterwarnings("ignore")
@@ -31,6 +38,11 @@ logging.getLogger('reV').setLevel(logging.CRITICAL)
 
 offset = xr.load_dataset('data/offset.nc')
 
+SOLAR_VARIABLES = ['air_temperature', 'wind_speed', 'surface_pressure', 'ghi', 'dni']
+
+# met data and configs for the worker processes, set by init_worker
+worker_data = {}
+
 
 def run_rev_solar_single_point(
     i,
@@ -40,12 +52,19 @@ def run_rev_solar_single_point(
     surface_pressure,
     ghi,
     dni,
+    lat,
+    lon,
     date_stamps,
-    config,
+    configs,
     offset
 ):
-  lat = air_temperature['XLAT'].to_numpy().astype('float')[()]
-  lon = air_temperature['XLONG'].to_numpy().astype('float')[()]
+  """
+  Run reV for one grid cell. The resource file is written once and every
+  config in configs is run against it. Returns the capacity factor profiles
+  with one column per config.
+  """
+  lat = float(lat)
+  lon = float(lon)
 
   # metadata array
   meta = pd.DataFrame({'latitude': [lat],
@@ -66,18 +85,171 @@ def run_rev_solar_single_point(
     f['surface_pressure'] = surface_pressure
     # some values are NaN sometimes, not exactly sure why
     # interpolating would be better
-    f['ghi'] = ghi.fillna(0)
-    f['dni'] = dni.fillna(0)
+    f['ghi'] = np.nan_to_num(ghi)
+    f['dni'] = np.nan_to_num(dni)
+    f.close()
+
+    cf_profiles = []
+    for config in configs:
+      config_dict = {0: config}
+
+      # run reV
+      pp_wrf = ProjectPoints.lat_lon_coords(ll, resource_fn, config_dict)
+      gen = Gen('pvwattsv5', pp_wrf, config_dict, resource_fn,
+                output_request=('cf_profile'))
+      gen.run(max_workers=1)
+      cf_profiles.append(gen.out['cf_profile'])
+  return np.concatenate(cf_profiles, axis=1)
+
+
+def run_pysam_solar_single_point(
+    i,
+    j,
+    air_temperature,
+    wind_speed,
+    surface_pressure,
+    ghi,
+    dni,
+    lat,
+    lon,
+    date_stamps,
+    configs,
+    offset
+):
+  """
+  Same as run_rev_solar_single_point but runs PVWatts v5 through PySAM
+  directly from the arrays, without writing a resource file or using reV.
+  """
+  time_index = pd.to_datetime(date_stamps)
+
+  return np.concatenate([pvwattsv5_cf_profile(
+      air_temperature,
+      wind_speed,
+      surface_pressure,
+      ghi,
+      dni,
+      time_index,
+      lat,
+      lon,
+      offset,
+      config
+  ) for config in configs], axis=1)
+
+
+def run_rev_solar_multi_point(
+    air_temperature,
+    wind_speed,
+    surface_pressure,
+    ghi,
+    dni,
+    lat,
+    lon,
+    date_stamps,
+    config,
+    offsets,
+    tasks=1,
+    tmp_dir=None
+):
+  """
+  Run reV for every cell in a (Time, south_north, west_east) block of solar
+  data with a single resource file and a single Gen. Returns the capacity
+  factor profiles with shape (8760, south_north, west_east).
+  """
+  nt, ni, nj = air_temperature.shape
+
+  # one site per grid cell, row major so the output can be reshaped
+  def stacked(x):
+    return np.reshape(x, (nt, ni * nj))
+  n_sites = ni * nj
+
+  # metadata array
+  meta = pd.DataFrame({'latitude': np.asarray(lat, dtype='float').ravel(),
+                       'longitude': np.asarray(lon, dtype='float').ravel(),
+                       'timezone': np.asarray(offsets, dtype='float').ravel(),
+                       'elevation': np.zeros(n_sites)})
+
+  # temporary directory to hold the multi-site hdf5 input file for this block
+  with tempfile.TemporaryDirectory(dir=tmp_dir) as tmpdirname:
+
+    resource_fn = f'{tmpdirname}/solar_block.h5'
+    f = h5py.File(resource_fn, 'w')
+    f['meta'] = meta.to_records()
+    f['time_index'] = date_stamps
+    f['air_temperature'] = stacked(air_temperature)
+    f['wind_speed'] = stacked(wind_speed)
+    f['surface_pressure'] = stacked(surface_pressure)
+    # some values are NaN sometimes, not exactly sure why
+    # interpolating would be better
+    f['ghi'] = np.nan_to_num(stacked(ghi))
+    f['dni'] = np.nan_to_num(stacked(dni))
     f.close()
 
     config_dict = {0: config}
 
-    # run reV
-    pp_wrf = ProjectPoints.lat_lon_coords(ll, resource_fn, config_dict)
+    # run reV, letting it spread the sites over its own workers
+    pp_wrf = ProjectPoints(slice(0, n_sites), config_dict, res_file=resource_fn)
     gen = Gen('pvwattsv5', pp_wrf, config_dict, resource_fn,
-                     output_request=('cf_profile'))
-    gen.run(max_workers=1)
-  return gen.out['cf_profile']
+              output_request=('cf_profile'))
+    gen.run(max_workers=tasks)
+    cf = gen.out['cf_profile']
+
+  return cf.reshape((cf.shape[0], ni, nj))
+
+
+def share_solar_data(solar, offsets, cells=None):
+  """
+  Move the met variables of solar into shared memory for the workers, along
+  with the coordinates and the time zone offsets of its cells. Variables are
+  deleted from solar (in place, so from the caller's dataset too) as they
+  are copied so the data is only held once. With cells, a pair of grid index
+  arrays i and j, only those cells are shared, as a grid with one row where
+  cell k is at (0, k). Returns the shared arrays.
+  """
+  select = cell_selector(cells)
+  shared = SharedArrays({'XLAT': select(solar['XLAT']),
+                         'XLONG': select(solar['XLONG']),
+                         'offset': select(offsets)})
+  for name in SOLAR_VARIABLES:
+    shared.add(name, select(solar[name]))
+    del solar[name]
+  return shared
+
+
+def init_worker(spec, date_stamps, configs, engine='rev'):
+  """Pool initializer, attaches the worker to the shared met data."""
+  worker_data.update(attach_shared(spec))
+  worker_data.update(date_stamps=date_stamps, configs=configs, engine=engine)
+
+
+def run_cell(i, j, config_ids):
+  """Run the configs with indexes config_ids at cell (i, j), in a worker."""
+  single_point = {'rev': run_rev_solar_single_point,
+                  'pysam': run_pysam_solar_single_point}[worker_data['engine']]
+  return single_point(
+      i,
+      j,
+      *[worker_data[name][:, i, j] for name in SOLAR_VARIABLES],
+      worker_data['XLAT'][i, j],
+      worker_data['XLONG'][i, j],
+      worker_data['date_stamps'],
+      [worker_data['configs'][k] for k in config_ids],
+      float(worker_data['offset'][i, j])
+  )
+
+
+def run_rows(start_irange, end_irange, nj, tmp_dir=None):
+  """Run the first config on a block of rows with reV, in a worker."""
+  rows = slice(start_irange, end_irange)
+  cols = slice(0, nj)
+  return run_rev_solar_multi_point(
+      *[worker_data[name][:, rows, cols] for name in SOLAR_VARIABLES],
+      worker_data['XLAT'][rows, cols],
+      worker_data['XLONG'][rows, cols],
+      worker_data['date_stamps'],
+      worker_data['configs'][0],
+      worker_data['offset'][rows, cols],
+      tmp_dir=tmp_dir
+  )
 
 
 def run_rev_solar_grid_year(
@@ -86,6 +258,17 @@ def run_rev_solar_grid_year(
     output_dir,
     tasks=64,
     load_full_dataset=True,
+    rows_per_task=1,
+    tmp_dir=None,
+    engine='rev',
+    validate=0,
+    max_tasks_per_worker=None,
+    max_rss_mb=None,
+    max_slowdown=2.0,
+    checkpoint_dir=None,
+    solar_geometry_dir=None,
+    store_fn=None,
+    encoding='float32',
 ):
 
   start = time()
@@ -98,17 +281,26 @@ def run_rev_solar_grid_year(
   else:
     solar = xr.open_dataset(nc_file)
 
+  # data stored on the cells of a region (wrf_solar.py --mask) is used as a
+  # grid with a single row
+  compressed = is_compressed(solar)
+  solar, offsets = grid_view(solar, offset.offset)
+
   # get date stamps as string
   solar_date_times = pd.to_datetime(solar['Time'], utc=True)
   solar_date_stamps = list(solar_date_times.strftime('%Y-%m-%d %H:%M:%S'))
 
-  # copy one of the variables from the netcdf file to get all dimensions
-  # solar_cf = solar['air_temperature'][:8760, :10, :10].rename('capacity_factor')
-  solar_cf = solar['air_temperature'][:8760, :, :].rename('capacity_factor')
-  solar_cf.attrs['projection'] = solar.attrs['projection']
+  # dimensions and coordinates of the output from one of the variables, only
+  # the coordinates are kept so it doesn't hold on to the met data once that
+  # is shared
+  # template = solar['air_temperature'][:8760, :10, :10]
+  template = solar['air_temperature'][:8760, :, :]
+  cf_dims = template.dims
+  cf_coords = template.coords.to_dataset()
   # shape[0] = time, shape[1] = south_north, shape[2] = east_west
-  ni = solar_cf.shape[1]
-  nj = solar_cf.shape[2]
+  ni = template.shape[1]
+  nj = template.shape[2]
+  del template
 
   # ni = 10
   # nj = 10
@@ -117,56 +309,119 @@ def run_rev_solar_grid_year(
   with open('sam/solar_default_config.json') as f:
     solar_config = json.load(f)
 
-  # reV memory issue, the runs get slower and slower over time.
-  # to avoid this, kill the processes after a while and start over
-  # testing shows about 50 i loop iterations is when slowdown starts
-  # that means every chunk is 50*424 points
-  iloop_restart_size = 50
-  n_chunks = int(np.ceil(ni/iloop_restart_size))
-  solar_cf_list = []
-
   start_parallel = time()
 
-  for chunki in range(n_chunks):
-    start_irange = chunki*iloop_restart_size
-    end_irange = np.min((ni, (chunki+1)*iloop_restart_size))
-    irange = list(range(start_irange, end_irange))
-
-    solar_cf_list_chunki = Parallel(
-        n_jobs=tasks,
-        backend='multiprocessing',
-        # backend='threading'
-    )(delayed(run_rev_solar_single_point)(
-        i,
-        j,
-        solar['air_temperature'][:, i, j],
-        solar['wind_speed'][:, i, j],
-        solar['surface_pressure'][:, i, j],
-        solar['ghi'][:, i, j],
-        solar['dni'][:, i, j],
-        solar_date_stamps,
+  if engine == 'numpy':
+    # read the sun position from the cache instead of computing it
+    geometry = None
+    cells = None
+    if solar_geometry_dir is not None:
+      geometry = SolarGeometryCache(solar_geometry_dir)
+      cells = tuple(x[:ni, :nj] for x in grid_indexes(solar))
+    # vectorized pvwatts for the whole grid in one pass
+    cf = pvwattsv5(
+        solar['ghi'][:, :ni, :nj],
+        solar['dni'][:, :ni, :nj],
+        solar['air_temperature'][:, :ni, :nj],
+        solar['wind_speed'][:, :ni, :nj],
+        solar_date_times,
+        solar['XLAT'][:ni, :nj].to_numpy(),
+        solar['XLONG'][:ni, :nj].to_numpy(),
         solar_config,
-        float(offset.offset[i, j].values)
-    ) for i in irange for j in tqdm(range(nj)))
-
-    solar_cf_list += solar_cf_list_chunki
+        geometry=geometry,
+        cells=cells,
+    )
+
+  # the met data goes into shared memory once, workers attach to it and the
+  # tasks only carry indexes
+  shared = None
+  checkpoint = None
+  if engine == 'rev' or validate > 0:
+    shared = share_solar_data(solar, offsets)
+
+  if engine == 'rev':
+    # big matrix for all the new generation data, a float32 memmap on disk
+    # (removed when closed) so only the pages being written are in memory
+    cf = np.memmap(tempfile.TemporaryFile(dir=tmp_dir or output_dir), dtype=np.float32,
+                   mode='w+', shape=(8760, ni, nj))
+
+    # each task is a few rows written to one multi-site resource file and run
+    # through a single reV Gen in one worker. tasks are handed out as workers
+    # free up, and workers are replaced when they slow down or grow too big
+    # rather than restarting the whole pool between bands of rows
+    row_starts = range(0, ni, rows_per_task)
+    row_tasks = [(start_irange, min(ni, start_irange + rows_per_task), nj, tmp_dir)
+                 for start_irange in row_starts]
+
+    # finished row blocks are saved as they come in, a restarted run loads
+    # them instead of running them again
+    if checkpoint_dir is not None:
+      checkpoint = Checkpoint(f'{checkpoint_dir}/solar_grid_{year}',
+                              {'year': year, 'nc_file': nc_file, 'rows_per_task': rows_per_task,
+                               'config': solar_config})
+
+    # each task is rows_per_task rows of sites
+    if max_tasks_per_worker is None:
+      max_tasks_per_worker = tasks_per_worker(rows_per_task * nj)
+    with RecyclingPool(tasks,
+                       initializer=init_worker,
+                       initargs=(shared.spec, solar_date_stamps, [solar_config]),
+                       max_tasks=max_tasks_per_worker,
+                       max_rss_mb=max_rss_mb,
+                       max_slowdown=max_slowdown) as pool:
+      for k, block_cf in tqdm(imap_checkpointed(pool, run_rows, row_tasks, checkpoint),
+                              total=len(row_tasks)):
+        start_irange = row_starts[k]
+        cf[:, start_irange:start_irange + block_cf.shape[1], :] = block_cf
+      print(f"\tRecycled {len(pool.recycle_events)} workers")
 
   print("\tParallel took:", str(timedelta(seconds=np.round(time() - start_parallel))))
 
-  # big matrix for all the new generation data
-  cf = np.zeros((8760, ni, nj))
+  if validate > 0:
+    report = validate_solar_grid(cf, shared, solar_date_stamps, solar_config,
+                                 n_sample=validate, tasks=tasks)
+    report.to_csv(f"{output_dir}/solar_gen_cf_{year}_validation.csv")
+    print(report.loc['all'].to_string())
+
+  if shared is not None:
+    shared.close()
+
+  solar_cf = xr.DataArray(cf, dims=cf_dims, coords=cf_coords.coords, name='capacity_factor',
+                          attrs={'projection': solar.attrs['projection']})
+  if store_fn is not None:
+    i, j = grid_indexes(solar_cf)
+    store = GenerationStore(store_fn, encoding=encoding)
+    store.append(year, cf.reshape((len(cf), -1)), solar_cf['Time'], i=i, j=j)
+  if compressed:
+    solar_cf = cell_view(solar_cf)
+  solar_cf.to_netcdf(f"{output_dir}/solar_gen_cf_{year}.nc",
+                     encoding={'capacity_factor': netcdf_encoding(encoding)})
+
+  if checkpoint is not None:
+    checkpoint.remove()
 
-  # loop through the list of points and save them all into an array format
-  counter = 0
-  for i in range(ni):
-    for j in range(nj):
-      cf[:, i, j] = solar_cf_list[counter][:, 0]
-      counter += 1
+  print("\tYear took:", str(timedelta(seconds=np.round(time() - start))))
 
-  solar_cf.values = cf
-  solar_cf.to_netcdf(f"{output_dir}/solar_gen_cf_{year}.nc")
 
-  print("\tYear took:", str(timedelta(seconds=np.round(time() - start))))
+def validate_solar_grid(cf, shared, date_stamps, config, n_sample=100, tasks=64, seed=0):
+  """
+  Compare grid capacity factors against reV run on a random sample of cells,
+  with the met data from the shared arrays of share_solar_data. Returns a
+  tolerance report with one row per sampled cell.
+  """
+  ni = cf.shape[1]
+  nj = cf.shape[2]
+  rng = np.random.default_rng(seed)
+  cells = rng.choice(ni*nj, size=min(n_sample, ni*nj), replace=False)
+  indexi, indexj = np.unravel_index(np.sort(cells), (ni, nj))
+
+  with RecyclingPool(tasks, initializer=init_worker,
+                     initargs=(shared.spec, date_stamps, [config])) as pool:
+    rev_cf_list = pool.map(run_cell, [(i, j, [0]) for i, j in zip(indexi, indexj)])
+
+  return tolerance_report(np.concatenate(rev_cf_list, axis=1),
+                          cf[:, indexi, indexj],
+                          names=[f'{i}_{j}' for i, j in zip(indexi, indexj)])
 
 
 def run_rev_solar_points_year(
@@ -175,10 +430,27 @@ def run_rev_solar_points_year(
         output_dir,
         config_fn,
         tasks=64,
-        load_full_dataset=True
+        load_full_dataset=True,
+        engine='rev',
+        max_tasks_per_worker=None,
+        max_rss_mb=None,
+        max_slowdown=2.0,
+        checkpoint_dir=None,
+        shard_size=256,
+        output_format='csv',
+        store_fn=None,
+        encoding='float32',
 ):
   start = time()
 
+  # fail before the year is run if the output can't be written
+  check_output_format(output_format)
+
+  # the plants are read first, without any there is nothing to run or write
+  solar_configs = pd.read_csv(config_fn)
+  if solar_configs.empty:
+    raise ValueError(f'No plants in {config_fn}, nothing to run for {year}')
+
   nc_file = glob.glob(f"{input_dir}/*solar_{year}*")[0]
 
   if load_full_dataset:
@@ -190,12 +462,15 @@ def run_rev_solar_points_year(
   if year == '2024':
     solar = dupe_last3_timesteps(solar)
 
+  # data stored on the cells of a region (wrf_solar.py --mask) is used as a
+  # grid with a single row
+  solar, offsets = grid_view(solar, offset.offset)
+
   # get date stamps as string
   solar_date_times = pd.to_datetime(solar['Time'], utc=True)
   solar_date_stamps = list(solar_date_times.strftime('%Y-%m-%d %H:%M:%S'))
 
   # load default config
-  solar_configs = pd.read_csv(config_fn)
   solar_config_dicts = solar_config_dicts_from_rows(solar_configs)
   n_plants = solar_configs.shape[0]
 
@@ -203,11 +478,30 @@ def run_rev_solar_points_year(
                  solar.XLAT.stack(z=('south_north', 'west_east'))]
   tree = cKDTree(np.array(grid_points).transpose())
   dists, rows = tree.query(solar_configs[['lon', 'lat']])
+  if np.any(dists > 0.5):
+    print(f"\tWarning: {np.sum(dists > 0.5)} plants are more than 0.5 degrees from the nearest cell")
   # indexes = pd.DataFrame({'i': grid_points[0]['south_north'][rows],
   #                         'j': grid_points[0]['west_east'][rows]})
   indexi = grid_points[0]['south_north'][rows].to_numpy()
   indexj = grid_points[0]['west_east'][rows].to_numpy()
 
+  # plants that share a grid cell and have the same model inputs (multi-unit
+  # plants, duplicate plant codes) give identical results, so only simulate
+  # each distinct (cell, config) pair once
+  unique_plants, plant_to_unique = dedup_simulations(indexi, indexj, solar_config_dicts)
+  n_unique = len(unique_plants)
+  print(f"\tSimulating {n_unique} unique cell/config pairs for {n_plants} plants, "
+        f"saved {n_plants - n_unique} simulations")
+
+  # plants that share a cell read exactly the same met data, so each cell is
+  # one task that writes its resource once and runs every config at the cell
+  cell_groups = group_by_cell(indexi, indexj, unique_plants)
+
+  # the met data of just the cells with plants goes into shared memory once,
+  # workers attach to it and the tasks only carry the cell and config indexes
+  cell_i, cell_j = np.array([ij for ij, _ in cell_groups]).reshape((-1, 2)).T
+  shared = share_solar_data(solar, offsets, cells=(cell_i, cell_j))
+
   start_parallel = time()
 
   # debugging
@@ -222,28 +516,46 @@ def run_rev_solar_points_year(
   #       solar['surface_pressure'][:, i, j],
   #       solar['ghi'][:, i, j],
   #       solar['dni'][:, i, j],
+  #       solar['XLAT'][i, j],
+  #       solar['XLONG'][i, j],
   #       solar_date_stamps,
-  #       solar_config_dicts[p],
+  #       [solar_config_dicts[p]],
   #       float(offset.offset[i, j].values)
   #   )
   #   solar_cf_list.append(x)
 
-  solar_cf_list = Parallel(
-      n_jobs=tasks,
-      backend='multiprocessing',
-      # backend='threading'
-  )(delayed(run_rev_solar_single_point)(
-      i,
-      j,
-      solar['air_temperature'][:, i, j],
-      solar['wind_speed'][:, i, j],
-      solar['surface_pressure'][:, i, j],
-      solar['ghi'][:, i, j],
-      solar['dni'][:, i, j],
-      solar_date_stamps,
-      solar_config_dicts[p],
-      float(offset.offset[i, j].values)
-  ) for i, j, p in tqdm(zip(indexi, indexj, range(n_plants)), total=n_plants))
+  # cell k of the shared data is at (0, k)
+  cell_tasks = [(0, k, plants) for k, (_, plants) in enumerate(cell_groups)]
+
+  # finished shards of cells are saved as they come in, a restarted run
+  # loads them instead of running them again
+  checkpoint = None
+  if checkpoint_dir is not None:
+    checkpoint = Checkpoint(f'{checkpoint_dir}/solar_points_{year}',
+                            {'year': year, 'nc_file': nc_file, 'engine': engine,
+                             'config': file_digest(config_fn), 'shard_size': shard_size})
+
+  # one column per config in each cell, unpack them by plant then fan the
+  # results back out to every plant
+  cf_by_plant = {}
+  # each task runs every config at one cell, worker limits and task times
+  # are in simulations
+  if max_tasks_per_worker is None:
+    max_tasks_per_worker = tasks_per_worker(n_unique / len(cell_tasks))
+  with RecyclingPool(tasks,
+                     initializer=init_worker,
+                     initargs=(shared.spec, solar_date_stamps, solar_config_dicts, engine),
+                     max_tasks=max_tasks_per_worker,
+                     max_rss_mb=max_rss_mb,
+                     max_slowdown=max_slowdown,
+                     task_weight=lambda args: len(args[2])) as pool:
+    for c, cell_cf in tqdm(imap_checkpointed(pool, run_cell, cell_tasks, checkpoint, shard_size),
+                           total=len(cell_tasks)):
+      for k, p in enumerate(cell_groups[c][1]):
+        cf_by_plant[p] = cell_cf[:, [k]]
+    print(f"\tRecycled {len(pool.recycle_events)} workers")
+  shared.close()
+  solar_cf_list = [cf_by_plant[unique_plants[k]] for k in plant_to_unique]
 
   print("\tParallel took:", str(timedelta(seconds=np.round(time() - start_parallel))))
 
@@ -259,10 +571,13 @@ def run_rev_solar_points_year(
   gen = pd.DataFrame(np.concatenate(solar_cf_list, axis=1),
                      index=date_times_output,
                      columns=dedup_names(solar_configs.plant_code))
-  # write out the data to a csv
-  (gen.reset_index()
-      .rename({'index': 'datetime'}, axis=1)
-      .to_csv(f'{output_dir}/solar_gen_cf_{year}.csv', index=False))
+  # write out the data, csv by default, see utils.profiles
+  write_profiles(gen, f'{output_dir}/solar_gen_cf_{year}', output_format, encoding)
+  if store_fn is not None:
+    GenerationStore(store_fn, encoding=encoding).append_profiles(year, gen)
+
+  if checkpoint is not None:
+    checkpoint.remove()
 
   print("\tYear took:", str(timedelta(seconds=np.round(time() - start))))
 
@@ -298,22 +613,61 @@ def dupe_last3_timesteps(data):
 
 
 if __name__ == '__main__':
-  mode = sys.argv[1]
-  year = sys.argv[2]
-  input_dir = sys.argv[3]
-  output_dir = sys.argv[4]
-  config_fn = sys.argv[5]
-
-  print(f'Running reV solar {mode} mode for {year}...')
-  if mode == 'grid':
-    run_rev_solar_grid_year(year, input_dir, output_dir)
-  elif mode == 'points':
-    # config_fn = 'sam/configs/eia_solar_configs.csv'
-    run_rev_solar_points_year(year, input_dir, output_dir, config_fn)
-  else:
-    raise Exception(
-        """Valid mode must be 'grid' or 'points'
-        
-        Usage:
-        
-        python rev_solar.py mode year in_dir out_dir config_fn""")
+  parser = argparse.ArgumentParser(
+      description='Create solar generation profiles from WRF met data.',
+      usage='python rev_solar.py mode year in_dir out_dir config_fn [--engine rev|pysam|numpy] [--validate n] [--max-tasks-per-worker n] [--max-rss-mb mb] [--max-slowdown x] [--checkpoint-dir dir] [--solar-geometry-dir dir] [--output-format csv|parquet|h5] [--store fn] [--encoding float32|uint16]')
+  parser.add_argument('mode', choices=['grid', 'points'])
+  parser.add_argument('year')
+  parser.add_argument('input_dir')
+  parser.add_argument('output_dir')
+  # config_fn = 'sam/configs/eia_solar_configs.csv'
+  parser.add_argument('config_fn', nargs='?', default=None)
+  # pysam runs the SAM model directly from memory, points mode only
+  # numpy runs a vectorized pvwatts over the whole grid, grid mode only
+  parser.add_argument('--engine', choices=['rev', 'pysam', 'numpy'], default='rev')
+  # compare grid mode output against reV on this many random cells
+  parser.add_argument('--validate', type=int, default=0)
+  # replace a worker after this many tasks, when its memory use goes over
+  # this many MB, or when its tasks get this many times slower
+  # default: about every 300 sites, see utils.executor.tasks_per_worker
+  parser.add_argument('--max-tasks-per-worker', type=int, default=None)
+  parser.add_argument('--max-rss-mb', type=float, default=None)
+  parser.add_argument('--max-slowdown', type=float, default=2.0)
+  # save finished work here so a rerun of a killed job picks up where it left off
+  parser.add_argument('--checkpoint-dir', default=None)
+  # sun position cache (utils.solar_geometry) for the numpy engine
+  parser.add_argument('--solar-geometry-dir', default=None)
+  # points mode profile format, see utils.profiles
+  parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='csv')
+  # also append the year to this multi-year store, see utils.generation_store
+  parser.add_argument('--store', default=None)
+  # uint16 packs the capacity factors with a scale factor, see utils.encoding
+  parser.add_argument('--encoding', choices=CF_ENCODINGS, default='float32')
+  args = parser.parse_args()
+
+  # show worker recycle events
+  logging.basicConfig(format='%(asctime)s %(message)s')
+  logging.getLogger('utils').setLevel(logging.INFO)
+
+  pool_args = {'max_tasks_per_worker': args.max_tasks_per_worker,
+               'max_rss_mb': args.max_rss_mb,
+               'max_slowdown': args.max_slowdown,
+               'checkpoint_dir': args.checkpoint_dir,
+               'store_fn': args.store,
+               'encoding': args.encoding}
+
+  print(f'Running reV solar {args.mode} mode for {args.year}...')
+  if args.mode == 'grid':
+    if args.engine == 'pysam':
+      parser.error(f'engine {args.engine} is not available in grid mode')
+    run_rev_solar_grid_year(args.year, args.input_dir, args.output_dir,
+                            engine=args.engine, validate=args.validate,
+                            solar_geometry_dir=args.solar_geometry_dir, **pool_args)
+  elif args.mode == 'points':
+    if args.config_fn is None:
+      parser.error('config_fn is required in points mode')
+    if args.engine == 'numpy':
+      parser.error(f'engine {args.engine} is not available in points mode')
+    run_rev_solar_points_year(args.year, args.input_dir, args.output_dir,
+                              args.config_fn, engine=args.engine,
+                              output_format=args.output_format, **pool_args)
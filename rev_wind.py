@@ -15,14 +15,20 @@ import glob
 import warnings
 import logging
 import tempfile
-import sys
-
-from joblib import Parallel, delayed
+import argparse
 
 from reV.config.project_points import ProjectPoints
 from reV.generation.generation import Gen
 
-from utils.misc import dedup_names
+from utils.cells import cell_view, grid_indexes, grid_view, is_compressed
+from utils.checkpoint import Checkpoint, file_digest, imap_checkpointed
+from utils.encoding import CF_ENCODINGS, netcdf_encoding
+from utils.generation_store import GenerationStore
+from utils.executor import RecyclingPool, SharedArrays, attach_shared, tasks_per_worker
+from utils.misc import cell_selector, dedup_names, dedup_simulations, group_by_cell, tolerance_report
+from utils.profiles import OUTPUT_FORMATS, check_output_format, write_profiles
+from utils.sam import windpower_cf_profile
+from utils.windpower import windpower
 
 # make reV and rex shut up
 warnings.filterwarnings("ignore")
@@ -31,6 +37,11 @@ logging.getLogger('reV').setLevel(logging.CRITICAL)
 
 offset = xr.load_dataset('data/offset.nc')
 
+WIND_VARIABLES = ['temperature', 'pressure', 'windspeed', 'winddirection']
+
+# met data and configs for the worker processes, set by init_worker
+worker_data = {}
+
 
 def run_rev_wind_single_point(
     i,
@@ -39,12 +50,21 @@ def run_rev_wind_single_point(
     pressure,
     windspeed,
     winddirection,
+    interp_level,
+    lat,
+    lon,
     date_stamps,
-    config,
+    configs,
     offset
 ):
-  lat = temperature['XLAT'].to_numpy().astype('float')[()]
-  lon = temperature['XLONG'].to_numpy().astype('float')[()]
+  """
+  Run reV for one grid cell. Met data has dimensions (Time, interp_level),
+  with interp_level in km. The resource file is written once and every
+  config in configs is run against it. Returns the capacity factor profiles
+  with one column per config.
+  """
+  lat = float(lat)
+  lon = float(lon)
   # offset = float(offset.offset[i, j].values)
 
   # metadata array
@@ -68,28 +88,204 @@ def run_rev_wind_single_point(
     f['time_index'] = date_stamps[1:]
 
     # rev needs variables at multiple heights and will interpolate between
-    heights = temperature['interp_level']
-    for i in range(len(heights)):
+    heights = interp_level
+    for k in range(len(heights)):
+
+      postfix = f'_{int(heights[k] * 1000)}m'
+
+      # the wind data is hour ending and has an extra point at the beginning
+      # so need to cut it off
+      f['temperature' + postfix] = temperature[1:, k]
+      f['pressure' + postfix] = pressure[1:, k]
+      f['windspeed' + postfix] = windspeed[1:, k]
+      f['winddirection' + postfix] = winddirection[1:, k]
+
+    f.close()
+
+    cf_profiles = []
+    for config in configs:
+      config_dict = {0: config}
+
+      # run reV
+      pp_wrf = ProjectPoints.lat_lon_coords(ll, resource_fn, config_dict)
+      gen = Gen('windpower', pp_wrf, config_dict, resource_fn,
+                output_request=('cf_profile'))
+      gen.run(max_workers=1)
+      cf_profiles.append(gen.out['cf_profile'])
+  return np.concatenate(cf_profiles, axis=1)
+
+
+def run_pysam_wind_single_point(
+    i,
+    j,
+    temperature,
+    pressure,
+    windspeed,
+    winddirection,
+    interp_level,
+    lat,
+    lon,
+    date_stamps,
+    configs,
+    offset
+):
+  """
+  Same as run_rev_wind_single_point but runs windpower through PySAM
+  directly from the arrays, without writing a resource file or using reV.
+  """
+  heights = np.asarray(interp_level) * 1000
+
+  # the wind data is hour ending and has an extra point at the beginning
+  # so just need to cut it off
+  time_index = pd.to_datetime(date_stamps[1:])
+  temperature = temperature[1:]
+  pressure = pressure[1:]
+  windspeed = windspeed[1:]
+  winddirection = winddirection[1:]
+
+  return np.concatenate([windpower_cf_profile(
+      temperature,
+      pressure,
+      windspeed,
+      winddirection,
+      heights,
+      time_index,
+      lat,
+      lon,
+      offset,
+      config
+  ) for config in configs], axis=1)
+
+
+def run_rev_wind_multi_point(
+    temperature,
+    pressure,
+    windspeed,
+    winddirection,
+    interp_level,
+    lat,
+    lon,
+    date_stamps,
+    config,
+    offsets,
+    tasks=1,
+    tmp_dir=None
+):
+  """
+  Run reV for every cell in a (Time, interp_level, south_north, west_east)
+  block of wind data with a single resource file and a single Gen. Returns
+  the capacity factor profiles with shape (8760, south_north, west_east).
+  """
+  nt, nk, ni, nj = temperature.shape
+
+  # one site per grid cell, row major so the output can be reshaped
+  def stacked(x, k):
+    return np.reshape(x[1:, k], (nt - 1, ni * nj))
+  n_sites = ni * nj
+
+  # metadata array
+  meta = pd.DataFrame({'latitude': np.asarray(lat, dtype='float').ravel(),
+                       'longitude': np.asarray(lon, dtype='float').ravel(),
+                       'timezone': np.asarray(offsets, dtype='float').ravel(),
+                       'elevation': np.zeros(n_sites)})
+
+  # temporary directory to hold the multi-site hdf5 input file for this block
+  with tempfile.TemporaryDirectory(dir=tmp_dir) as tmpdirname:
+
+    resource_fn = f'{tmpdirname}/wind_block.h5'
+    f = h5py.File(resource_fn, 'w')
+
+    f['meta'] = meta.to_records()
+
+    # the wind data is hour ending and has an extra point at the beginning
+    # so just need to cut it off
+    # rev will drop the last day in a leap year
+    f['time_index'] = date_stamps[1:]
+
+    # rev needs variables at multiple heights and will interpolate between
+    heights = interp_level
+    for k in range(len(heights)):
 
-      postfix = f'_{int(heights[i] * 1000)}m'
+      postfix = f'_{int(heights[k] * 1000)}m'
 
       # the wind data is hour ending and has an extra point at the beginning
       # so need to cut it off
-      f['temperature' + postfix] = temperature[1:, i]
-      f['pressure' + postfix] = pressure[1:, i]
-      f['windspeed' + postfix] = windspeed[1:, i]
-      f['winddirection' + postfix] = winddirection[1:, i]
+      f['temperature' + postfix] = stacked(temperature, k)
+      f['pressure' + postfix] = stacked(pressure, k)
+      f['windspeed' + postfix] = stacked(windspeed, k)
+      f['winddirection' + postfix] = stacked(winddirection, k)
 
     f.close()
 
     config_dict = {0: config}
 
-    # run reV
-    pp_wrf = ProjectPoints.lat_lon_coords(ll, resource_fn, config_dict)
+    # run reV, letting it spread the sites over its own workers
+    pp_wrf = ProjectPoints(slice(0, n_sites), config_dict, res_file=resource_fn)
     gen = Gen('windpower', pp_wrf, config_dict, resource_fn,
-                     output_request=('cf_profile'))
-    gen.run(max_workers=1)
-  return gen.out['cf_profile']
+              output_request=('cf_profile'))
+    gen.run(max_workers=tasks)
+    cf = gen.out['cf_profile']
+
+  return cf.reshape((cf.shape[0], ni, nj))
+
+
+def share_wind_data(wind, offsets, cells=None):
+  """
+  Move the met variables of wind into shared memory for the workers, along
+  with the levels, coordinates and the time zone offsets of its cells.
+  Variables are deleted from wind (in place, so from the caller's dataset
+  too) as they are copied so the data is only held once. With cells, a pair
+  of grid index arrays i and j, only those cells are shared, as a grid with
+  one row where cell k is at (0, k). Returns the shared arrays.
+  """
+  select = cell_selector(cells)
+  shared = SharedArrays({'interp_level': wind['interp_level'].to_numpy(),
+                         'XLAT': select(wind['XLAT']),
+                         'XLONG': select(wind['XLONG']),
+                         'offset': select(offsets)})
+  for name in WIND_VARIABLES:
+    shared.add(name, select(wind[name]))
+    del wind[name]
+  return shared
+
+
+def init_worker(spec, date_stamps, configs, engine='rev'):
+  """Pool initializer, attaches the worker to the shared met data."""
+  worker_data.update(attach_shared(spec))
+  worker_data.update(date_stamps=date_stamps, configs=configs, engine=engine)
+
+
+def run_cell(i, j, config_ids):
+  """Run the configs with indexes config_ids at cell (i, j), in a worker."""
+  single_point = {'rev': run_rev_wind_single_point,
+                  'pysam': run_pysam_wind_single_point}[worker_data['engine']]
+  return single_point(
+      i,
+      j,
+      *[worker_data[name][:, :, i, j] for name in WIND_VARIABLES],
+      worker_data['interp_level'],
+      worker_data['XLAT'][i, j],
+      worker_data['XLONG'][i, j],
+      worker_data['date_stamps'],
+      [worker_data['configs'][k] for k in config_ids],
+      float(worker_data['offset'][i, j])
+  )
+
+
+def run_rows(start_irange, end_irange, nj, tmp_dir=None):
+  """Run the first config on a block of rows with reV, in a worker."""
+  rows = slice(start_irange, end_irange)
+  cols = slice(0, nj)
+  return run_rev_wind_multi_point(
+      *[worker_data[name][:, :, rows, cols] for name in WIND_VARIABLES],
+      worker_data['interp_level'],
+      worker_data['XLAT'][rows, cols],
+      worker_data['XLONG'][rows, cols],
+      worker_data['date_stamps'],
+      worker_data['configs'][0],
+      worker_data['offset'][rows, cols],
+      tmp_dir=tmp_dir
+  )
 
 
 def run_rev_wind_grid_year(
@@ -99,6 +295,16 @@ def run_rev_wind_grid_year(
     hub_height,
     tasks=64,
     load_full_dataset=True,
+    rows_per_task=1,
+    tmp_dir=None,
+    engine='rev',
+    validate=0,
+    max_tasks_per_worker=None,
+    max_rss_mb=None,
+    max_slowdown=2.0,
+    checkpoint_dir=None,
+    store_fn=None,
+    encoding='float32',
 ):
 
   start = time()
@@ -111,18 +317,27 @@ def run_rev_wind_grid_year(
   else:
     wind = xr.open_dataset(nc_file)
 
+  # data stored on the cells of a region (wrf_wind.py --mask) is used as a
+  # grid with a single row
+  compressed = is_compressed(wind)
+  wind, offsets = grid_view(wind, offset.offset)
+
   # get date stamps as string
   wind_date_times = pd.to_datetime(wind['Time'], utc=True)
   wind_date_stamps = list(wind_date_times.strftime('%Y-%m-%d %H:%M:%S'))
 
-  # copy one of the variables from the netcdf file to get all dimensions
-  wind_cf = wind['temperature'][:8760, 0, :, :].rename('capacity_factor')
+  # dimensions and coordinates of the output from one of the variables, only
+  # the coordinates are kept so it doesn't hold on to the met data once that
+  # is shared
+  template = wind['temperature'][:8760, 0, :, :]
   # for debugging
-  # wind_cf = wind['temperature'][:8760, 0, :10, :10].rename('capacity_factor')
-  wind_cf.attrs['projection'] = wind.attrs['projection']
+  # template = wind['temperature'][:8760, 0, :10, :10]
+  cf_dims = template.dims
+  cf_coords = template.coords.to_dataset()
   # shape[0] = time, shape[1] = south_north, shape[2] = east_west
-  ni = wind_cf.shape[1]
-  nj = wind_cf.shape[2]
+  ni = template.shape[1]
+  nj = template.shape[2]
+  del template
 
   # ni = 10
   # nj = 10
@@ -136,55 +351,111 @@ def run_rev_wind_grid_year(
   # estimated relationship from EIA data using robust regression
   wind_config['wind_turbine_rotor_diameter'] = hub_height*1.15
 
-  # reV memory issue, the runs get slower and slower over time.
-  # to avoid this, kill the processes after a while and start over
-  # testing shows about 50 i loop iterations is when slowdown starts
-  # that means every chunk is 50*424 points
-  iloop_restart_size = 50
-  n_chunks = int(np.ceil(ni/iloop_restart_size))
-  wind_cf_list = []
-
   start_parallel = time()
 
-  for chunki in range(n_chunks):
-    start_irange = chunki*iloop_restart_size
-    end_irange = np.min((ni, (chunki+1)*iloop_restart_size))
-    irange = list(range(start_irange, end_irange))
-
-    wind_cf_list_chunki = Parallel(
-        n_jobs=tasks,
-        backend='multiprocessing',
-        # backend='threading'
-    )(delayed(run_rev_wind_single_point)(
-        i,
-        j,
-        wind['temperature'][:, :, i, j],
-        wind['pressure'][:, :, i, j],
-        wind['windspeed'][:, :, i, j],
-        wind['winddirection'][:, :, i, j],
-        wind_date_stamps,
+  if engine == 'numpy':
+    # vectorized windpower for the whole grid in one pass
+    # the wind data is hour ending and has an extra point at the beginning
+    # so just need to cut it off
+    cf = windpower(
+        wind['temperature'][1:, :, :ni, :nj],
+        wind['pressure'][1:, :, :ni, :nj],
+        wind['windspeed'][1:, :, :ni, :nj],
+        wind['interp_level'].to_numpy() * 1000,
         wind_config,
-        float(offset.offset[i, j].values)
-    ) for i in irange for j in tqdm(range(nj)))
-
-    wind_cf_list += wind_cf_list_chunki
+        winddirection=wind['winddirection'][1:, :, :ni, :nj],
+    )
+
+  # the met data goes into shared memory once, workers attach to it and the
+  # tasks only carry indexes
+  shared = None
+  checkpoint = None
+  if engine == 'rev' or validate > 0:
+    shared = share_wind_data(wind, offsets)
+
+  if engine == 'rev':
+    # big matrix for all the new generation data, a float32 memmap on disk
+    # (removed when closed) so only the pages being written are in memory
+    cf = np.memmap(tempfile.TemporaryFile(dir=tmp_dir or output_dir), dtype=np.float32,
+                   mode='w+', shape=(8760, ni, nj))
+
+    # each task is a few rows written to one multi-site resource file and run
+    # through a single reV Gen in one worker. tasks are handed out as workers
+    # free up, and workers are replaced when they slow down or grow too big
+    # rather than restarting the whole pool between bands of rows
+    row_starts = range(0, ni, rows_per_task)
+    row_tasks = [(start_irange, min(ni, start_irange + rows_per_task), nj, tmp_dir)
+                 for start_irange in row_starts]
+
+    # finished row blocks are saved as they come in, a restarted run loads
+    # them instead of running them again
+    if checkpoint_dir is not None:
+      checkpoint = Checkpoint(f'{checkpoint_dir}/wind_grid_{year}',
+                              {'year': year, 'nc_file': nc_file, 'rows_per_task': rows_per_task,
+                               'config': wind_config})
+
+    # each task is rows_per_task rows of sites
+    if max_tasks_per_worker is None:
+      max_tasks_per_worker = tasks_per_worker(rows_per_task * nj)
+    with RecyclingPool(tasks,
+                       initializer=init_worker,
+                       initargs=(shared.spec, wind_date_stamps, [wind_config]),
+                       max_tasks=max_tasks_per_worker,
+                       max_rss_mb=max_rss_mb,
+                       max_slowdown=max_slowdown) as pool:
+      for k, block_cf in tqdm(imap_checkpointed(pool, run_rows, row_tasks, checkpoint),
+                              total=len(row_tasks)):
+        start_irange = row_starts[k]
+        cf[:, start_irange:start_irange + block_cf.shape[1], :] = block_cf
+      print(f"\tRecycled {len(pool.recycle_events)} workers")
 
   print("\tParallel took:", str(timedelta(seconds=np.round(time() - start_parallel))))
 
-  # big matrix for all the new generation data
-  cf = np.zeros((8760, ni, nj))
+  if validate > 0:
+    report = validate_wind_grid(cf, shared, wind_date_stamps, wind_config,
+                                n_sample=validate, tasks=tasks)
+    report.to_csv(f"{output_dir}/wind_gen_cf_{year}_{int(hub_height)}m_validation.csv")
+    print(report.loc['all'].to_string())
+
+  if shared is not None:
+    shared.close()
+
+  wind_cf = xr.DataArray(cf, dims=cf_dims, coords=cf_coords.coords, name='capacity_factor',
+                         attrs={'projection': wind.attrs['projection']})
+  if store_fn is not None:
+    i, j = grid_indexes(wind_cf)
+    store = GenerationStore(store_fn, encoding=encoding)
+    store.append(year, cf.reshape((len(cf), -1)), wind_cf['Time'], i=i, j=j)
+  if compressed:
+    wind_cf = cell_view(wind_cf)
+  wind_cf.to_netcdf(f"{output_dir}/wind_gen_cf_{year}_{int(hub_height)}m.nc",
+                    encoding={'capacity_factor': netcdf_encoding(encoding)})
+
+  if checkpoint is not None:
+    checkpoint.remove()
 
-  # loop through the list of points and save them all into an array format
-  counter = 0
-  for i in range(ni):
-    for j in range(nj):
-      cf[:, i, j] = wind_cf_list[counter][:, 0]
-      counter += 1
+  print("\tYear took:", str(timedelta(seconds=np.round(time() - start))))
 
-  wind_cf.values = cf
-  wind_cf.to_netcdf(f"{output_dir}/wind_gen_cf_{year}_{int(hub_height)}m.nc")
 
-  print("\tYear took:", str(timedelta(seconds=np.round(time() - start))))
+def validate_wind_grid(cf, shared, date_stamps, config, n_sample=100, tasks=64, seed=0):
+  """
+  Compare grid capacity factors against reV run on a random sample of cells,
+  with the met data from the shared arrays of share_wind_data. Returns a
+  tolerance report with one row per sampled cell.
+  """
+  ni = cf.shape[1]
+  nj = cf.shape[2]
+  rng = np.random.default_rng(seed)
+  cells = rng.choice(ni*nj, size=min(n_sample, ni*nj), replace=False)
+  indexi, indexj = np.unravel_index(np.sort(cells), (ni, nj))
+
+  with RecyclingPool(tasks, initializer=init_worker,
+                     initargs=(shared.spec, date_stamps, [config])) as pool:
+    rev_cf_list = pool.map(run_cell, [(i, j, [0]) for i, j in zip(indexi, indexj)])
+
+  return tolerance_report(np.concatenate(rev_cf_list, axis=1),
+                          cf[:, indexi, indexj],
+                          names=[f'{i}_{j}' for i, j in zip(indexi, indexj)])
 
 
 def run_rev_wind_points_year(
@@ -193,10 +464,27 @@ def run_rev_wind_points_year(
         output_dir,
         config_fn,
         tasks=64,
-        load_full_dataset=True
+        load_full_dataset=True,
+        engine='rev',
+        max_tasks_per_worker=None,
+        max_rss_mb=None,
+        max_slowdown=2.0,
+        checkpoint_dir=None,
+        shard_size=256,
+        output_format='csv',
+        store_fn=None,
+        encoding='float32',
 ):
   start = time()
 
+  # fail before the year is run if the output can't be written
+  check_output_format(output_format)
+
+  # the plants are read first, without any there is nothing to run or write
+  wind_configs = pd.read_csv(config_fn)
+  if wind_configs.empty:
+    raise ValueError(f'No plants in {config_fn}, nothing to run for {year}')
+
   nc_file = glob.glob(f"{input_dir}/*wind_{year}*")[0]
 
   if load_full_dataset:
@@ -208,12 +496,15 @@ def run_rev_wind_points_year(
   if year == '2024':
     wind = dupe_last3_timesteps(wind)
 
+  # data stored on the cells of a region (wrf_wind.py --mask) is used as a
+  # grid with a single row
+  wind, offsets = grid_view(wind, offset.offset)
+
   # get date stamps as string
   wind_date_times = pd.to_datetime(wind['Time'], utc=True)
   wind_date_stamps = list(wind_date_times.strftime('%Y-%m-%d %H:%M:%S'))
 
   # load default config
-  wind_configs = pd.read_csv(config_fn)
   wind_config_dicts = wind_config_dicts_from_rows(wind_configs)
   n_plants = wind_configs.shape[0]
 
@@ -221,28 +512,64 @@ def run_rev_wind_points_year(
                  wind.XLAT.stack(z=('south_north', 'west_east'))]
   tree = cKDTree(np.array(grid_points).transpose())
   dists, rows = tree.query(wind_configs[['lon', 'lat']])
+  if np.any(dists > 0.5):
+    print(f"\tWarning: {np.sum(dists > 0.5)} plants are more than 0.5 degrees from the nearest cell")
   # indexes = pd.DataFrame({'i': grid_points[0]['south_north'][rows],
   #                         'j': grid_points[0]['west_east'][rows]})
   indexi = grid_points[0]['south_north'][rows].to_numpy()
   indexj = grid_points[0]['west_east'][rows].to_numpy()
 
+  # plants that share a grid cell and have the same model inputs (multi-unit
+  # plants, duplicate plant codes) give identical results, so only simulate
+  # each distinct (cell, config) pair once
+  unique_plants, plant_to_unique = dedup_simulations(indexi, indexj, wind_config_dicts)
+  n_unique = len(unique_plants)
+  print(f"\tSimulating {n_unique} unique cell/config pairs for {n_plants} plants, "
+        f"saved {n_plants - n_unique} simulations")
+
+  # plants that share a cell read exactly the same met data, so each cell is
+  # one task that writes its resource once and runs every config at the cell
+  cell_groups = group_by_cell(indexi, indexj, unique_plants)
+
+  # the met data of just the cells with plants goes into shared memory once,
+  # workers attach to it and the tasks only carry the cell and config indexes
+  cell_i, cell_j = np.array([ij for ij, _ in cell_groups]).reshape((-1, 2)).T
+  shared = share_wind_data(wind, offsets, cells=(cell_i, cell_j))
+
   start_parallel = time()
 
-  wind_cf_list = Parallel(
-      n_jobs=tasks,
-      backend='multiprocessing',
-      # backend='threading'
-  )(delayed(run_rev_wind_single_point)(
-      i,
-      j,
-      wind['temperature'][:, :, i, j],
-      wind['pressure'][:, :, i, j],
-      wind['windspeed'][:, :, i, j],
-      wind['winddirection'][:, :, i, j],
-      wind_date_stamps,
-      wind_config_dicts[p],
-      float(offset.offset[i, j].values)
-  ) for i, j, p in tqdm(zip(indexi, indexj, range(n_plants)), total=n_plants))
+  # cell k of the shared data is at (0, k)
+  cell_tasks = [(0, k, plants) for k, (_, plants) in enumerate(cell_groups)]
+
+  # finished shards of cells are saved as they come in, a restarted run
+  # loads them instead of running them again
+  checkpoint = None
+  if checkpoint_dir is not None:
+    checkpoint = Checkpoint(f'{checkpoint_dir}/wind_points_{year}',
+                            {'year': year, 'nc_file': nc_file, 'engine': engine,
+                             'config': file_digest(config_fn), 'shard_size': shard_size})
+
+  # one column per config in each cell, unpack them by plant then fan the
+  # results back out to every plant
+  cf_by_plant = {}
+  # each task runs every config at one cell, worker limits and task times
+  # are in simulations
+  if max_tasks_per_worker is None:
+    max_tasks_per_worker = tasks_per_worker(n_unique / len(cell_tasks))
+  with RecyclingPool(tasks,
+                     initializer=init_worker,
+                     initargs=(shared.spec, wind_date_stamps, wind_config_dicts, engine),
+                     max_tasks=max_tasks_per_worker,
+                     max_rss_mb=max_rss_mb,
+                     max_slowdown=max_slowdown,
+                     task_weight=lambda args: len(args[2])) as pool:
+    for c, cell_cf in tqdm(imap_checkpointed(pool, run_cell, cell_tasks, checkpoint, shard_size),
+                           total=len(cell_tasks)):
+      for k, p in enumerate(cell_groups[c][1]):
+        cf_by_plant[p] = cell_cf[:, [k]]
+    print(f"\tRecycled {len(pool.recycle_events)} workers")
+  shared.close()
+  wind_cf_list = [cf_by_plant[unique_plants[k]] for k in plant_to_unique]
 
   print("\tParallel took:", str(timedelta(seconds=np.round(time() - start_parallel))))
 
@@ -259,10 +586,13 @@ def run_rev_wind_points_year(
   gen = pd.DataFrame(np.concatenate(wind_cf_list, axis=1),
                      index=date_times_output,
                      columns=dedup_names(wind_configs.plant_code))
-  # write out the data to a csv
-  (gen.reset_index()
-      .rename({'index': 'datetime'}, axis=1)
-      .to_csv(f'{output_dir}/wind_gen_cf_{year}.csv', index=False))
+  # write out the data, csv by default, see utils.profiles
+  write_profiles(gen, f'{output_dir}/wind_gen_cf_{year}', output_format, encoding)
+  if store_fn is not None:
+    GenerationStore(store_fn, encoding=encoding).append_profiles(year, gen)
+
+  if checkpoint is not None:
+    checkpoint.remove()
 
   print("\tYear took:", str(timedelta(seconds=np.round(time() - start))))
 
@@ -299,27 +629,66 @@ def dupe_last3_timesteps(data):
 
 
 if __name__ == '__main__':
-  mode = sys.argv[1]
-  year = sys.argv[2]
-  input_dir = sys.argv[3]
-  output_dir = sys.argv[4]
-  config_fn = sys.argv[5]
-  # only applies to grid mode
-  try:
-    hub_height = sys.argv[5]
-  except:
-    hub_height = '125'
-
-  print(f'Running reV wind {mode} mode for {year}...')
-  if mode == 'grid':
-    run_rev_wind_grid_year(year, input_dir, output_dir, hub_height)
-  elif mode == 'points':
-    # config_fn = 'sam/configs/eia_wind_configs.csv'
-    run_rev_wind_points_year(year, input_dir, output_dir, config_fn)
-  else:
-    raise Exception(
-        """Valid mode must be 'grid' or 'points'
-        
-        Usage:
-        
-        python rev_wind.py mode year in_dir out_dir config_fn [hub_height]""")
+  parser = argparse.ArgumentParser(
+      description='Create wind generation profiles from WRF met data.',
+      usage='python rev_wind.py mode year in_dir out_dir [config_fn] [--hub-height m] [--engine rev|pysam|numpy] [--validate n] [--max-tasks-per-worker n] [--max-rss-mb mb] [--max-slowdown x] [--checkpoint-dir dir] [--output-format csv|parquet|h5] [--store fn] [--encoding float32|uint16]')
+  parser.add_argument('mode', choices=['grid', 'points'])
+  parser.add_argument('year')
+  parser.add_argument('input_dir')
+  parser.add_argument('output_dir')
+  # config_fn = 'sam/configs/eia_wind_configs.csv', points mode only
+  parser.add_argument('config_fn', nargs='?', default=None)
+  # grid mode only, points take it from config_fn (default 125)
+  parser.add_argument('--hub-height', type=float, default=None)
+  # pysam runs the SAM model directly from memory, points mode only
+  # numpy runs a vectorized windpower over the whole grid, grid mode only
+  parser.add_argument('--engine', choices=['rev', 'pysam', 'numpy'], default='rev')
+  # compare grid mode output against reV on this many random cells
+  parser.add_argument('--validate', type=int, default=0)
+  # replace a worker after this many tasks, when its memory use goes over
+  # this many MB, or when its tasks get this many times slower
+  # default: about every 300 sites, see utils.executor.tasks_per_worker
+  parser.add_argument('--max-tasks-per-worker', type=int, default=None)
+  parser.add_argument('--max-rss-mb', type=float, default=None)
+  parser.add_argument('--max-slowdown', type=float, default=2.0)
+  # save finished work here so a rerun of a killed job picks up where it left off
+  parser.add_argument('--checkpoint-dir', default=None)
+  # points mode profile format, see utils.profiles
+  parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='csv')
+  # also append the year to this multi-year store, see utils.generation_store
+  parser.add_argument('--store', default=None)
+  # uint16 packs the capacity factors with a scale factor, see utils.encoding
+  parser.add_argument('--encoding', choices=CF_ENCODINGS, default='float32')
+  args = parser.parse_args()
+
+  # show worker recycle events
+  logging.basicConfig(format='%(asctime)s %(message)s')
+  logging.getLogger('utils').setLevel(logging.INFO)
+
+  pool_args = {'max_tasks_per_worker': args.max_tasks_per_worker,
+               'max_rss_mb': args.max_rss_mb,
+               'max_slowdown': args.max_slowdown,
+               'checkpoint_dir': args.checkpoint_dir,
+               'store_fn': args.store,
+               'encoding': args.encoding}
+
+  print(f'Running reV wind {args.mode} mode for {args.year}...')
+  if args.mode == 'grid':
+    if args.engine == 'pysam':
+      parser.error(f'engine {args.engine} is not available in grid mode')
+    if args.config_fn is not None:
+      parser.error('config_fn is only used in points mode, grid mode runs sam/wind_default_config.json '
+                   'at --hub-height')
+    hub_height = 125 if args.hub_height is None else args.hub_height
+    run_rev_wind_grid_year(args.year, args.input_dir, args.output_dir, hub_height,
+                           engine=args.engine, validate=args.validate, **pool_args)
+  elif args.mode == 'points':
+    if args.config_fn is None:
+      parser.error('config_fn is required in points mode')
+    if args.hub_height is not None:
+      parser.error('--hub-height only applies to grid mode, points mode takes it from config_fn')
+    if args.engine == 'numpy':
+      parser.error(f'engine {args.engine} is not available in points mode')
+    run_rev_wind_points_year(args.year, args.input_dir, args.output_dir,
+                             args.config_fn, engine=args.engine,
+                             output_format=args.output_format, **pool_args)
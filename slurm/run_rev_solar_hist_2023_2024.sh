@@ -13,13 +13,16 @@ source ~/venv/rev/bin/activate
 
 INPUT_DIR=/rcfs/projects/im3/data/solar-wind/met_data/historical/
 OUTPUT_DIR=/people/brac840/tgw-gen/gen
+# finished work is saved here, resubmitting after a timeout picks up where it
+# left off and years that already have output are skipped
+CHECKPOINT_DIR=$OUTPUT_DIR/checkpoints
 CONFIG_SOLAR=sam/configs/eia_solar_configs.csv
 
-echo "python rev_solar.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_SOLAR"
+echo "python rev_solar.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_SOLAR --checkpoint-dir $CHECKPOINT_DIR"
 
-srun python rev_solar.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_SOLAR &
+[ -f $OUTPUT_DIR/solar_gen_cf_2023.csv ] || srun python rev_solar.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_SOLAR --checkpoint-dir $CHECKPOINT_DIR &
 wait
-srun python rev_solar.py points 2024 $INPUT_DIR $OUTPUT_DIR $CONFIG_SOLAR &
+[ -f $OUTPUT_DIR/solar_gen_cf_2024.csv ] || srun python rev_solar.py points 2024 $INPUT_DIR $OUTPUT_DIR $CONFIG_SOLAR --checkpoint-dir $CHECKPOINT_DIR &
 wait
 
 echo "Done"
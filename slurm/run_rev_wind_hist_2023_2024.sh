@@ -13,13 +13,16 @@ source ~/venv/rev/bin/activate
 
 INPUT_DIR=/rcfs/projects/im3/data/solar-wind/met_data/historical/
 OUTPUT_DIR=/people/brac840/tgw-gen/gen
+# finished work is saved here, resubmitting after a timeout picks up where it
+# left off and years that already have output are skipped
+CHECKPOINT_DIR=$OUTPUT_DIR/checkpoints
 CONFIG_WIND=sam/configs/eia_wind_configs.csv
 
-echo "python rev_wind.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_WIND"
+echo "python rev_wind.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_WIND --checkpoint-dir $CHECKPOINT_DIR"
 
-srun python rev_wind.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_WIND &
+[ -f $OUTPUT_DIR/wind_gen_cf_2023.csv ] || srun python rev_wind.py points 2023 $INPUT_DIR $OUTPUT_DIR $CONFIG_WIND --checkpoint-dir $CHECKPOINT_DIR &
 wait
-srun python rev_wind.py points 2024 $INPUT_DIR $OUTPUT_DIR $CONFIG_WIND &
+[ -f $OUTPUT_DIR/wind_gen_cf_2024.csv ] || srun python rev_wind.py points 2024 $INPUT_DIR $OUTPUT_DIR $CONFIG_WIND --checkpoint-dir $CHECKPOINT_DIR &
 wait
 
 echo "Done"
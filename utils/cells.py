@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Restrict the WRF grid to a region of interest. Data for a region is stored
+compactly along a 'cell' dimension, with the grid indexes of each cell in the
+i (south_north) and j (west_east) coordinates.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.ndimage import binary_dilation
+from scipy.spatial import cKDTree
+
+GRID_DIMS = ('south_north', 'west_east')
+
+
+def bbox_mask(lat, lon, lon_min, lat_min, lon_max, lat_max):
+  """Cells with centers inside a lon/lat bounding box."""
+  return (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+
+
+def nearest_cells(lat, lon, plant_lat, plant_lon):
+  """
+  Flat index of the nearest grid cell to each plant, by distance in degrees
+  the same as the points mode of the reV scripts.
+  """
+  tree = cKDTree(np.column_stack([np.ravel(lon), np.ravel(lat)]))
+  _, rows = tree.query(np.column_stack([plant_lon, plant_lat]))
+  return rows
+
+
+def plant_mask(lat, lon, config_fn, buffer=1):
+  """
+  Cells within buffer cells (in i and j) of the nearest cell to any plant in
+  a plant config csv with lat and lon columns.
+  """
+  configs = pd.read_csv(config_fn)
+  rows = nearest_cells(lat, lon, configs['lat'], configs['lon'])
+  mask = np.zeros(np.shape(lat), dtype=bool)
+  mask[np.unravel_index(rows, mask.shape)] = True
+  if buffer > 0:
+    mask = binary_dilation(mask, structure=np.ones((2*buffer + 1, 2*buffer + 1), dtype=bool))
+  return mask
+
+
+def netcdf_mask(fn, shape):
+  """Boolean mask from the 'mask' variable (or the only variable) of a netCDF file."""
+  ds = xr.open_dataset(fn)
+  name = 'mask' if 'mask' in ds.data_vars else list(ds.data_vars)[0]
+  mask = ds[name].to_numpy().astype(bool)
+  if mask.shape != tuple(shape):
+    raise ValueError(f'Mask in {fn} has shape {mask.shape}, the grid is {tuple(shape)}')
+  return mask
+
+
+def region_mask(spec, lat, lon, buffer=1):
+  """
+  Mask of the grid cells in a region, given as one of
+
+    * a bounding box 'lon_min,lat_min,lon_max,lat_max'
+    * a plant config csv, cells within buffer cells of any plant
+    * a netCDF file with a boolean mask on the grid
+  """
+  lat = np.asarray(lat)
+  lon = np.asarray(lon)
+  if spec.endswith('.csv'):
+    mask = plant_mask(lat, lon, spec, buffer)
+  elif spec.endswith('.nc'):
+    mask = netcdf_mask(spec, lat.shape)
+  else:
+    try:
+      lon_min, lat_min, lon_max, lat_max = [float(x) for x in spec.split(',')]
+    except ValueError:
+      raise ValueError(f'Mask {spec} is not a csv file, netCDF file or '
+                       'lon_min,lat_min,lon_max,lat_max bounding box')
+    mask = bbox_mask(lat, lon, lon_min, lat_min, lon_max, lat_max)
+  if not mask.any():
+    raise ValueError(f'Mask {spec} does not contain any grid cells')
+  return mask
+
+
+def plant_sites(lat, lon, config_fns):
+  """
+  Sites for the plants in one or more plant config csvs, the nearest grid
+  cell to each plant.
+
+  Returns
+  -------
+  tuple
+      Mask of the cells with at least one plant, and an xr.Dataset with a
+      plant dimension holding the plant_code, lat, lon and config file of
+      each plant and the index of its site along the cell dimension of the
+      data compressed with the mask.
+  """
+  plants = pd.concat([pd.read_csv(fn)[['plant_code', 'lat', 'lon']].assign(config=os.path.basename(fn))
+                      for fn in config_fns], ignore_index=True)
+  rows = nearest_cells(lat, lon, plants['lat'], plants['lon'])
+  mask = np.zeros(np.shape(lat), dtype=bool)
+  mask.ravel()[rows] = True
+  # cells are numbered in row major order by compress_cells
+  site = np.cumsum(mask.ravel())[rows] - 1
+
+  table = xr.Dataset({
+      'plant_code': ('plant', plants['plant_code'].to_numpy()),
+      'plant_lat': ('plant', plants['lat'].to_numpy()),
+      'plant_lon': ('plant', plants['lon'].to_numpy()),
+      'plant_config': ('plant', plants['config'].to_numpy().astype(str)),
+      'plant_site': ('plant', site),
+  })
+  return mask, table
+
+
+def compress_cells(ds, mask):
+  """
+  Select the cells in mask from data on the grid. The south_north and
+  west_east dimensions are replaced by a single cell dimension with the grid
+  indexes in the i and j coordinates.
+  """
+  i, j = np.nonzero(mask)
+  out = ds.isel(south_north=xr.DataArray(i, dims='cell'),
+                west_east=xr.DataArray(j, dims='cell'))
+  out = out.drop_vars(GRID_DIMS, errors='ignore')
+  return out.assign_coords(i=('cell', i), j=('cell', j))
+
+
+def is_compressed(ds):
+  return 'cell' in ds.dims
+
+
+def grid_view(ds, offset):
+  """
+  Data stored on cells is returned with dimensions south_north (size 1) and
+  west_east (one per cell) so code written for the grid can use it as is,
+  along with the time zone offsets of those cells in the same layout. Data
+  on the grid is returned unchanged.
+  """
+  if not is_compressed(ds):
+    return ds, np.asarray(offset)
+  offset = np.asarray(offset)[ds['i'].to_numpy(), ds['j'].to_numpy()]
+  # the plant table of a sites file isn't needed, plants are matched to cells again
+  ds = ds.drop_dims('plant', errors='ignore')
+  ds = ds.rename({'cell': 'west_east'}).expand_dims('south_north', axis=-2)
+  # expand_dims only applies to the data variables
+  ds = ds.assign_coords({name: ds[name].expand_dims('south_north') for name in ('XLAT', 'XLONG')})
+  return ds, offset[np.newaxis, :]
+
+
+def grid_indexes(ds):
+  """
+  Grid indexes i and j of the cells of data on the grid, or of data on
+  cells in its grid_view, with dimensions (south_north, west_east).
+  """
+  if 'i' in ds.coords:
+    return ds['i'].to_numpy()[np.newaxis, :], ds['j'].to_numpy()[np.newaxis, :]
+  return np.meshgrid(np.arange(ds.sizes['south_north']), np.arange(ds.sizes['west_east']), indexing='ij')
+
+
+def cell_view(da):
+  """Undo grid_view for an output with the south_north and west_east dimensions."""
+  return da.isel(south_north=0).rename({'west_east': 'cell'})
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints for long runs that may be killed part way, e.g. when a SLURM job
+hits its time limit. Finished units of work are recorded in a directory so a
+restarted run can skip them and only do what is left.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+def file_digest(fn):
+  """sha1 of the contents of a file, to tell if an input changed between runs."""
+  with open(fn, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+class Checkpoint:
+  """
+  Directory of finished units of work for one run. Each unit is saved to its
+  own .npz file, written under a temporary name and renamed when complete,
+  so a unit is either fully saved or not there at all.
+
+  run_key is a json serializable description of the run (year, inputs,
+  settings). If the directory holds units from a run with a different key
+  they are deleted and the run starts over.
+  """
+
+  def __init__(self, directory, run_key):
+    self.directory = directory
+    os.makedirs(directory, exist_ok=True)
+    key_fn = os.path.join(directory, 'run.json')
+    run_key = json.loads(json.dumps(run_key, sort_keys=True, default=str))
+    if os.path.exists(key_fn):
+      with open(key_fn) as f:
+        if json.load(f) != run_key:
+          print(f'\tCheckpoint in {directory} is from a different run, starting over')
+          self.reset()
+    with open(key_fn, 'w') as f:
+      json.dump(run_key, f, sort_keys=True)
+
+  def _path(self, unit):
+    return os.path.join(self.directory, f'{unit}.npz')
+
+  def units(self):
+    """Names of the finished units."""
+    return sorted(fn[:-4] for fn in os.listdir(self.directory) if fn.endswith('.npz'))
+
+  def done(self, unit):
+    return os.path.exists(self._path(unit))
+
+  def save(self, unit, **arrays):
+    """Record unit as finished, along with any results it produced."""
+    tmp_fn = self._path(unit) + '.tmp'
+    with open(tmp_fn, 'wb') as f:
+      np.savez(f, **arrays)
+    os.replace(tmp_fn, self._path(unit))
+
+  def load(self, unit):
+    """Results saved with a finished unit, as a dict of arrays."""
+    with np.load(self._path(unit)) as data:
+      return {name: data[name] for name in data.files}
+
+  def reset(self):
+    """Forget all finished units."""
+    for fn in os.listdir(self.directory):
+      if fn.endswith('.npz') or fn.endswith('.tmp'):
+        os.remove(os.path.join(self.directory, fn))
+
+  def remove(self):
+    """Delete the checkpoint once the run's final output is written."""
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def imap_checkpointed(pool, func, tasks, checkpoint=None, shard_size=1):
+  """
+  Like pool.imap_unordered(func, tasks), yielding (index, result), but the
+  results are saved in shards of shard_size consecutive tasks as each shard
+  finishes. Shards finished by an earlier run are loaded from checkpoint
+  instead of being run again. Results must be numpy arrays.
+
+  Unit names depend on shard_size, so it should be part of the run_key.
+  """
+  tasks = list(tasks)
+  n_tasks = len(tasks)
+
+  todo = []
+  for start in range(0, n_tasks, shard_size):
+    unit = f'tasks_{start}'
+    if checkpoint is not None and checkpoint.done(unit):
+      for index, result in checkpoint.load(unit).items():
+        yield int(index), result
+    else:
+      todo.extend(range(start, min(start + shard_size, n_tasks)))
+
+  pending = {}
+  for k, result in pool.imap_unordered(func, [tasks[index] for index in todo]):
+    index = todo[k]
+    yield index, result
+    if checkpoint is not None:
+      start = index - index % shard_size
+      shard = pending.setdefault(start, {})
+      shard[str(index)] = result
+      if len(shard) == min(shard_size, n_tasks - start):
+        checkpoint.save(f'tasks_{start}', **pending.pop(start))
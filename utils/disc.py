@@ -11,8 +11,16 @@ There were four main changes from the original code
     3) removed unused result calculations
     4) Water and Pressure were changed to vectors from scalers
 """
+import math
+
 import numpy as np
 
+# numba is optional, it compiles the fused DISC kernel, see disc_fused
+try:
+  import numba
+except ImportError:
+  numba = None
+
 # from farms import SOLAR_CONSTANT
 SOLAR_CONSTANT = 1361.2
 
@@ -103,3 +111,154 @@ def disc(ghi, sza, doy, pressure=1013.25, sza_lim=87):
   DNI[np.logical_or.reduce((sza >= sza_lim, ghi < 1, DNI < 0))] = 0
 
   return DNI
+
+
+def _disc_point(f):
+  """
+  disc for a single value of dtype f, every step in one pass so no
+  temporaries. The constants are of dtype f too, so the float32 version
+  never promotes to float64.
+  """
+  solar_constant = f(SOLAR_CONSTANT)
+  zero, one, kt_split = f(0), f(1), f(0.6)
+  am_a, am_b, am_c, am_d = f(0.15), f(93.885), f(-1.253), f(100 / 101325)
+  a_high = f(-5.743), f(21.77), f(-27.49), f(11.56)
+  b_high = f(41.4), f(-118.5), f(66.05), f(31.9)
+  c_high = f(-47.01), f(184.2), f(-222.), f(73.81)
+  a_low = f(0.512), f(-1.56), f(2.286), f(-2.222)
+  b_low = f(0.37), f(0.962)
+  c_low = f(-0.28), f(0.932), f(-2.048)
+  knc = f(0.866), f(-0.122), f(0.0121), f(-0.000653), f(0.000014)
+
+  def point(ghi, sza, re_var, pressure, sza_lim):
+    I0 = re_var * solar_constant
+    Ztemp = sza_lim if sza > sza_lim else sza
+    if Ztemp >= sza_lim:
+      AM = zero
+    else:
+      AM = (one / (math.cos(math.radians(Ztemp)) + am_a * (am_b - Ztemp)**am_c)
+            * pressure * am_d)
+
+    Kt = ghi / (I0 * math.cos(math.radians(sza)))
+    if Kt < zero:
+      Kt = zero
+    if Kt > kt_split:
+      A = a_high[0] + Kt * (a_high[1] + Kt * (a_high[2] + Kt * a_high[3]))
+      B = b_high[0] + Kt * (b_high[1] + Kt * (b_high[2] + Kt * b_high[3]))
+      C = c_high[0] + Kt * (c_high[1] + Kt * (c_high[2] + Kt * c_high[3]))
+    elif Kt <= kt_split:
+      A = a_low[0] + Kt * (a_low[1] + Kt * (a_low[2] + Kt * a_low[3]))
+      B = b_low[0] + b_low[1] * Kt
+      C = c_low[0] + Kt * (c_low[1] + Kt * c_low[2])
+    else:
+      # nan
+      A = B = C = zero
+
+    Knc = knc[0] + AM * (knc[1] + AM * (knc[2] + AM * (knc[3] + AM * knc[4])))
+    DNI = (Knc - (A + B * math.exp(C * AM))) * I0
+    if sza >= sza_lim or ghi < one or DNI < zero:
+      DNI = zero
+    return DNI
+  return point
+
+
+def _disc_numpy(ghi, sza, re_var, pressure, sza_lim):
+  # disc_fused without numba, one mask for the Kt branches and the
+  # temporaries in the input dtype
+  I0 = re_var * SOLAR_CONSTANT
+  Ztemp = np.minimum(sza, sza_lim)
+  AM = (100 * pressure / 101325) / (np.cos(np.radians(Ztemp))
+                                    + 0.15 * np.power(93.885 - Ztemp, -1.253))
+  AM[Ztemp >= sza_lim] = 0
+
+  Kt = ghi / (I0 * np.cos(np.radians(sza)))
+  np.maximum(Kt, 0, out=Kt)
+  high = Kt > 0.6
+  A = np.where(high, -5.743 + Kt * (21.77 + Kt * (-27.49 + Kt * 11.56)),
+               0.512 + Kt * (-1.56 + Kt * (2.286 + Kt * -2.222)))
+  B = np.where(high, 41.4 + Kt * (-118.5 + Kt * (66.05 + Kt * 31.9)),
+               0.37 + 0.962 * Kt)
+  C = np.where(high, -47.01 + Kt * (184.2 + Kt * (-222. + Kt * 73.81)),
+               -0.28 + Kt * (0.932 + Kt * -2.048))
+  missing = np.isnan(Kt)
+  if missing.any():
+    A[missing] = B[missing] = C[missing] = 0
+
+  C *= AM
+  np.exp(C, out=C)
+  B *= C
+  A += B
+  Knc = 0.866 + AM * (-0.122 + AM * (0.0121 + AM * (-0.000653 + AM * 0.000014)))
+  Knc -= A
+  DNI = Knc * I0
+  DNI[(sza >= sza_lim) | (ghi < 1) | (DNI < 0)] = 0
+  return DNI
+
+
+if numba is None:
+  _disc_kernels = {}
+else:
+  # compiled ahead for both dtypes, so float32 inputs give float32 output
+  _disc_kernels = {np.dtype(f): numba.vectorize([f'{f.__name__}({", ".join([f.__name__] * 5)})'],
+                                                nopython=True)(_disc_point(f))
+                   for f in (np.float32, np.float64)}
+
+
+def _disc_kernel(ghi, sza, re_var, pressure, sza_lim):
+  kernel = _disc_kernels.get(ghi.dtype, _disc_numpy)
+  return kernel(ghi, sza, re_var, pressure, sza_lim)
+
+
+def disc_fused(ghi, sza, doy, pressure=1013.25, sza_lim=87):
+  """
+  Same as disc, but computed in a single pass over the data when numba is
+  installed (a vectorized NumPy version otherwise), and in float32 when ghi
+  is float32. Inputs are broadcast against each other, a 1d doy goes with
+  the first dimension of sza like in disc.
+
+  Returns
+  -------
+  DNI : np.ndarray
+      Estimated direct normal irradiance in W/m2.
+  """
+  ghi = np.asarray(ghi)
+  dtype = np.float32 if ghi.dtype == np.float32 else np.float64
+  sza = np.asarray(sza, dtype=dtype)
+  doy = np.asarray(doy)
+
+  day_angle = 2. * np.pi * (doy - 1) / 365
+  re_var = (1.00011 + 0.034221 * np.cos(day_angle)
+            + 0.00128 * np.sin(day_angle)
+            + 0.000719 * np.cos(2. * day_angle)
+            + 7.7E-5 * np.sin(2. * day_angle))
+  if re_var.ndim < sza.ndim:
+    re_var = re_var.reshape(re_var.shape + (1,) * (sza.ndim - re_var.ndim))
+
+  return _disc_kernel(ghi.astype(dtype, copy=False), sza, re_var.astype(dtype),
+                      np.asarray(pressure, dtype=dtype), dtype(sza_lim))
+
+
+if __name__ == '__main__':
+  # benchmark disc_fused against disc on a week of hourly data for 20000
+  # cells and check the output dtype, python -m utils.disc
+  import time
+  import warnings
+  warnings.filterwarnings('ignore')
+
+  rng = np.random.default_rng(0)
+  shape = (168, 20000)
+  sza = rng.uniform(0, 120, shape)
+  ghi = np.maximum(rng.uniform(-50, 1100, shape) * np.cos(np.radians(sza)), 0)
+  pressure = rng.uniform(700, 1050, shape)
+  doy = np.repeat(np.arange(1, 8), 24)
+
+  start = time.time()
+  expected = disc(ghi.ravel(), sza.ravel(), np.repeat(doy, shape[1]), pressure=pressure.ravel()).reshape(shape)
+  print(f'disc float64: {time.time() - start:.3f}s')
+  for dtype in (np.float64, np.float32):
+    disc_fused(ghi[:1].astype(dtype), sza[:1], doy[:1], pressure[:1])  # compile
+    start = time.time()
+    dni = disc_fused(ghi.astype(dtype), sza, doy, pressure=pressure.astype(dtype))
+    assert dni.dtype == dtype, f'disc_fused returned {dni.dtype} for {np.dtype(dtype).name} input'
+    print(f'disc_fused {np.dtype(dtype).name} ({"numba" if numba else "numpy"}): '
+          f'{time.time() - start:.3f}s, max abs difference {np.abs(dni - expected).max():.2e} W/m2')
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Storage encodings for capacity factors. Besides float32 they can be packed
+as uint16 with scale_factor and add_offset, the netCDF convention, which
+keeps 4 decimals (more than bias_correct.py rounds to) in half the space
+and compresses much better. Values outside 0 to 6.5534 are clipped and
+NaN is stored as FILL_VALUE.
+"""
+
+import numpy as np
+
+CF_ENCODINGS = ('float32', 'uint16')
+SCALE_FACTOR = 1e-4
+ADD_OFFSET = 0.0
+FILL_VALUE = np.iinfo(np.uint16).max
+
+
+def encode_cf(cf):
+  """Pack capacity factors into uint16."""
+  cf = np.asarray(cf, dtype=np.float32)
+  packed = np.round((np.clip(cf, ADD_OFFSET, ADD_OFFSET + (FILL_VALUE - 1)*SCALE_FACTOR) - ADD_OFFSET)/SCALE_FACTOR)
+  return np.where(np.isnan(cf), FILL_VALUE, packed).astype(np.uint16)
+
+
+def decode_cf(packed, scale_factor=SCALE_FACTOR, add_offset=ADD_OFFSET):
+  """Unpack uint16 capacity factors to float32."""
+  packed = np.asarray(packed)
+  cf = (packed*np.float32(scale_factor) + np.float32(add_offset)).astype(np.float32)
+  cf[packed == FILL_VALUE] = np.nan
+  return cf
+
+
+def packing_attrs():
+  """Attributes that describe the packing, stored next to uint16 data."""
+  # float32 so readers decode to float32
+  return {'scale_factor': np.float32(SCALE_FACTOR), 'add_offset': np.float32(ADD_OFFSET),
+          '_FillValue': np.uint16(FILL_VALUE)}
+
+
+def netcdf_encoding(encoding='float32', complevel=1):
+  """xarray to_netcdf encoding of a capacity factor variable."""
+  if encoding == 'float32':
+    return {'dtype': 'float32'}
+  if encoding == 'uint16':
+    return {'dtype': 'uint16', **packing_attrs(), 'zlib': True, 'complevel': complevel, 'shuffle': True}
+  raise ValueError(f'Unknown encoding {encoding}, use one of {CF_ENCODINGS}')
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Process pool that recycles its workers.
+
+reV runs get slower and use more memory the longer a process lives. Instead
+of tearing down the whole pool every so often (which leaves cores idle while
+the last tasks of each round finish), each worker is replaced on its own once
+it has run a number of tasks, its memory (RSS) grows past a limit, or its
+recent tasks take much longer than its first ones. Tasks are scheduled
+continuously, one at a time per worker, so a slow or recycled worker never
+holds up the others.
+
+Large read-only inputs (the year of met data) are put in shared memory once
+with SharedArrays. Workers attach to them in their initializer, so tasks only
+need to carry indexes.
+"""
+
+import logging
+import multiprocessing
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# reV processes used to be restarted about every 330 sites, recycle workers
+# at least that often by default
+SITES_PER_WORKER = 300
+
+
+def tasks_per_worker(sites_per_task, sites_per_worker=SITES_PER_WORKER):
+  """Task limit for a RecyclingPool that recycles about every sites_per_worker sites."""
+  return max(1, int(sites_per_worker // max(sites_per_task, 1)))
+
+
+def _worker(worker_id, inbox, outbox, initializer, initargs,
+            max_tasks, max_rss_mb, max_slowdown, warmup_tasks):
+  if initializer is not None:
+    initializer(*initargs)
+  process = psutil.Process()
+  durations = []
+
+  while True:
+    item = inbox.get()
+    if item is None:
+      break
+    index, func, args, weight = item
+
+    start = time.perf_counter()
+    try:
+      ok, payload = True, func(*args)
+    except Exception:
+      ok, payload = False, traceback.format_exc()
+    # time per unit of work, so tasks of different sizes can be compared
+    durations.append((time.perf_counter() - start) / weight)
+
+    # decide if this worker should be replaced before taking another task
+    reason = None
+    rss_mb = process.memory_info().rss / 1e6
+    n = len(durations)
+    if max_tasks is not None and n >= max_tasks:
+      reason = f'ran {n} tasks'
+    elif max_rss_mb is not None and rss_mb > max_rss_mb:
+      reason = f'rss {rss_mb:.0f} MB > {max_rss_mb} MB'
+    elif max_slowdown is not None and n >= 2 * warmup_tasks:
+      baseline = sum(durations[:warmup_tasks]) / warmup_tasks
+      recent = sum(durations[-warmup_tasks:]) / warmup_tasks
+      if recent > max_slowdown * baseline:
+        reason = f'task time {recent:.2f}s > {max_slowdown} x {baseline:.2f}s'
+
+    outbox.put((worker_id, index, ok, payload, reason))
+    if reason is not None:
+      break
+
+
+class RecyclingPool:
+  """
+  Pool of worker processes that are replaced when they have run max_tasks
+  tasks, their RSS exceeds max_rss_mb, or the mean time of their last
+  warmup_tasks tasks is more than max_slowdown times the mean of their first
+  warmup_tasks tasks. Any limit set to None is not checked. When tasks do
+  different amounts of work (e.g. a cell with several plant configs),
+  task_weight(args) gives the amount for each task and task times are
+  divided by it before they are compared.
+
+  initializer(*initargs) is run in every worker when it starts, including
+  the replacements.
+
+  Usage:
+
+    with RecyclingPool(64, max_tasks=250) as pool:
+      for index, result in pool.imap_unordered(func, args_list):
+        ...
+  """
+
+  def __init__(
+      self,
+      processes,
+      initializer=None,
+      initargs=(),
+      max_tasks=None,
+      max_rss_mb=None,
+      max_slowdown=None,
+      warmup_tasks=5,
+      task_weight=None,
+      start_method='fork'
+  ):
+    self.processes = processes
+    self.initializer = initializer
+    self.initargs = initargs
+    self.max_tasks = max_tasks
+    self.max_rss_mb = max_rss_mb
+    self.max_slowdown = max_slowdown
+    self.warmup_tasks = warmup_tasks
+    self.task_weight = task_weight
+    self._ctx = multiprocessing.get_context(start_method)
+    self._outbox = self._ctx.Queue()
+    self._workers = {}
+    self._next_worker_id = 0
+    # (time, pid, reason) for every recycled worker
+    self.recycle_events = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def _start_worker(self):
+    worker_id = self._next_worker_id
+    self._next_worker_id += 1
+    inbox = self._ctx.Queue()
+    process = self._ctx.Process(
+        target=_worker,
+        args=(worker_id, inbox, self._outbox, self.initializer, self.initargs,
+              self.max_tasks, self.max_rss_mb, self.max_slowdown, self.warmup_tasks),
+        daemon=True)
+    process.start()
+    self._workers[worker_id] = (process, inbox)
+    return worker_id
+
+  def _recycle_worker(self, worker_id, reason):
+    process, _ = self._workers.pop(worker_id)
+    process.join()
+    self.recycle_events.append((time.time(), process.pid, reason))
+    logger.info(f'Recycled worker {process.pid}: {reason}')
+    return self._start_worker()
+
+  def imap_unordered(self, func, iterable):
+    """
+    Run func(*args) for every args tuple in iterable and yield
+    (index, result) as tasks finish, where index is the position of args in
+    iterable. Arguments are only taken from iterable when a worker is free.
+    """
+    tasks = enumerate(iterable)
+    exhausted = False
+    idle = [self._start_worker() for _ in range(self.processes - len(self._workers))]
+    idle += [w for w in self._workers if w not in idle]
+    running = {}
+
+    while True:
+      # hand out work to every idle worker
+      while idle and not exhausted:
+        try:
+          index, args = next(tasks)
+        except StopIteration:
+          exhausted = True
+          break
+        worker_id = idle.pop()
+        weight = 1 if self.task_weight is None else max(self.task_weight(args), 1)
+        self._workers[worker_id][1].put((index, func, args, weight))
+        running[worker_id] = index
+
+      if not running:
+        return
+
+      try:
+        worker_id, index, ok, payload, reason = self._outbox.get(timeout=5)
+      except queue.Empty:
+        for worker_id, index in running.items():
+          process = self._workers[worker_id][0]
+          if not process.is_alive():
+            raise RuntimeError(
+                f'Worker {process.pid} died with exit code {process.exitcode} '
+                f'while running task {index}')
+        continue
+
+      del running[worker_id]
+      if not ok:
+        raise RuntimeError(f'Task {index} failed in worker:\n{payload}')
+      if reason is not None:
+        worker_id = self._recycle_worker(worker_id, reason)
+      idle.append(worker_id)
+      yield index, payload
+
+  def map(self, func, iterable):
+    """Like imap_unordered but returns a list of results in input order."""
+    results = {}
+    for index, result in self.imap_unordered(func, iterable):
+      results[index] = result
+    return [results[k] for k in range(len(results))]
+
+  def close(self):
+    for process, inbox in self._workers.values():
+      if process.is_alive():
+        inbox.put(None)
+    for process, _ in self._workers.values():
+      process.join(timeout=10)
+      if process.is_alive():
+        process.terminate()
+    self._workers = {}
+    if self.recycle_events:
+      logger.info(f'{len(self.recycle_events)} workers recycled')
+
+
+
+class SharedArrays:
+  """
+  Copies of numpy arrays in shared memory. Create them in the parent, pass
+  spec to the workers (e.g. through the pool initargs) and get the arrays
+  back there with attach_shared(spec), without copying or pickling the data.
+
+  Usage:
+
+    with SharedArrays({'ghi': ghi}) as shared:
+      shared.add('dni', dni)
+      with RecyclingPool(64, initializer=init, initargs=(shared.spec,)) as pool:
+        ...
+  """
+
+  def __init__(self, arrays=None):
+    self._blocks = []
+    # name -> (shared memory name, shape, dtype)
+    self.spec = {}
+    for name, array in (arrays or {}).items():
+      self.add(name, array)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def add(self, name, array):
+    array = np.asarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    self._blocks.append(block)
+    self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+  def close(self):
+    for block in self._blocks:
+      block.close()
+      block.unlink()
+    self._blocks = []
+    self.spec = {}
+
+
+# shared memory blocks attached in this process, kept open for as long as
+# the process lives since the arrays are views of them
+_attached = []
+
+
+def attach_shared(spec):
+  """Arrays from the spec of a SharedArrays, as a dict of read-only views."""
+  arrays = {}
+  for name, (block_name, shape, dtype) in spec.items():
+    block = shared_memory.SharedMemory(name=block_name)
+    _attached.append(block)
+    arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+    arrays[name].flags.writeable = False
+  return arrays
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-year store of generation profiles, so the whole history of a plant (or
+grid cell) can be read without opening one file per year. Everything lives
+in one HDF5 file:
+
+  * cf: float32 (time, column), or uint16 packed as in utils.encoding,
+    chunked as a year of hours of one column so a column's history is one
+    small chunk per year
+  * datetime: int64 ns UTC of each row
+  * year, year_start: the years in the store and their first row
+  * plant_code_unique for points, or i and j (grid indexes) for grid cells
+
+Years are appended as they are run, in any order. Appends from several runs
+at once are serialized with a lock file next to the store.
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from utils.encoding import decode_cf, encode_cf, packing_attrs
+from utils.netcdf import _locked
+
+
+def _utc_ns(times):
+  times = pd.DatetimeIndex(times)
+  if times.tz is not None:
+    times = times.tz_convert('UTC').tz_localize(None)
+  return times.to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+
+class GenerationStore:
+  """
+  Generation profiles of a fixed set of columns (plants or grid cells) for
+  any number of years, in the HDF5 file fn. encoding is only used when the
+  store is created, later appends are stored the same way.
+  """
+
+  def __init__(self, fn, time_chunk=8760, column_chunk=1, encoding='float32'):
+    self.fn = fn
+    self.time_chunk = time_chunk
+    self.column_chunk = column_chunk
+    self.encoding = encoding
+
+  def _create(self, f, n_columns):
+    cf = f.create_dataset('cf', shape=(0, n_columns), maxshape=(None, n_columns),
+                          dtype=np.uint16 if self.encoding == 'uint16' else np.float32,
+                          chunks=(self.time_chunk, min(self.column_chunk, max(1, n_columns))),
+                          compression='gzip', compression_opts=1, shuffle=True)
+    if self.encoding == 'uint16':
+      cf.attrs.update(packing_attrs())
+    f.create_dataset('datetime', shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(self.time_chunk,))
+    f.create_dataset('year', shape=(0,), maxshape=(None,), dtype=np.int32, chunks=(64,))
+    f.create_dataset('year_start', shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(64,))
+
+  def _check(self, f, name, values):
+    if name not in f:
+      f.create_dataset(name, data=values)
+    elif not np.array_equal(f[name][:], values):
+      raise ValueError(f'{name} in {self.fn} does not match, use a new store for a different set of columns')
+
+  def append(self, year, cf, times, plant_codes=None, i=None, j=None):
+    """
+    Add a year of generation cf (time, column) at times, replacing it if
+    the year is already in the store. Columns are either plants, named by
+    plant_codes, or grid cells at grid indexes i and j.
+    """
+    year = int(year)
+    cf = np.asarray(cf, dtype=np.float32)
+    times = _utc_ns(times)
+    if len(times) != cf.shape[0]:
+      raise ValueError(f'{len(times)} times for {cf.shape[0]} rows of generation')
+    with _locked(self.fn), h5py.File(self.fn, 'a') as f:
+      if 'cf' not in f:
+        self._create(f, cf.shape[1])
+      if plant_codes is not None:
+        self._check(f, 'plant_code_unique', np.array([str(p) for p in plant_codes], dtype='S'))
+      else:
+        self._check(f, 'i', np.ravel(i).astype(np.int32))
+        self._check(f, 'j', np.ravel(j).astype(np.int32))
+      if f['cf'].shape[1] != cf.shape[1]:
+        raise ValueError(f'{self.fn} has {f["cf"].shape[1]} columns, the data has {cf.shape[1]}')
+
+      years = f['year'][:].tolist()
+      if year in years:
+        k = years.index(year)
+        t0 = f['year_start'][k]
+        t1 = f['year_start'][k + 1] if k + 1 < len(years) else f['cf'].shape[0]
+        if t1 - t0 != len(cf):
+          raise ValueError(f'{year} in {self.fn} has {t1 - t0} rows, the data has {len(cf)}')
+      else:
+        t0 = f['cf'].shape[0]
+        for name in ('cf', 'datetime'):
+          f[name].resize(t0 + len(cf), axis=0)
+        for name, value in (('year', year), ('year_start', t0)):
+          f[name].resize(len(years) + 1, axis=0)
+          f[name][-1] = value
+      f['cf'][t0:t0 + len(cf)] = encode_cf(cf) if f['cf'].dtype == np.uint16 else cf
+      f['datetime'][t0:t0 + len(cf)] = times
+
+  def append_profiles(self, year, gen):
+    """Add a year of points mode profiles, a DataFrame with one column per plant."""
+    self.append(year, gen.to_numpy(np.float32), gen.index, plant_codes=gen.columns)
+
+  def years(self):
+    if not os.path.exists(self.fn):
+      return []
+    with h5py.File(self.fn, 'r') as f:
+      return sorted(f['year'][:].tolist())
+
+  def _read(self, f, columns, start, end):
+    # rows in the date range, in time order
+    times = f['datetime'][:]
+    keep = np.ones(len(times), dtype=bool)
+    if start is not None:
+      keep &= times >= _utc_ns([start])[0]
+    if end is not None:
+      keep &= times < _utc_ns([end])[0]
+    rows = np.flatnonzero(keep)
+    rows = rows[np.argsort(times[rows], kind='stable')]
+    index = pd.DatetimeIndex(pd.to_datetime(times[rows], unit='ns', utc=True), name='datetime')
+    if len(rows) == 0:
+      return np.empty((0, len(columns)), dtype=np.float32), index
+
+    # h5py needs increasing indexes, read the span of rows and the unique
+    # columns in order, then put them back in the order asked for
+    unique, inverse = np.unique(columns, return_inverse=True)
+    r0, r1 = rows.min(), rows.max() + 1
+    if len(unique) == f['cf'].shape[1]:
+      data = f['cf'][r0:r1]
+    elif len(unique) == 1:
+      data = f['cf'][r0:r1, unique[0]:unique[0] + 1]
+    else:
+      data = f['cf'][r0:r1, unique]
+    data = data[rows - r0][:, inverse]
+    if 'scale_factor' in f['cf'].attrs:
+      data = decode_cf(data, f['cf'].attrs['scale_factor'], f['cf'].attrs['add_offset'])
+    return data, index
+
+  def read(self, plant_codes=None, start=None, end=None):
+    """
+    Generation of the plants in plant_codes (all of them by default) from
+    start up to end as a DataFrame, like utils.profiles.read_profiles.
+    """
+    with h5py.File(self.fn, 'r') as f:
+      stored = f['plant_code_unique'].asstr()[:].tolist()
+      names = stored if plant_codes is None else [str(p) for p in plant_codes]
+      position = {name: k for k, name in enumerate(stored)}
+      missing = [name for name in names if name not in position]
+      if missing:
+        raise KeyError(f'Plants {missing[:10]} are not in {self.fn}')
+      data, index = self._read(f, np.array([position[name] for name in names], dtype=np.intp), start, end)
+    return pd.DataFrame(data, index=index, columns=names)
+
+  def read_cells(self, i, j, start=None, end=None):
+    """
+    Generation of the grid cells at grid indexes i and j from start up to
+    end, as an xr.DataArray with dimensions (Time, cell).
+    """
+    with h5py.File(self.fn, 'r') as f:
+      flat = pd.Index(f['i'][:].astype(np.int64) << 32 | f['j'][:].astype(np.int64))
+      k = flat.get_indexer(np.ravel(i).astype(np.int64) << 32 | np.ravel(j).astype(np.int64))
+      if (k < 0).any():
+        raise KeyError(f'{(k < 0).sum()} of the cells are not in {self.fn}')
+      data, index = self._read(f, k, start, end)
+    return xr.DataArray(data, dims=('Time', 'cell'), name='capacity_factor',
+                        coords={'Time': index.tz_localize(None).rename('Time'), 'i': ('cell', np.ravel(i)),
+                                'j': ('cell', np.ravel(j))})
@@ -5,6 +5,18 @@ Created on Feb 10 08:46:43 2023
 @author: Cameron Bracken (cameron.bracken@pnnl.gov)
 """
 
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# plant config columns that describe the plant but are not model inputs
+PLANT_METADATA_KEYS = ('plant_code', 'plant_code_unique', 'plant_name', 'generator_id',
+                       'state', 'county', 'ba', 'nerc_region', 'component_capacity_mw',
+                       'lat', 'lon')
+
 
 def dedup_names(names):
   # stolen from an old version of pandas
@@ -23,3 +35,100 @@ def dedup_names(names):
     counts[col] = cur_count + 1
 
   return names
+
+
+def tolerance_report(reference, test, names=None):
+  """
+  Summarize the differences between two sets of capacity factor profiles
+  with dimensions (time, sites). Returns one row per site and a final row
+  over all sites.
+  """
+  reference = np.asarray(reference, dtype='float')
+  test = np.asarray(test, dtype='float')
+  if names is None:
+    names = list(range(reference.shape[1]))
+
+  def stats(r, t):
+    diff = t - r
+    return {'mean_cf_reference': r.mean(),
+            'mean_cf_test': t.mean(),
+            'bias': diff.mean(),
+            'mae': np.abs(diff).mean(),
+            'rmse': np.sqrt((diff**2).mean()),
+            'max_abs_diff': np.abs(diff).max(),
+            'correlation': np.corrcoef(r.ravel(), t.ravel())[0, 1]}
+
+  report = pd.DataFrame([stats(reference[:, k], test[:, k]) for k in range(reference.shape[1])],
+                        index=names)
+  report.loc['all'] = stats(reference, test)
+  return report
+
+
+def _json_default(x):
+  if isinstance(x, np.generic):
+    return x.item()
+  if isinstance(x, np.ndarray):
+    return x.tolist()
+  raise TypeError(f'{type(x)} is not JSON serializable')
+
+
+def simulation_key(i, j, config):
+  """
+  Content hash of a (grid cell, config) pair. Plant metadata columns are
+  dropped and the keys are sorted so that plants with the same model inputs
+  at the same cell get the same key.
+  """
+  canonical = {k: v for k, v in config.items() if k not in PLANT_METADATA_KEYS}
+  payload = json.dumps([int(i), int(j), canonical], sort_keys=True, default=_json_default)
+  return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def dedup_simulations(indexi, indexj, configs):
+  """
+  Find the distinct (grid cell, config) pairs among a set of plants.
+
+  Returns the plant index of one representative for each distinct pair and,
+  for every plant, the position of its pair in that list, so results for the
+  representatives can be fanned back out with results[inverse].
+  """
+  memo = {}
+  unique = []
+  inverse = np.empty(len(indexi), dtype=int)
+  for p, (i, j) in enumerate(zip(indexi, indexj)):
+    key = simulation_key(i, j, configs[p])
+    if key not in memo:
+      memo[key] = len(unique)
+      unique.append(p)
+    inverse[p] = memo[key]
+  return np.array(unique, dtype=int), inverse
+
+
+def group_by_cell(indexi, indexj, plants):
+  """
+  Group plants by the grid cell they map to. Returns a list of
+  ((i, j), [plant indexes]) in order of first appearance.
+  """
+  groups = {}
+  for p in plants:
+    groups.setdefault((int(indexi[p]), int(indexj[p])), []).append(int(p))
+  return list(groups.items())
+
+
+def cell_selector(cells=None):
+  """
+  Function that returns the data of a DataArray (or array) with the grid
+  dimensions last as a numpy array, either whole or, with cells a pair of
+  grid index arrays i and j, just those cells as a grid with one row.
+  """
+  if cells is None:
+    return lambda x: np.asarray(x)
+  i, j = (np.asarray(k) for k in cells)
+
+  def select(x):
+    if isinstance(x, xr.DataArray):
+      x = x.isel(south_north=xr.DataArray(i, dims='cell'),
+                 west_east=xr.DataArray(j, dims='cell')).to_numpy()
+    else:
+      x = np.asarray(x)[..., i, j]
+    return x[..., np.newaxis, :]
+  return select
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for the netCDF layout of the yearly met and generation files.
+"""
+
+import fcntl
+import itertools
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
+
+SPATIAL_DIMS = ('south_north', 'west_east')
+
+
+def time_chunked_encoding(ds, tile=16, time_chunk=None):
+  """
+  netCDF encoding that stores every data variable of ds in chunks that hold
+  the whole time series (or time_chunk steps) of a tile x tile block of grid
+  cells (tile x tile cells for data stored on a cell dimension), and one
+  level of any other dimension. Reading the full series of
+  one cell or one tile then only touches a handful of chunks, instead of
+  every time step of the default layout.
+
+  Parameters
+  ----------
+  ds : xr.Dataset
+      Dataset that will be written with to_netcdf.
+  tile : int
+      Size of the chunks in the south_north and west_east dimensions.
+  time_chunk : int
+      Size of the chunks in the Time dimension, defaults to the whole year.
+      Can only be larger than Time if Time is unlimited.
+
+  Returns
+  -------
+  dict
+      Encoding to pass to to_netcdf, e.g.
+      ds.to_netcdf(fn, encoding=time_chunked_encoding(ds)).
+  """
+  encoding = {}
+  for name, var in ds.data_vars.items():
+    if 'Time' not in var.dims:
+      continue
+    chunks = []
+    for dim, size in zip(var.dims, var.shape):
+      if dim == 'Time':
+        chunks.append(size if time_chunk is None else time_chunk)
+      elif dim in SPATIAL_DIMS:
+        chunks.append(min(tile, size))
+      elif dim == 'cell':
+        chunks.append(min(tile * tile, size))
+      else:
+        chunks.append(1)
+    encoding[name] = {'chunksizes': tuple(chunks), 'contiguous': False}
+  return encoding
+
+
+def spatial_tiles(dims, shape, tile=16):
+  """
+  Index tuples of the tile x tile blocks of grid cells (tile * tile cells
+  for a cell dimension) that cover an array with spatial dims and shape,
+  e.g. the dimensions after Time of a netCDF variable.
+  """
+  sizes = [tile * tile if dim == 'cell' else tile for dim in dims]
+  starts = [range(0, n, size) for n, size in zip(shape, sizes)]
+  for start in itertools.product(*starts):
+    yield tuple(slice(k, min(k + size, n)) for k, size, n in zip(start, sizes, shape))
+
+
+def create_time_store(fn, template, time_axis, encoding=None):
+  """
+  Create a netCDF file for a whole year from a template dataset, without
+  writing any data. The file has the variables, coordinates and attributes
+  of template and an unlimited Time dimension set to time_axis. Variables
+  without a Time dimension are written as is, the others are filled in later
+  with write_time_region.
+
+  Parameters
+  ----------
+  fn : str
+      Output file name.
+  template : xr.Dataset
+      Dataset with the same variables as the final file, only the metadata
+      is used so it can hold a single time step.
+  time_axis : np.ndarray
+      Values of the Time coordinate for the whole year, in the type that
+      Time has in template.
+  encoding : dict
+      netCDF encoding for to_netcdf, e.g. from time_chunked_encoding.
+  """
+  template.isel(Time=slice(0, 0)).to_netcdf(fn, unlimited_dims=['Time'], encoding=encoding)
+  with Dataset(fn, 'a') as nc:
+    nc['Time'][:] = np.asarray(time_axis)
+
+
+@contextmanager
+def _locked(fn):
+  # netCDF/HDF5 files can't be written by more than one process at a time
+  with open(f'{fn}.lock', 'w') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_time_region(fn, ds, t0):
+  """
+  Write the data variables of ds that have a Time dimension into the file fn
+  created by create_time_store, starting at time step t0. Safe to call from several
+  processes at once, writes are serialized with a lock file next to fn.
+  """
+  n = ds.sizes['Time']
+  with _locked(fn), Dataset(fn, 'a') as nc:
+    for name, var in ds.data_vars.items():
+      if 'Time' not in var.dims:
+        continue
+      dims = nc[name].dimensions
+      nc[name][t0:t0 + n] = var.transpose(*dims).to_numpy()
+
+
+def rechunk_time(fn, time_chunk):
+  """
+  Rewrite fn with chunks of time_chunk steps along Time, keeping the other
+  chunk sizes, compression and metadata. Data is copied one chunk of the
+  other dimensions at a time so only that much is ever in memory.
+  """
+  tmp_fn = f'{fn}.rechunk.tmp'
+  with Dataset(fn) as src, Dataset(tmp_fn, 'w', format=src.data_model) as dst:
+    src.set_auto_maskandscale(False)
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+    for name, dim in src.dimensions.items():
+      dst.createDimension(name, None if dim.isunlimited() else len(dim))
+    n_time = len(src.dimensions['Time'])
+    for name, var in src.variables.items():
+      chunks = var.chunking()
+      if chunks != 'contiguous' and 'Time' in var.dimensions:
+        chunks = [min(time_chunk, n_time) if dim == 'Time' else c for dim, c in zip(var.dimensions, chunks)]
+      filters = var.filters() or {}
+      out = dst.createVariable(name, var.datatype, var.dimensions,
+                               fill_value=var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None,
+                               contiguous=chunks == 'contiguous',
+                               chunksizes=None if chunks == 'contiguous' else chunks,
+                               zlib=filters.get('zlib', False), complevel=filters.get('complevel', 4),
+                               shuffle=filters.get('shuffle', False))
+      out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'})
+      out.set_auto_maskandscale(False)
+      if var.ndim < 2 or var.dimensions[0] != 'Time':
+        out[:] = var[:]
+        continue
+      steps = [range(0, n, c) for n, c in zip(var.shape[1:], chunks[1:])]
+      for start in itertools.product(*steps):
+        index = (slice(None),) + tuple(slice(k, k + c) for k, c in zip(start, chunks[1:]))
+        out[index] = var[index]
+  os.replace(tmp_fn, fn)
+
+
+def finish_time_store(fn, time_chunk=None):
+  """
+  Clean up after all the regions of fn have been written. The regions are
+  written to chunks about one region long, since rewriting a chunk that
+  holds the whole year for every region would decompress and write it
+  again each time. With time_chunk the file is rechunked once at the end,
+  e.g. to whole year chunks for fast reads of a cell's full series.
+  """
+  if time_chunk is not None:
+    rechunk_time(fn, time_chunk)
+  # only set once every region is written, see time_store_status
+  with Dataset(fn, 'a') as nc:
+    nc.setncattr('time_store_complete', 1)
+  Path(f'{fn}.lock').unlink(missing_ok=True)
+
+
+def time_store_status(fn):
+  """
+  'complete' if fn was finished by finish_time_store, 'partial' if it can be
+  opened but isn't finished (regions can still be written to it), or None if
+  it is missing or can't be read, e.g. it was killed while being created.
+  """
+  try:
+    with Dataset(fn) as nc:
+      return 'complete' if 'time_store_complete' in nc.ncattrs() else 'partial'
+  except OSError:
+    return None
+
+
+def assign_time_regions(times_by_file):
+  """
+  Split the time axis of a year between files whose time steps overlap.
+  Each time step goes to the first file that has it, the same result as
+  concatenating the files in order and dropping duplicate times.
+
+  Parameters
+  ----------
+  times_by_file : list
+      pd.DatetimeIndex of the time steps in each file, in file order.
+
+  Returns
+  -------
+  tuple
+      The time axis for the year and a list with, for each file, the time
+      steps that file writes and the index of the first one in the axis.
+  """
+  axis = pd.DatetimeIndex([])
+  regions = []
+  for times in times_by_file:
+    times = pd.DatetimeIndex(times)
+    own = times[~times.isin(axis)]
+    regions.append((own, len(axis)))
+    axis = axis.append(own)
+  return axis, regions
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Read and write the points mode generation profiles, a DataFrame with a UTC
+datetime index and one column per plant (plant_code_unique). Besides csv
+they can be stored as
+
+  * parquet: float32, zstd compressed, needs pyarrow
+  * h5: float32 (time, plant) dataset 'cf' in chunks of all times for a block
+    of plants, with 'datetime' (int64 ns UTC) and 'plant_code_unique'
+
+Both are much smaller and faster to read than csv. With encoding='uint16'
+the capacity factors are packed as in utils.encoding, read_profiles unpacks
+them.
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from utils.encoding import decode_cf, encode_cf, packing_attrs
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'h5')
+
+
+def check_output_format(output_format):
+  """
+  Raise if output_format is unknown or needs a package that isn't
+  installed, so a run can fail before the year is simulated.
+  """
+  if output_format not in OUTPUT_FORMATS:
+    raise ValueError(f'Unknown output format {output_format}, use one of {OUTPUT_FORMATS}')
+  if output_format == 'parquet':
+    try:
+      import pyarrow  # noqa: F401
+    except ImportError:
+      raise ImportError('The parquet format needs pyarrow, install it with pip install pyarrow '
+                        '(it is in requirements.txt) or use --output-format csv or h5') from None
+
+
+def write_profiles(gen, fn_base, output_format='csv', encoding='float32'):
+  """
+  Write gen to fn_base plus the extension of output_format, returns the file
+  name. encoding only applies to the binary formats. The file is written
+  under a temporary name and moved into place, so a killed job never leaves
+  a truncated file behind.
+  """
+  fn = f'{fn_base}.{output_format}'
+  tmp_fn = f'{fn}.tmp'
+  packed = encoding == 'uint16'
+  if output_format == 'csv':
+    (gen.reset_index()
+        .rename({'index': 'datetime'}, axis=1)
+        .to_csv(tmp_fn, index=False))
+  elif output_format == 'parquet':
+    check_output_format(output_format)
+    out = pd.DataFrame(encode_cf(gen) if packed else gen.to_numpy(np.float32),
+                       index=gen.index.rename('datetime'), columns=gen.columns.astype(str))
+    if packed:
+      # kept in the pandas metadata of the file
+      out.attrs = {k: float(v) for k, v in packing_attrs().items()}
+    out.to_parquet(tmp_fn, compression='zstd')
+  elif output_format == 'h5':
+    times = pd.DatetimeIndex(gen.index)
+    if times.tz is not None:
+      times = times.tz_convert('UTC').tz_localize(None)
+    with h5py.File(tmp_fn, 'w') as f:
+      cf = f.create_dataset('cf', data=encode_cf(gen) if packed else gen.to_numpy(np.float32),
+                            compression='gzip', shuffle=packed,
+                            chunks=(len(gen), min(64, gen.shape[1])) if gen.size else None)
+      if packed:
+        cf.attrs.update(packing_attrs())
+      f.create_dataset('datetime', data=times.to_numpy().astype('datetime64[ns]').astype(np.int64))
+      f.create_dataset('plant_code_unique', data=np.array(gen.columns.astype(str), dtype='S'))
+  else:
+    raise ValueError(f'Unknown output format {output_format}, use one of {OUTPUT_FORMATS}')
+  os.replace(tmp_fn, fn)
+  return fn
+
+
+def find_profiles(fn_base):
+  """File name of the profiles written to fn_base in any of OUTPUT_FORMATS."""
+  for output_format in OUTPUT_FORMATS:
+    fn = f'{fn_base}.{output_format}'
+    if os.path.exists(fn):
+      return fn
+  raise FileNotFoundError(f'No generation profiles {fn_base}.{{{",".join(OUTPUT_FORMATS)}}}')
+
+
+def profiles_encoding(fn):
+  """Encoding of the profiles in fn, 'uint16' if write_profiles packed them."""
+  output_format = os.path.splitext(fn)[1][1:]
+  if output_format == 'parquet':
+    check_output_format(output_format)
+    import pyarrow.parquet as pq
+    # the packing attributes are kept in the pandas metadata
+    attrs = (pq.read_schema(fn).metadata or {}).get(b'PANDAS_ATTRS', b'')
+    return 'uint16' if b'scale_factor' in attrs else 'float32'
+  if output_format == 'h5':
+    with h5py.File(fn, 'r') as f:
+      return 'uint16' if 'scale_factor' in f['cf'].attrs else 'float32'
+  return 'float32'
+
+
+def read_profiles(fn, columns=None):
+  """
+  Read generation profiles written by write_profiles (format from the file
+  extension), optionally only the plants in columns.
+  """
+  output_format = os.path.splitext(fn)[1][1:]
+  names = None if columns is None else list(dict.fromkeys(str(c) for c in columns))
+  if output_format == 'csv':
+    gen = pd.read_csv(fn, index_col='datetime', parse_dates=True,
+                      usecols=None if names is None else ['datetime'] + names)
+  elif output_format == 'parquet':
+    check_output_format(output_format)
+    gen = pd.read_parquet(fn, columns=names)
+    if 'scale_factor' in gen.attrs:
+      gen = pd.DataFrame(decode_cf(gen, gen.attrs['scale_factor'], gen.attrs['add_offset']),
+                         index=gen.index, columns=gen.columns)
+  elif output_format == 'h5':
+    with h5py.File(fn, 'r') as f:
+      index = pd.DatetimeIndex(pd.to_datetime(f['datetime'][:], unit='ns', utc=True), name='datetime')
+      stored = f['plant_code_unique'].asstr()[:].tolist()
+      if names is None:
+        k = slice(None)
+        stored_names = stored
+      else:
+        # h5py needs increasing indexes
+        position = {name: i for i, name in enumerate(stored)}
+        k = np.sort([position[name] for name in names])
+        stored_names = [stored[i] for i in k]
+      cf = f['cf'][:, k]
+      if 'scale_factor' in f['cf'].attrs:
+        cf = decode_cf(cf, f['cf'].attrs['scale_factor'], f['cf'].attrs['add_offset'])
+      gen = pd.DataFrame(cf, index=index, columns=stored_names)
+  else:
+    raise ValueError(f'Unknown generation profile format {fn}')
+  if columns is not None:
+    gen = gen[[str(c) for c in columns]]
+  return gen
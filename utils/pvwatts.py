@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized NumPy implementation of the PVWatts v5 model for computing
+capacity factors on every cell of a grid in one pass.
+
+This follows the SAM PVWatts v5 model (Dobos 2014, PVWatts Version 5 Manual)
+as it is run by reV:
+
+  * sun position at the middle of each hour
+  * Perez 1990 transposition to the plane of array for fixed (array_type 0
+    and 1), 1-axis (2), 1-axis backtracking (3) and 2-axis (4) arrays
+  * row to row self shading of 1-axis arrays without backtracking, on the
+    beam (shaded fraction of the module) and the sky diffuse (view of the
+    sky blocked by the next row)
+  * glass cover transmittance from the Fresnel equations
+  * Fuentes (1987) transient cell temperature model
+  * PVWatts DC model, system losses, and the PVWatts inverter part load
+    efficiency curve with clipping at the AC rating (DC/AC ratio)
+
+The result is not bit for bit identical to SAM, use the validation option in
+rev_solar.py to check the differences against the reV engine.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.sza import solar_position_grid
+
+# SAM always runs a 365 day hourly year
+N_HOURS = 8760
+
+# temperature coefficient of power by module_type (standard, premium, thin film)
+GAMMA = {0: -0.0047, 1: -0.0035, 2: -0.0020}
+
+# perez 1990 coefficients as used by SAM, one row per sky clearness bin
+EPSBINS = np.array([1.065, 1.23, 1.5, 1.95, 2.8, 4.5, 6.2])
+F11 = np.array([-0.0083117, 0.1299457, 0.3296958, 0.5682053,
+                0.8730280, 1.1326077, 1.0601591, 0.6777470])
+F12 = np.array([0.5877285, 0.6825954, 0.4868735, 0.1874525,
+                -0.3920403, -1.2367284, -1.5999137, -0.3272588])
+F13 = np.array([-0.0620636, -0.1513725, -0.2210958, -0.2951290,
+                -0.3616149, -0.4118494, -0.3589221, -0.2504286])
+F21 = np.array([-0.0596012, -0.0189325, 0.0554140, 0.1088631,
+                0.2255647, 0.2877813, 0.2642124, 0.1561313])
+F22 = np.array([0.0721249, 0.0659650, -0.0639588, -0.1519229,
+                -0.4620442, -0.8230357, -1.1272340, -1.3765031])
+F23 = np.array([-0.0220216, -0.0288748, -0.0260542, -0.0139754,
+                0.0012448, 0.0558651, 0.1310694, 0.2506212])
+
+# module cover
+N_AIR = 1.0
+N_GLASS = 1.526
+K_GLASS = 4.0
+L_GLASS = 0.002
+N_AR = 1.3
+K_AR = 4.0
+L_AR = L_GLASS * 0.01
+AOI_MIN = 0.5
+AOI_MAX = 89.5
+
+# tracker rotation limit in degrees
+ROTATION_LIMIT = 45.0
+
+ALBEDO = 0.2
+
+
+def solar_position(time_index, lat, lon, offset_minutes=30, geometry=None, cells=None):
+  """
+  Solar zenith and azimuth (degrees) with dimensions (time, cells) for a
+  DatetimeIndex and 1-D arrays of cell latitude and longitude. SAM computes
+  the sun position at the middle of the hour for hourly data. With a
+  utils.solar_geometry.SolarGeometryCache the position is read from the
+  cache for the cells at grid indexes cells = (i, j) instead.
+  """
+  times = pd.DatetimeIndex(time_index) + pd.Timedelta(minutes=offset_minutes)
+  if geometry is not None:
+    return geometry.lookup(times, *cells, offset_minutes=offset_minutes)
+  return solar_position_grid(longitude=lon, latitude=lat, time_utc=times)
+
+
+def _transmittance(theta1, n_cover, n_incoming, k, l):
+  theta2 = np.arcsin(n_incoming / n_cover * np.sin(theta1))
+  # fresnel's equation for non-reflected unpolarized radiation
+  tr = 1 - 0.5 * (np.sin(theta2 - theta1)**2 / np.sin(theta2 + theta1)**2
+                  + np.tan(theta2 - theta1)**2 / np.tan(theta2 + theta1)**2)
+  # transmittance of cover due to absorption
+  return tr * np.exp(-k * l / np.cos(theta2)), theta2
+
+
+def _iam_nonorm(aoi, ar_glass):
+  theta = np.radians(np.clip(aoi, AOI_MIN, AOI_MAX))
+  if ar_glass:
+    tau_coating, theta2 = _transmittance(theta, N_AR, N_AIR, K_AR, L_AR)
+    tau_glass, _ = _transmittance(theta2, N_GLASS, N_AR, K_GLASS, L_GLASS)
+    return tau_coating * tau_glass
+  return _transmittance(theta, N_GLASS, N_AIR, K_GLASS, L_GLASS)[0]
+
+
+def iam(aoi, ar_glass=False):
+  """Incidence angle modifier of the module cover, normalized to normal incidence."""
+  return _iam_nonorm(aoi, ar_glass) / _iam_nonorm(0.0, ar_glass)
+
+
+def surface_orientation(zenith, azimuth, array_type, tilt, surface_azimuth, gcr=0.4):
+  """
+  Cosine of the angle of incidence, the surface tilt (degrees) and the
+  fraction of the module shaded by the next row of the array for each time
+  and cell. Only 1-axis arrays without backtracking shade themselves.
+  """
+  z = np.radians(zenith)
+  sun_e = np.sin(z) * np.sin(np.radians(azimuth))
+  sun_n = np.sin(z) * np.cos(np.radians(azimuth))
+  sun_u = np.cos(z)
+
+  if array_type == 4:
+    # 2-axis tracking always faces the sun
+    return np.ones_like(z), np.clip(zenith, 0, 90), np.zeros_like(z)
+
+  beta = np.radians(tilt)
+  gamma = np.radians(surface_azimuth)
+  # normal of the array at zero rotation
+  n0_e = np.sin(beta) * np.sin(gamma)
+  n0_n = np.sin(beta) * np.cos(gamma)
+  n0_u = np.cos(beta)
+  cos_aoi0 = sun_e * n0_e + sun_n * n0_n + sun_u * n0_u
+
+  if array_type in (0, 1):
+    return cos_aoi0, np.broadcast_to(tilt, np.shape(z)), np.zeros_like(z)
+
+  # 1-axis tracking, rotation about the axis with positive rotation toward
+  # the west
+  sun_w = sun_e * np.cos(gamma) - sun_n * np.sin(gamma)
+  rotation = np.arctan2(sun_w, cos_aoi0)
+  true_tracking = rotation
+  if array_type == 3:
+    # backtracking to avoid row to row shading
+    with np.errstate(invalid='ignore'):
+      temp = np.abs(np.cos(rotation)) / gcr
+      backtrack = np.where(temp < 1, np.arccos(np.minimum(temp, 1)), 0)
+    rotation = rotation - np.sign(rotation) * backtrack
+  limit = np.radians(ROTATION_LIMIT)
+  rotation = np.clip(rotation, -limit, limit)
+
+  cos_aoi = np.cos(rotation) * cos_aoi0 + np.sin(rotation) * sun_w
+  surface_tilt = np.degrees(np.arccos(np.clip(np.cos(rotation) * np.cos(beta), -1, 1)))
+
+  shaded = np.zeros_like(z)
+  if array_type == 2:
+    # in the plane across the axis the next row is 1/gcr module widths
+    # away, its shadow covers the module once the sun is low enough
+    with np.errstate(divide='ignore', invalid='ignore'):
+      shaded = 1 - np.cos(true_tracking) / (gcr * np.cos(true_tracking - rotation))
+    shaded = np.clip(np.nan_to_num(shaded), 0, 1)
+  return cos_aoi, surface_tilt, shaded
+
+
+def sky_view_derate(surface_tilt, gcr=0.4, nsteps=200):
+  """
+  Fraction of the isotropic sky diffuse that reaches a module with the next
+  row of the array in front of it, averaged over the module width as in
+  SAM's diffuse_reduce. Depends only on the tilt, so it is tabulated once
+  per degree and interpolated.
+  """
+  tilts = np.radians(np.arange(1, 91, dtype='float'))
+  position = (np.arange(nsteps) + 0.5) / nsteps
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # elevation of the top of the next row seen from each point of the module
+    arg = 1 / np.tan(tilts[:, np.newaxis]) - 1 / (gcr * np.sin(tilts[:, np.newaxis]) * (1 - position))
+    mask = -np.pi / 2 + np.arctan(arg)
+    shaded = np.pi + np.pi / np.sqrt(1 + np.tan(tilts[:, np.newaxis] + mask)**2)
+  open_sky = np.pi + np.pi / np.sqrt(1 + np.tan(tilts)**2)
+  derate = np.clip(np.nan_to_num(shaded.mean(axis=1) / open_sky, nan=1.0), 0, 1)
+  return np.interp(surface_tilt, np.r_[0, np.degrees(tilts)], np.r_[1, derate])
+
+
+def perez(ghi, dni, zenith, cos_aoi, surface_tilt, doy):
+  """
+  Plane of array irradiance (beam, sky diffuse, ground reflected) from the
+  Perez 1990 model as implemented in SAM.
+  """
+  z = np.radians(zenith)
+  cos_z = np.cos(z)
+  dhi = np.maximum(ghi - dni * np.maximum(cos_z, 0), 0)
+
+  # extraterrestrial normal irradiance
+  i0 = 1367.0 * (1 + 0.033 * np.cos(2 * np.pi * doy / 365.0))
+
+  with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+    air_mass = 1.0 / (cos_z + 0.15 * np.power(np.maximum(93.9 - zenith, 1e-6), -1.253))
+    delta = dhi * air_mass / i0
+    kz = 5.535e-6 * zenith**3
+    eps = ((dhi + dni) / dhi + kz) / (1 + kz)
+  eps = np.nan_to_num(eps, nan=1.0, posinf=EPSBINS[-1] + 1)
+  delta = np.nan_to_num(delta)
+  b = np.digitize(eps, EPSBINS)
+
+  f1 = np.maximum(0, F11[b] + F12[b] * delta + F13[b] * z)
+  f2 = F21[b] + F22[b] * delta + F23[b] * z
+
+  a = np.maximum(0, cos_aoi)
+  c = np.maximum(np.cos(np.radians(85)), cos_z)
+  tilt = np.radians(surface_tilt)
+  sky = dhi * ((1 - f1) * (1 + np.cos(tilt)) / 2 + f1 * a / c + f2 * np.sin(tilt))
+  sky = np.where(dhi > 0, np.maximum(sky, 0), 0)
+
+  beam = dni * a
+  ground = ghi * ALBEDO * (1 - np.cos(tilt)) / 2
+  return beam, sky, ground
+
+
+def _fuentes_hconv(tave, windmod, temp_delta, xlen, tilt, check_reynold):
+  densair = 0.003484 * 101325.0 / tave
+  visair = 0.24237e-6 * tave**0.76 / densair
+  condair = 2.1695e-4 * tave**0.84
+  reynold = windmod * xlen / visair
+  laminar = 0.8600 / reynold**0.5 * densair * windmod * 1007 / 0.71**0.67
+  if check_reynold:
+    # turbulent above Re = 1.2e5
+    turbulent = 0.0282 / reynold**0.2 * densair * windmod * 1007 / 0.71**0.4
+    hforce = np.where(reynold > 1.2e5, turbulent, laminar)
+  else:
+    hforce = laminar
+  grashof = 9.8 / tave * temp_delta * xlen**3 / visair**2 * np.sin(np.radians(tilt))
+  hfree = 0.21 * (grashof * 0.71)**0.32 * condair / xlen
+  return (hfree**3 + hforce**3)**(1 / 3)
+
+
+class FuentesCellTemperature:
+  """
+  Fuentes (1987) transient cell temperature model used by PVWatts v5, stepped
+  one hour at a time for every cell at once. Holds the module temperature
+  between calls so the year can be processed in blocks.
+  """
+
+  boltz = 5.669e-8
+  emiss = 0.84
+  absorp = 0.83
+  cap0 = 11000
+  module_height = 5.0
+  wind_height = 9.144
+  tilt = 30.0
+  xlen = 2 * (0.31579 * 1.2) / (0.31579 + 1.2)
+
+  def __init__(self, ncells, inoct=45.0):
+    tinoct = inoct + 273.15
+    self.tinoct = tinoct
+
+    # convective coefficient of top surface of module at NOCT
+    tave = (tinoct + 293.15) / 2
+    hconv = _fuentes_hconv(tave, 1.0, tinoct - 293.15, self.xlen, self.tilt, False)
+
+    # ground temperature ratio and ratio of total to top side convection
+    hground = self.emiss * self.boltz * (tinoct**2 + 293.15**2) * (tinoct + 293.15)
+    backrat = ((self.absorp * 800.0
+                - self.emiss * self.boltz * (tinoct**4 - 282.21**4)
+                - hconv * (tinoct - 293.15))
+               / ((hground + hconv) * (tinoct - 293.15)))
+    tground = (tinoct**4 - backrat * (tinoct**4 - 293.15**4))**0.25
+    tground = np.clip(tground, 293.15, tinoct)
+    self.tgrat = (tground - 293.15) / (tinoct - 293.15)
+    self.convrat = ((self.absorp * 800 - self.emiss * self.boltz
+                     * (2 * tinoct**4 - 282.21**4 - tground**4))
+                    / (hconv * (tinoct - 293.15)))
+
+    # high inoct implies coupling with the racking, more thermal mass
+    self.cap = self.cap0
+    if tinoct > 321.15:
+      self.cap = self.cap * (1 + (tinoct - 321.15) / 12)
+
+    self.tmod0 = np.full(ncells, 293.15)
+    self.sun0 = np.zeros(ncells)
+
+  def step(self, poa, temp_air, wind_speed, dtime=1.0):
+    """Cell temperature (C) for the next hour."""
+    tamb = temp_air + 273.15
+    sun = poa * self.absorp
+    windmod = wind_speed * (self.module_height / self.wind_height)**0.2 + 1e-4
+    tsky = 0.68 * (0.0552 * tamb**1.5) + 0.32 * tamb
+
+    tmod0 = self.tmod0
+    sun0 = self.sun0
+    tmod = tmod0
+    # heat loss terms depend on tmod so iterate
+    for _ in range(10):
+      tave = (tmod + tamb) / 2
+      hconv = self.convrat * _fuentes_hconv(tave, windmod, np.abs(tmod - tamb),
+                                            self.xlen, self.tilt, True)
+      hsky = self.emiss * self.boltz * (tmod**2 + tamb**2) * (tmod + tamb)
+      tground = tamb + self.tgrat * (tmod - tamb)
+      hground = self.emiss * self.boltz * (tmod**2 + tground**2) * (tmod + tground)
+      eigen = -(hconv + hsky + hground) / self.cap * dtime * 3600
+      ex = np.where(eigen > -10, np.exp(np.maximum(eigen, -10)), 0)
+      tmod = (tmod0 * ex
+              + ((1 - ex) * (hconv * tamb + hsky * tsky + hground * tground
+                             + sun0 + (sun - sun0) / eigen)
+                 + sun - sun0)
+              / (hconv + hsky + hground))
+
+    self.tmod0 = tmod
+    self.sun0 = sun
+    return tmod - 273.15
+
+
+def inverter(dc, pac0, inv_eff):
+  """PVWatts part load inverter efficiency with clipping at the AC rating."""
+  eta_nom = inv_eff / 100.0
+  eta_ref = 0.9637
+  pdc0_inv = pac0 / eta_nom
+  with np.errstate(divide='ignore', invalid='ignore'):
+    zeta = dc / pdc0_inv
+    eta = eta_nom / eta_ref * (-0.0162 * zeta - 0.0059 / zeta + 0.9858)
+    ac = np.where(dc > 0, dc * eta, 0)
+  return np.clip(ac, 0, pac0)
+
+
+def pvwattsv5(
+    ghi,
+    dni,
+    air_temperature,
+    wind_speed,
+    time_index,
+    lat,
+    lon,
+    config,
+    block_size=168,
+    geometry=None,
+    cells=None,
+):
+  """
+  Hourly capacity factor from PVWatts v5 for every cell of a grid.
+
+  Parameters
+  ----------
+  ghi, dni : np.ndarray
+      Irradiance in W/m2 with dimensions (time, ...).
+  air_temperature : np.ndarray
+      Air temperature in C with dimensions (time, ...).
+  wind_speed : np.ndarray
+      Wind speed in m/s with dimensions (time, ...).
+  time_index : pd.DatetimeIndex
+      UTC time of each step.
+  lat, lon : np.ndarray
+      Cell coordinates with the trailing dimensions of the met data.
+  config : dict
+      reV/SAM pvwattsv5 config, e.g. sam/solar_default_config.json.
+  block_size : int
+      Number of hours computed at once, bounds the size of temporary arrays.
+  geometry : utils.solar_geometry.SolarGeometryCache
+      Optional cache to read the sun position from.
+  cells : tuple
+      Grid indexes (i, j) of the cells, shaped like lat, to use with geometry.
+
+  Returns
+  -------
+  np.ndarray
+      float32 capacity factor with dimensions (8760, ...). Like reV, only the
+      first 365 days are kept.
+  """
+  grid_shape = np.shape(lat)
+  lat = np.asarray(lat, dtype='float').ravel()
+  lon = np.asarray(lon, dtype='float').ravel()
+  ncells = lat.size
+  if cells is not None:
+    cells = tuple(np.asarray(x).ravel() for x in cells)
+  nt = min(N_HOURS, len(time_index))
+  time_index = pd.DatetimeIndex(time_index)[:nt]
+
+  array_type = int(config['array_type'])
+  # reV sets the tilt to the latitude if it isn't given
+  tilt = config.get('tilt', 'latitude')
+  tilt = np.abs(lat) if tilt in ('lat', 'latitude') else float(tilt)
+  surface_azimuth = float(config['azimuth'])
+  gcr = float(config.get('gcr', 0.4))
+  module_type = int(config.get('module_type', 0))
+  gamma = GAMMA[module_type]
+  losses = float(config['losses'])
+  system_capacity = float(config['system_capacity'])
+  pac0 = system_capacity / float(config['dc_ac_ratio'])
+  inv_eff = float(config.get('inv_eff', 96))
+
+  # roof mounted fixed arrays run hotter
+  cell_temperature = FuentesCellTemperature(ncells, inoct=49.0 if array_type == 1 else 45.0)
+
+  def flat(x, t0, t1):
+    x = np.nan_to_num(np.asarray(x[t0:t1], dtype='float'))
+    return x.reshape((t1 - t0, ncells))
+
+  cf = np.zeros((nt, ncells), dtype='float32')
+  for t0 in range(0, nt, block_size):
+    t1 = min(nt, t0 + block_size)
+    times = time_index[t0:t1]
+    ghi_b = np.maximum(flat(ghi, t0, t1), 0)
+    dni_b = np.maximum(flat(dni, t0, t1), 0)
+
+    zenith, azimuth = solar_position(times, lat, lon, geometry=geometry, cells=cells)
+    sun_up = zenith < 90
+    ghi_b = np.where(sun_up, ghi_b, 0)
+    dni_b = np.where(sun_up, dni_b, 0)
+
+    cos_aoi, surface_tilt, shaded = surface_orientation(
+        zenith, azimuth, array_type, tilt, surface_azimuth, gcr)
+    doy = times.day_of_year.to_numpy()[:, np.newaxis]
+    beam, sky, ground = perez(ghi_b, dni_b, zenith, cos_aoi, surface_tilt, doy)
+    if array_type == 2:
+      beam = beam * (1 - shaded)
+      sky = sky * sky_view_derate(surface_tilt, gcr)
+    poa = beam + sky + ground
+
+    # reflection losses of the module cover only apply to the beam component
+    aoi = np.degrees(np.arccos(np.clip(cos_aoi, -1, 1)))
+    tpoa = np.maximum(poa - (1 - iam(aoi, module_type == 1)) * beam, 0)
+
+    air_temperature_b = flat(air_temperature, t0, t1)
+    wind_speed_b = flat(wind_speed, t0, t1)
+    tcell = np.empty_like(poa)
+    for k in range(t1 - t0):
+      tcell[k] = cell_temperature.step(poa[k], air_temperature_b[k], wind_speed_b[k])
+
+    dc = system_capacity * tpoa / 1000 * (1 + gamma * (tcell - 25))
+    dc = np.maximum(dc, 0) * (1 - losses / 100)
+    ac = inverter(dc, pac0, inv_eff)
+    cf[t0:t1] = ac / system_capacity
+
+  return cf.reshape((nt,) + grid_shape)
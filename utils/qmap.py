@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Empirical quantile mapping, vectorized over plants (or cells). Each value is
+replaced by the reference value at its quantile in its own series, the same
+as
+
+  q = ECDF(x)(x)
+  np.percentile(reference, 100*q)
+
+for every column, but the reference quantiles are computed once in a table
+and a whole year is mapped with one rank and one lookup.
+"""
+
+import numpy as np
+from scipy.stats import rankdata
+
+
+def quantile_table(reference, n, chunk_size=256):
+  """
+  Quantiles of each column of reference at k/n for k = 0..n, the only
+  quantiles the ECDF of a series of length n can take.
+
+  Parameters
+  ----------
+  reference : np.ndarray
+      Reference data with dimensions (time, plants).
+  n : int
+      Length of the series that will be mapped, e.g. 8760.
+  chunk_size : int
+      Number of columns done at once, bounds memory use.
+
+  Returns
+  -------
+  np.ndarray
+      float32 table with dimensions (n + 1, plants).
+  """
+  reference = np.asarray(reference)
+  q = 100 * np.arange(n + 1) / n
+  table = np.empty((n + 1, reference.shape[1]), dtype=np.float32)
+  for c0 in range(0, reference.shape[1], chunk_size):
+    c1 = min(reference.shape[1], c0 + chunk_size)
+    table[:, c0:c1] = np.percentile(reference[:, c0:c1], q, axis=0)
+  return table
+
+
+def quantile_map(data, table):
+  """
+  Map every column of data (time, plants) to the reference distribution in
+  table, from quantile_table with n equal to the length of data.
+  """
+  data = np.asarray(data)
+  if table.shape[0] != data.shape[0] + 1:
+    raise ValueError(f'Quantile table is for series of length {table.shape[0] - 1}, '
+                     f'the data has {data.shape[0]} time steps')
+  # number of values <= each value, i.e. n times the ECDF
+  rank = rankdata(data, method='max', axis=0).astype(np.intp)
+  return np.take_along_axis(table, rank, axis=0)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Consolidated store of the NSRDB generation used as the reference for bias
+correction. The per year csvs written by validation/reV_solar_power.py are
+copied once into a single HDF5 file, with a float32 (plant, hour) dataset
+gen/{year} per year so each plant's series is contiguous, and the times in
+time/{year}. New years are added without touching the others, and the
+datasets are memory mapped for reading.
+"""
+
+import h5py
+import numpy as np
+import pandas as pd
+
+
+def update_reference_store(fn, csv_template, years, plant_codes):
+  """
+  Add the years that are missing from the store at fn, creating it if
+  needed. csv_template is formatted with year to get each csv file name.
+  """
+  plant_codes = [str(p) for p in plant_codes]
+  with h5py.File(fn, 'a') as f:
+    if 'plant_code' not in f:
+      f.create_dataset('plant_code', data=np.array(plant_codes, dtype='S'))
+    elif f['plant_code'].asstr()[:].tolist() != plant_codes:
+      raise ValueError(f'Plants in {fn} do not match the plant configs, delete it to rebuild')
+    for year in years:
+      if f'gen/{year}' in f:
+        continue
+      print(f'Adding {year} to {fn}')
+      csv = pd.read_csv(csv_template.format(year=year), index_col='index', parse_dates=True)
+      # contiguous, not chunked, so it can be memory mapped
+      f.create_dataset(f'gen/{year}', data=csv[plant_codes].to_numpy(np.float32).T)
+      f.create_dataset(f'time/{year}', data=csv.index.to_numpy().astype('datetime64[ns]').astype(np.int64))
+
+
+def open_reference_store(fn, years):
+  """
+  Plant codes and a memory mapped (plant, hour) array for each of years in
+  the store at fn.
+  """
+  with h5py.File(fn, 'r') as f:
+    plant_codes = f['plant_code'].asstr()[:].tolist()
+    layout = {year: (f[f'gen/{year}'].id.get_offset(), f[f'gen/{year}'].shape) for year in years}
+  gen = {year: np.memmap(fn, mode='r', dtype=np.float32, offset=offset, shape=shape)
+         for year, (offset, shape) in layout.items()}
+  return plant_codes, gen
+
+
+def reference_columns(gen, c0, c1):
+  """Generation of plants c0 to c1 for all the years in gen, as (hour, plant)."""
+  return np.concatenate([g[c0:c1] for g in gen.values()], axis=1).T
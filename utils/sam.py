@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Run the SAM models used by reV (PVWatts v5 and windpower) directly through
+PySAM on in-memory arrays, without writing a resource file or going through
+reV/rex.
+
+The resource handling follows what reV does for a single site so that the
+capacity factor profiles match the reV engine:
+
+  * only the first 365 days are kept (reV drops the last day of leap years)
+  * the resource is rolled from UTC to local standard time before running SAM
+    and the output is rolled back to UTC afterwards
+  * diffuse irradiance is filled in from ghi and dni as rex does when the
+    resource file has no dhi
+  * capacity factor is generation divided by system_capacity
+"""
+
+import numpy as np
+import pandas as pd
+
+import PySAM.Pvwattsv5 as Pvwattsv5
+import PySAM.Windpower as Windpower
+
+from utils.sza import solar_zenith_and_azimuth_angle
+from utils.windpower import interp_to_height
+
+# SAM always runs a 365 day hourly year
+N_HOURS = 8760
+
+# keys in the plant configs that are adjustment factors rather than
+# model inputs
+ADJUST_KEYS = ('constant', 'adjust:constant')
+
+
+def _to_sam_value(value):
+  """Convert numpy/pandas scalars and arrays to plain python for PySAM."""
+  if isinstance(value, np.ndarray):
+    return value.tolist()
+  if isinstance(value, np.generic):
+    value = value.item()
+  if isinstance(value, int) and not isinstance(value, bool):
+    value = float(value)
+  return value
+
+
+def _set_adjustment(model, value):
+  adjust = model.AdjustmentFactors
+  # the name of the constant adjustment changed between PySAM versions. the
+  # getters raise on models that don't have it assigned yet, so check dir
+  if 'adjust_constant' in dir(adjust):
+    adjust.adjust_constant = value
+  else:
+    adjust.constant = value
+
+
+def assign_config(model, config):
+  """
+  Assign a reV style SAM config dict to a PySAM model. Keys that are not SAM
+  inputs (plant_code, lat, lon, etc. from the plant config csvs) are skipped.
+  """
+  _set_adjustment(model, 0.0)
+  for key, value in config.items():
+    value = _to_sam_value(value)
+    if key in ADJUST_KEYS:
+      _set_adjustment(model, value)
+      continue
+    if isinstance(value, str) or (isinstance(value, float) and np.isnan(value)):
+      continue
+    try:
+      model.value(key, value)
+    except Exception:
+      # not an input to this model
+      continue
+
+
+def _time_fields(time_index):
+  time_index = pd.DatetimeIndex(time_index)[:N_HOURS]
+  return {'year': time_index.year.tolist(),
+          'month': time_index.month.tolist(),
+          'day': time_index.day.tolist(),
+          'hour': time_index.hour.tolist(),
+          'minute': time_index.minute.tolist()}
+
+
+def _to_local(x, tz):
+  """First 365 days of a UTC series, rolled to local standard time."""
+  return np.roll(np.asarray(x, dtype='float')[:N_HOURS], int(tz))
+
+
+def _to_utc(x, tz):
+  return np.roll(np.asarray(x, dtype='float32'), -int(tz))
+
+
+def pvwattsv5_cf_profile(
+    air_temperature,
+    wind_speed,
+    surface_pressure,
+    ghi,
+    dni,
+    time_index,
+    lat,
+    lon,
+    tz,
+    config
+):
+  """
+  Hourly capacity factor for one site from PVWatts v5, shape (8760, 1) to
+  match reV's cf_profile output.
+  """
+  config = dict(config)
+  # reV sets the tilt to the latitude if it isn't given
+  if 'tilt' not in config or config['tilt'] in ('lat', 'latitude'):
+    config['tilt'] = abs(lat)
+
+  # the resource files only have ghi and dni, rex computes dhi from them
+  # with the sun position at each time stamp before handing them to SAM
+  ghi = np.maximum(np.nan_to_num(np.asarray(ghi, dtype='float')[:N_HOURS]), 0)
+  dni = np.maximum(np.nan_to_num(np.asarray(dni, dtype='float')[:N_HOURS]), 0)
+  zenith, _ = solar_zenith_and_azimuth_angle(lon, lat, pd.DatetimeIndex(time_index)[:N_HOURS])
+  dhi = np.maximum(ghi - dni * np.cos(np.radians(zenith)), 0)
+
+  resource = {
+      'lat': float(lat),
+      'lon': float(lon),
+      'tz': float(tz),
+      'elev': 0.0,
+      'tdry': _to_local(air_temperature, tz).tolist(),
+      'wspd': _to_local(wind_speed, tz).tolist(),
+      'pres': _to_local(surface_pressure, tz).tolist(),
+      'gh': _to_local(ghi, tz).tolist(),
+      'dn': _to_local(dni, tz).tolist(),
+      'df': _to_local(dhi, tz).tolist(),
+  }
+  resource.update(_time_fields(time_index))
+
+  # PySAM has no stand alone defaults for pvwattsv5, like reV start from an
+  # empty model and assign every input
+  model = Pvwattsv5.new()
+  model.Lifetime.system_use_lifetime_output = 0
+  assign_config(model, config)
+  model.SolarResource.solar_resource_data = resource
+  model.execute()
+
+  cf = _to_utc(model.Outputs.gen, tz) / config['system_capacity']
+  return cf.reshape((-1, 1))
+
+
+def windpower_cf_profile(
+    temperature,
+    pressure,
+    windspeed,
+    winddirection,
+    heights,
+    time_index,
+    lat,
+    lon,
+    tz,
+    config
+):
+  """
+  Hourly capacity factor for one site from SAM windpower, shape (8760, 1) to
+  match reV's cf_profile output. Inputs have dimensions (time, level) with
+  heights in meters, pressure in Pa and temperature in C.
+  """
+  hub_height = float(config['wind_turbine_hub_ht'])
+
+  def at_hub(x, method='linear'):
+    return _to_local(interp_to_height(np.asarray(x), heights, hub_height, method), tz)
+
+  # SAM wants pressure in atm
+  data = np.stack([at_hub(temperature),
+                   at_hub(pressure) / 101325.0,
+                   at_hub(windspeed, 'power'),
+                   at_hub(winddirection, 'circular')], axis=1)
+
+  resource = {
+      'lat': float(lat),
+      'lon': float(lon),
+      'tz': float(tz),
+      'elev': 0.0,
+      'fields': [1, 2, 3, 4],
+      'heights': 4 * [hub_height],
+      'data': data.tolist(),
+  }
+  resource.update(_time_fields(time_index))
+
+  model = Windpower.default('WindPowerNone')
+  assign_config(model, config)
+  model.Resource.wind_resource_model_choice = 0
+  model.Resource.wind_resource_data = resource
+  model.execute()
+
+  cf = _to_utc(model.Outputs.gen, tz) / config['system_capacity']
+  return cf.reshape((-1, 1))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the sun position on the WRF grid. The grid (data/grid.nc) never
+changes, so the solar zenith and azimuth for every hour of a year are
+computed once, saved as float32 .npy files and memory mapped by later runs.
+Only the hours and cells that are looked up are read from disk.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from utils.sza import solar_position_grid
+
+
+class SolarGeometryCache:
+  """
+  Hourly solar zenith and azimuth in degrees on the WRF grid, one file per
+  year and minute offset past the hour in directory. Each file holds an array
+  with dimensions (2, hour of year, south_north, west_east), zenith first.
+  A year takes about 9 GB on the full grid and is built the first time it is
+  needed.
+  """
+
+  def __init__(self, directory, grid_fn='data/grid.nc'):
+    self.directory = directory
+    os.makedirs(directory, exist_ok=True)
+    grid = xr.load_dataset(grid_fn)
+    self.lat = grid['XLAT'].to_numpy()
+    self.lon = grid['XLONG'].to_numpy()
+    self._years = {}
+
+  def __getstate__(self):
+    # workers open their own memory maps
+    state = self.__dict__.copy()
+    state['_years'] = {}
+    return state
+
+  def _path(self, year, offset_minutes):
+    return os.path.join(self.directory, f'solar_geometry_{year}_{offset_minutes:02d}.npy')
+
+  def build(self, year, offset_minutes=0, block_hours=168):
+    """Compute and save the sun position for a year unless it's already cached."""
+    year = int(year)
+    fn = self._path(year, offset_minutes)
+    if os.path.exists(fn):
+      return fn
+    times = pd.date_range(f'{year}-01-01', f'{year + 1}-01-01', freq='h', inclusive='left')
+    times = times + pd.Timedelta(minutes=offset_minutes)
+    # written under a temporary name so a killed build is never used
+    tmp_fn = f'{fn}.{os.getpid()}.tmp'
+    out = np.lib.format.open_memmap(tmp_fn, mode='w+', dtype=np.float32,
+                                    shape=(2, len(times)) + self.lat.shape)
+    for t0 in range(0, len(times), block_hours):
+      t1 = min(len(times), t0 + block_hours)
+      out[0, t0:t1], out[1, t0:t1] = solar_position_grid(self.lon, self.lat, times[t0:t1])
+    out.flush()
+    del out
+    os.replace(tmp_fn, fn)
+    return fn
+
+  def year(self, year, offset_minutes=0):
+    """Memory mapped zenith and azimuth for a whole year, built if needed."""
+    key = (int(year), offset_minutes)
+    if key not in self._years:
+      data = np.load(self.build(*key), mmap_mode='r')
+      if data.shape[2:] != self.lat.shape:
+        raise ValueError(f'Solar geometry in {self._path(*key)} has grid shape '
+                         f'{data.shape[2:]}, the grid is {self.lat.shape}')
+      self._years[key] = data
+    return self._years[key]
+
+  def lookup(self, times, i=None, j=None, offset_minutes=0):
+    """
+    Zenith and azimuth for times, which must be whole hours plus
+    offset_minutes, with dimensions (time, south_north, west_east), or
+    (time, *i.shape) for the cells at grid indexes i and j.
+    """
+    times = pd.DatetimeIndex(times)
+    if times.tz is not None:
+      times = times.tz_convert('UTC').tz_localize(None)
+    hourly = times - pd.Timedelta(minutes=offset_minutes)
+    if (hourly != hourly.floor('h')).any():
+      raise ValueError(f'Solar geometry is only cached for whole hours plus {offset_minutes} minutes')
+
+    shape = (len(times),) + (self.lat.shape if i is None else np.shape(i))
+    zenith = np.empty(shape, dtype=np.float32)
+    azimuth = np.empty(shape, dtype=np.float32)
+    for year in np.unique(hourly.year):
+      rows = np.flatnonzero(hourly.year == year)
+      hours = (hourly[rows] - pd.Timestamp(year=year, month=1, day=1)) // pd.Timedelta(hours=1)
+      data = self.year(year, offset_minutes)[:, np.asarray(hours)]
+      if i is not None:
+        data = data[:, :, i, j]
+      zenith[rows], azimuth[rows] = data[0], data[1]
+    return zenith, azimuth
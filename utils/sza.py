@@ -52,6 +52,35 @@ def solar_zenith_and_azimuth_angle(longitude: float,
   Returns:
       tuple: (Zenith, Azimuth) angles in degrees
   """
+  return _position(*_time_terms(time_utc), np.deg2rad(longitude), np.deg2rad(latitude))
+
+
+def solar_position_grid(longitude, latitude, time_utc: pandas.DatetimeIndex) -> tuple:
+  """Solar zenith and azimuth angle for every time and every cell of a grid.
+
+  Same as solar_zenith_and_azimuth_angle, but the terms that only depend on
+  time are computed once per time step and broadcast against the cells, so
+  there is no need to repeat the times and coordinates for every pair.
+
+  Args:
+      longitude (np.ndarray): Longitude of the cells, any shape e.g.
+          (south_north, west_east)
+      latitude (np.ndarray): Latitude of the cells, same shape as longitude
+      time_utc (pandas.core.indexes.datetimes.DatetimeIndex):
+          The times in UTC
+  Returns:
+      tuple: (Zenith, Azimuth) angles in degrees, with dimensions
+          (time, *longitude.shape)
+  """
+  longitude = np.asarray(longitude)
+  latitude = np.asarray(latitude)
+  expand = (slice(None),) + (np.newaxis,) * longitude.ndim
+  terms = [term[expand] for term in _time_terms(pandas.DatetimeIndex(time_utc))]
+  return _position(*terms, np.deg2rad(longitude), np.deg2rad(latitude))
+
+
+def _time_terms(time_utc):
+  # parts of the computation that only depend on time, one value per time
   year = time_utc.year.values
   month = time_utc.month.values
   day = time_utc.day.values
@@ -66,13 +95,6 @@ def solar_zenith_and_azimuth_angle(longitude: float,
   time_vec = (year_val + month_val - year_val_pc + day
               + 0.0416667 * day_hours - 21958.0)
 
-  # Arguments of the method:
-  lat_rad = np.deg2rad(latitude)
-  lon_rad = np.deg2rad(longitude)
-  # Reasonable estimates for pressure and temperature
-  pressure = 1.0  # unit: atmosphere
-  temperature = 20.0  # unit: degree of celsius
-
   # Computation
   d_t = 96.4 + 0.567 * (year - 2061.0)
   te = time_vec + 1.1574e-5 * d_t
@@ -94,6 +116,19 @@ def solar_zenith_and_azimuth_angle(longitude: float,
 
   r_asc[r_asc < 0] += 2 * np.pi
 
+  sd = sl * se
+  cd = np.sqrt(1.0 - sd * sd)
+  return time_vec, r_asc, sd, cd
+
+
+def _position(time_vec, r_asc, sd, cd, lon_rad, lat_rad):
+  # combine the time terms with the coordinates of the cells, the arguments
+  # are either all the same shape or broadcast against each other
+
+  # Reasonable estimates for pressure and temperature
+  pressure = 1.0  # unit: atmosphere
+  temperature = 20.0  # unit: degree of celsius
+
   h_ang = ((1.7528311 + 6.300388099 * time_vec + lon_rad - r_asc + np.pi)
            % (2 * np.pi)) - np.pi
 
@@ -102,8 +137,6 @@ def solar_zenith_and_azimuth_angle(longitude: float,
 
   sp = np.sin(lat_rad)
   cp = np.sqrt((1.0 - sp * sp))
-  sd = sl * se
-  cd = np.sqrt(1.0 - sd * sd)
   s_h = np.sin(h_ang)
   c_h = np.cos(h_ang)
 
@@ -1,37 +1,54 @@
+import numpy as np
 import pytz
 from timezonefinder import TimezoneFinder
 from datetime import datetime
-from tqdm import tqdm
 
 # this takes a while to load, so load it once and use globally
 tf = TimezoneFinder()
 
 
+def standard_offset(tz_name):
+  """Standard time (no daylight saving) UTC offset of a timezone in seconds."""
+  timezone = pytz.timezone(tz_name)
+  dt = timezone.localize(datetime(2020, 1, 1))
+  return int((dt.utcoffset() - dt.dst()).total_seconds())
+
+
+def tz_offsets(latitude, longitude):
+  """
+  Standard UTC offset in seconds at each point of latitude and longitude,
+  arrays of any shape (a grid or a list of sites). The timezones are found
+  in one pass over plain arrays and each timezone is converted to an offset
+  once, so the whole WRF grid takes well under a second. Points without a
+  timezone (open ocean in older timezonefinder versions) get the nautical
+  offset from their longitude.
+  """
+  latitude = np.asarray(latitude, dtype=np.float64)
+  longitude = np.asarray(longitude, dtype=np.float64)
+  names = np.array([tf.timezone_at(lng=lon, lat=lat) or ''
+                    for lat, lon in zip(latitude.ravel().tolist(), longitude.ravel().tolist())])
+  zones, inverse = np.unique(names, return_inverse=True)
+  offsets = np.array([standard_offset(zone) if zone else 0 for zone in zones], dtype=np.int32)[inverse]
+  missing = names == ''
+  offsets[missing] = np.round(longitude.ravel()[missing]/15).astype(np.int32)*3600
+  return offsets.reshape(latitude.shape)
+
+
 def get_tz_offset(lat, lon):
   """
-  Get timezone offset from utc, rev requires this field be in the 
-  metadata but its unclear if it actually affects the wind or solar 
-  calcs. I did some tests and the differences between setting the 
-  timezone offset properly and setting it to 0 came down to rounding 
+  Get timezone offset from utc, rev requires this field be in the
+  metadata but its unclear if it actually affects the wind or solar
+  calcs. I did some tests and the differences between setting the
+  timezone offset properly and setting it to 0 came down to rounding
   error. out of an abundance of caution I'm setting it properly anyway
   since it doesnt take much time at all to compute (~.1 ms).
   """
-  tz = tf.timezone_at(lng=lon, lat=lat)
-  timezone = pytz.timezone(tz)
-  dt = datetime.utcnow()
-  return timezone.utcoffset(dt).total_seconds()/60/60
+  return tz_offsets(lat, lon)[()]/60/60
 
 
 def get_tz_offset_grid(xlat, xlon):
-  s = xlat.shape
-  offset = xlat.copy(deep=True).rename('tz_offset')
-
-  for i in range(s[0]):
-    for j in range(s[1]):
-      lat = xlat[i, j].values[()]
-      lon = xlon[i, j].values[()]
-      offset[i, j] = get_tz_offset(lat, lon)
-  return offset
+  """Standard UTC offset in hours on the grid of xlat and xlon."""
+  return xlat.copy(data=tz_offsets(xlat, xlon)/60/60).rename('tz_offset')
 
 
 def get_tz_offset2(latitude, longitude):
@@ -39,14 +56,4 @@ def get_tz_offset2(latitude, longitude):
   Get the UTC offset for a list of lat/lon points.
 
   """
-  tf = TimezoneFinder()  # reuse
-
-  # query_points = [(13.358, 52.5061), (-120,42)]
-  offset = []
-  for lon, lat in tqdm(zip(longitude, latitude), total=len(longitude)):
-    tz = tf.timezone_at(lng=lon, lat=lat)
-    timezone = pytz.timezone(tz)
-    dt = datetime.datetime.utcnow()
-    offset.append(timezone.utcoffset(dt).total_seconds()/60/60)
-
-  return offset
+  return list(tz_offsets(latitude, longitude)/60/60)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Vertical interpolation of WRF fields to fixed heights above ground, the same
+as wrf.vinterp(..., vert_coord='ght_agl', extrapolate=True) for fields with
+no field_type. The bracketing model levels and weights only depend on the
+model level heights, so they are found once and applied to every field.
+
+wrf.vinterp interpolates linearly in exp(-z/SCLHT). Heights below the lowest
+model level get the lowest level value and heights above the top get the top
+value.
+"""
+
+import numpy as np
+
+# scale height used by wrf-python, Rd*256/g
+SCLHT = 287.0 * 256.0 / 9.81
+
+
+def interp_weights(height, levels):
+  """
+  Model level index and weight for each target height.
+
+  Parameters
+  ----------
+  height : np.ndarray
+      Height above ground of the model levels in m, with the levels on axis 1
+      e.g. (Time, bottom_top, south_north, west_east). Must increase with the
+      level index.
+  levels : np.ndarray
+      Target heights above ground in m.
+
+  Returns
+  -------
+  tuple
+      Index of the model level below each target and the weight of that level,
+      both shaped like height with axis 1 replaced by the target levels. The
+      level above has weight 1 - weight.
+  """
+  height = np.asarray(height)
+  levels = np.asarray(levels, dtype=np.float64)
+  nz = height.shape[1]
+  shape = height.shape[:1] + (len(levels),) + height.shape[2:]
+  index = np.empty(shape, dtype=np.intp)
+  weight = np.empty(shape, dtype=np.float64)
+  for n, level in enumerate(levels):
+    k = np.clip((height <= level).sum(axis=1) - 1, 0, nz - 2)
+    # only the two bracketing levels are converted to the exp coordinate
+    z0 = np.take_along_axis(height, k[:, np.newaxis], axis=1)[:, 0].astype(np.float64)
+    z1 = np.take_along_axis(height, k[:, np.newaxis] + 1, axis=1)[:, 0].astype(np.float64)
+    vc0 = np.exp(-z0 / SCLHT)
+    vc1 = np.exp(-z1 / SCLHT)
+    # out of range weights become 0 or 1, i.e. the top or bottom level value
+    weight[:, n] = np.clip((np.exp(-level / SCLHT) - vc1) / (vc0 - vc1), 0, 1)
+    index[:, n] = k
+  return index, weight
+
+
+def apply_weights(field, index, weight):
+  """Interpolate field, shaped like the height given to interp_weights."""
+  field = np.asarray(field)
+  lower = np.take_along_axis(field, index, axis=1)
+  upper = np.take_along_axis(field, index + 1, axis=1)
+  return (weight * lower + (1 - weight) * upper).astype(field.dtype)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized NumPy windpower model for computing capacity factors on every cell
+of a grid in one pass, for the case where every cell has the same turbine and
+farm layout (grid mode).
+
+Follows SAM windpower as run by reV:
+
+  * met data is interpolated from the WRF levels to hub height the same way
+    rex does for multi-height wind resource files
+  * the wind speed is corrected for air density before the power curve is
+    applied, v * (rho / 1.225)^(1/3)
+  * farm output is the turbine output times the number of turbines, times
+    the wake efficiency of the farm, reduced by the loss settings and the
+    constant adjustment factor. Loss settings missing from the config take
+    SAM's defaults, as they do in reV and utils.sam
+
+The wake efficiency of the configured SAM wake model is tabulated once by
+running SAM on a grid of wind speeds and directions at sea level density,
+and interpolated for every cell and hour. Use the validation option in
+rev_wind.py to check the differences against the reV engine, and
+python -m utils.windpower to compare against utils.sam.
+"""
+
+import numpy as np
+import pandas as pd
+import PySAM.Windpower as Windpower
+
+# SAM always runs a 365 day hourly year
+N_HOURS = 8760
+
+AIR_DENSITY_SEA_LEVEL = 1.225
+R_DRY_AIR = 287.05
+
+# SAM wake models, the constant model is the wake_int_loss setting
+WAKE_MODEL_CONSTANT = 3
+
+# resolution of the wake efficiency table
+WAKE_WINDSPEED_STEP = 0.5
+WAKE_DIRECTION_STEP = 2.0
+
+
+def bracketing_levels(heights, height):
+  """Index of the lower of the two levels used to interpolate to height."""
+  return int(np.clip(np.searchsorted(heights, height) - 1, 0, len(heights) - 2))
+
+
+def shear_exponent(windspeed, heights, height):
+  """
+  Power law shear exponent at each site from the mean wind speed of the two
+  levels bracketing height. windspeed has dimensions (time, level, ...).
+  """
+  heights = np.asarray(heights, dtype='float')
+  k = bracketing_levels(heights, height)
+  x1 = np.asarray(windspeed[:, k], dtype='float').mean(axis=0)
+  x2 = np.asarray(windspeed[:, k + 1], dtype='float').mean(axis=0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    alpha = np.log(x2 / x1) / np.log(heights[k + 1] / heights[k])
+  return np.nan_to_num(alpha, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def interp_to_height(data, heights, height, method='linear', alpha=None):
+  """
+  Interpolate data on vertical levels to a single height, using the two
+  nearest levels and extrapolating beyond the top and bottom levels. Mirrors
+  the interpolation done by rex for wind resource files.
+
+  Parameters
+  ----------
+  data : np.ndarray
+      Array with dimensions (time, level, ...).
+  heights : np.ndarray
+      Height of each level, increasing, same units as height.
+  height : float
+      Height to interpolate to.
+  method : str
+      'linear', 'power' (power law with the mean shear of each site, for
+      wind speed) or 'circular' (for wind direction in degrees).
+  alpha : np.ndarray
+      Shear exponent for the power method. If not given it is computed from
+      data, pass it in when data is only a block of the full time series.
+
+  Returns
+  -------
+  np.ndarray
+      Array with dimensions (time, ...).
+  """
+  heights = np.asarray(heights, dtype='float')
+  if height in heights:
+    return data[:, int(np.flatnonzero(heights == height)[0])]
+
+  k = bracketing_levels(heights, height)
+  h1, h2 = heights[k], heights[k + 1]
+  x1, x2 = data[:, k], data[:, k + 1]
+
+  if method == 'power':
+    if alpha is None:
+      alpha = shear_exponent(data, heights, height)
+    return x1 * (height / h1)**alpha
+  elif method == 'circular':
+    diff = np.mod(x2 - x1 + 180, 360) - 180
+    return np.mod(x1 + diff * (height - h1) / (h2 - h1), 360)
+  else:
+    return x1 + (x2 - x1) * (height - h1) / (h2 - h1)
+
+
+def default_losses():
+  """SAM's loss settings, used for the ones a config doesn't set."""
+  # the groups of a PySAM model are empty once the model itself is freed
+  model = Windpower.default('WindPowerNone')
+  return model.Losses.export()
+
+
+def loss_fraction(config):
+  """
+  Total fractional loss from the loss settings of a windpower config. Each
+  *_loss percentage, with SAM's default for the ones not in config (and the
+  older wind_farm_losses_percent), is applied in series, followed by the
+  constant adjustment factor.
+  """
+  losses = default_losses()
+  losses.update({key: value for key, value in config.items()
+                 if key.endswith('_loss') or key == 'wind_farm_losses_percent'})
+  keep = 1.0
+  for value in losses.values():
+    keep *= 1 - float(value) / 100
+  for key in ('constant', 'adjust:constant'):
+    if key in config:
+      keep *= 1 - float(config[key]) / 100
+  return 1 - keep
+
+
+def turbine_power(windspeed, air_density, powercurve_windspeeds, powercurve_powerout):
+  """Turbine output (kW) from the power curve after the air density correction."""
+  corrected = windspeed * np.cbrt(air_density / AIR_DENSITY_SEA_LEVEL)
+  # zero below cut in and above cut out
+  return np.interp(corrected, powercurve_windspeeds, powercurve_powerout, left=0, right=0)
+
+
+def wake_table(config):
+  """
+  Wake efficiency of the farm (output with wakes over the output of the
+  same number of free standing turbines) on a grid of hub height wind
+  speeds and directions, from SAM with the wake model of config. Returns the
+  wind speeds, the directions and the table with dimensions (speed,
+  direction).
+  """
+  windspeeds = np.arange(0, np.max(config['wind_turbine_powercurve_windspeeds']) + WAKE_WINDSPEED_STEP,
+                         WAKE_WINDSPEED_STEP)
+  directions = np.arange(0, 360, WAKE_DIRECTION_STEP)
+  ws, wd = (x.ravel() for x in np.meshgrid(windspeeds, directions, indexing='ij'))
+
+  # SAM wants whole years of hours, pad with calm hours
+  n_hours = -(-len(ws) // N_HOURS) * N_HOURS
+  ws = np.pad(ws, (0, n_hours - len(ws)))
+  wd = np.pad(wd, (0, n_hours - len(wd)))
+  n_years = n_hours // N_HOURS
+  times = pd.date_range('2001-01-01', periods=N_HOURS, freq='h')
+  # 15 C and 1 atm is sea level density
+  data = np.stack([np.full(n_hours, 15.0), np.ones(n_hours), ws, wd], axis=1)
+
+  model = Windpower.default('WindPowerNone')
+  for key in ('wind_farm_wake_model', 'wind_farm_xCoordinates', 'wind_farm_yCoordinates',
+              'wind_resource_turbulence_coeff', 'wind_turbine_hub_ht', 'wind_turbine_rotor_diameter',
+              'wind_turbine_powercurve_windspeeds', 'wind_turbine_powercurve_powerout', 'system_capacity'):
+    if key in config:
+      value = config[key]
+      model.value(key, [float(x) for x in value] if isinstance(value, (list, np.ndarray)) else float(value))
+  model.Losses.assign({key: 0.0 for key in model.Losses.export()})
+  model.Resource.wind_resource_model_choice = 0
+  model.Resource.wind_resource_data = {
+      'lat': 0.0, 'lon': 0.0, 'tz': 0.0, 'elev': 0.0,
+      'fields': [1, 2, 3, 4],
+      'heights': 4 * [float(config['wind_turbine_hub_ht'])],
+      'data': data.tolist(),
+      'year': np.repeat(times.year[0] + np.arange(n_years), N_HOURS).tolist(),
+      **{field: np.tile(getattr(times, field), n_years).tolist() for field in ('month', 'day', 'hour', 'minute')},
+  }
+  model.execute()
+
+  farm = np.asarray(model.Outputs.gen)[:windspeeds.size * directions.size]
+  free = len(config['wind_farm_xCoordinates']) * turbine_power(
+      np.repeat(windspeeds, directions.size), AIR_DENSITY_SEA_LEVEL,
+      np.asarray(config['wind_turbine_powercurve_windspeeds'], dtype='float'),
+      np.asarray(config['wind_turbine_powercurve_powerout'], dtype='float'))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    efficiency = np.where(free > 0, farm / free, 1.0)
+  return windspeeds, directions, np.clip(efficiency, 0, 1).reshape((windspeeds.size, directions.size))
+
+
+def wake_efficiency(windspeed, winddirection, table):
+  """Bilinear interpolation of a wake_table, wrapping around in direction."""
+  windspeeds, directions, efficiency = table
+  step_ws = windspeeds[1] - windspeeds[0]
+  step_wd = directions[1] - directions[0]
+  x = np.clip(np.nan_to_num(windspeed) / step_ws, 0, windspeeds.size - 1)
+  y = np.mod(np.nan_to_num(winddirection), 360) / step_wd
+  i0 = np.minimum(x.astype(int), windspeeds.size - 2)
+  j0 = y.astype(int) % directions.size
+  j1 = (j0 + 1) % directions.size
+  fx = x - i0
+  fy = y - np.floor(y)
+  return ((1 - fx) * ((1 - fy) * efficiency[i0, j0] + fy * efficiency[i0, j1])
+          + fx * ((1 - fy) * efficiency[i0 + 1, j0] + fy * efficiency[i0 + 1, j1]))
+
+
+def windpower(
+    temperature,
+    pressure,
+    windspeed,
+    heights,
+    config,
+    winddirection=None,
+    block_size=168
+):
+  """
+  Hourly capacity factor from SAM windpower for every cell of a grid.
+
+  Parameters
+  ----------
+  temperature : np.ndarray
+      Air temperature in C with dimensions (time, level, ...).
+  pressure : np.ndarray
+      Pressure in Pa with dimensions (time, level, ...).
+  windspeed : np.ndarray
+      Wind speed in m/s with dimensions (time, level, ...).
+  heights : np.ndarray
+      Height of each level in meters.
+  config : dict
+      reV/SAM windpower config, e.g. sam/wind_default_config.json.
+  winddirection : np.ndarray
+      Wind direction in degrees with dimensions (time, level, ...), needed
+      for the wake models other than the constant one.
+  block_size : int
+      Number of hours computed at once, bounds the size of temporary arrays.
+
+  Returns
+  -------
+  np.ndarray
+      float32 capacity factor with dimensions (8760, ...). Like reV, only the
+      first 365 days are kept.
+  """
+  heights = np.asarray(heights, dtype='float')
+  hub_height = float(config['wind_turbine_hub_ht'])
+  nt = min(N_HOURS, windspeed.shape[0])
+
+  powercurve_windspeeds = np.asarray(config['wind_turbine_powercurve_windspeeds'], dtype='float')
+  powercurve_powerout = np.asarray(config['wind_turbine_powercurve_powerout'], dtype='float')
+  n_turbines = len(config['wind_farm_xCoordinates'])
+  system_capacity = float(config['system_capacity'])
+  keep = 1 - loss_fraction(config)
+
+  table = None
+  if n_turbines > 1 and int(config.get('wind_farm_wake_model', 0)) != WAKE_MODEL_CONSTANT:
+    if winddirection is None:
+      raise ValueError(f'wind_farm_wake_model {config.get("wind_farm_wake_model", 0)} needs winddirection, '
+                       f'or use the constant wake model ({WAKE_MODEL_CONSTANT})')
+    table = wake_table(config)
+
+  # the shear exponent comes from the whole year so the result doesn't
+  # depend on the block size
+  alpha = shear_exponent(windspeed[:nt], heights, hub_height)
+
+  cf = np.zeros((nt,) + tuple(windspeed.shape[2:]), dtype='float32')
+  for t0 in range(0, nt, block_size):
+    t1 = min(nt, t0 + block_size)
+
+    def at_hub(x, method='linear'):
+      return interp_to_height(np.asarray(x[t0:t1], dtype='float'), heights, hub_height,
+                              method, alpha=alpha)
+
+    ws = np.nan_to_num(at_hub(windspeed, 'power'))
+    air_density = at_hub(pressure) / (R_DRY_AIR * (at_hub(temperature) + 273.15))
+    air_density = np.nan_to_num(air_density, nan=AIR_DENSITY_SEA_LEVEL)
+
+    power = turbine_power(ws, air_density, powercurve_windspeeds, powercurve_powerout)
+    if table is not None:
+      power = power * wake_efficiency(ws, at_hub(winddirection, 'circular'), table)
+    cf[t0:t1] = n_turbines * power * keep / system_capacity
+
+  return cf
+
+
+if __name__ == '__main__':
+  # compare against SAM windpower run through utils.sam on a synthetic year
+  # for a few sites and every wake model, python -m utils.windpower
+  import json
+  import time
+  from utils.misc import tolerance_report
+  from utils.sam import windpower_cf_profile
+
+  rng = np.random.default_rng(0)
+  n_sites = 8
+  heights = np.array([20.0, 60.0, 100.0, 140.0, 200.0])
+  times = pd.date_range('2019-01-01', periods=N_HOURS, freq='h', tz='UTC')
+  # weibull winds with a diurnal cycle, shear and slowly turning directions
+  hour = times.hour.to_numpy()[:, np.newaxis, np.newaxis]
+  ws100 = (rng.weibull(2.0, (N_HOURS, 1, n_sites)) * rng.uniform(6, 10, n_sites)
+           * (1 + 0.2 * np.cos(2 * np.pi * (hour - 3) / 24)))
+  windspeed = ws100 * (heights[:, np.newaxis] / 100)**rng.uniform(0.05, 0.3, n_sites)
+  winddirection = np.mod(np.cumsum(rng.normal(0, 10, (N_HOURS, 1, n_sites)), axis=0)
+                         + rng.uniform(0, 360, n_sites), 360) * np.ones((1, len(heights), 1))
+  temperature = (15 - 10 * np.cos(2 * np.pi * times.day_of_year.to_numpy() / 365)[:, np.newaxis, np.newaxis]
+                 - 0.0065 * heights[:, np.newaxis] + rng.normal(0, 2, (N_HOURS, 1, n_sites)))
+  pressure = 101325 * np.exp(-heights[:, np.newaxis] / 8400) * np.ones((N_HOURS, 1, n_sites))
+
+  with open('sam/wind_default_config.json') as f:
+    config = json.load(f)
+  config['wind_turbine_hub_ht'] = 100.0
+
+  for wake_model in (0, 1, 2, 3):
+    config['wind_farm_wake_model'] = wake_model
+    start = time.time()
+    cf = windpower(temperature, pressure, windspeed, heights, config, winddirection=winddirection)
+    numpy_time = time.time() - start
+    start = time.time()
+    reference = np.concatenate([windpower_cf_profile(temperature[:, :, k], pressure[:, :, k], windspeed[:, :, k],
+                                                     winddirection[:, :, k], heights, times, 40.0, -100.0, 0,
+                                                     config) for k in range(n_sites)], axis=1)
+    sam_time = time.time() - start
+    report = tolerance_report(reference, cf).loc['all']
+    print(f'wake model {wake_model}: mean cf sam {report.mean_cf_reference:.4f} numpy {report.mean_cf_test:.4f}, '
+          f'bias {report.bias:+.4f}, rmse {report.rmse:.4f}, numpy {numpy_time:.1f}s, sam {sam_time:.1f}s')
+    assert abs(report.bias) < 0.005 and report.rmse < 0.01, f'wake model {wake_model} is off from SAM'
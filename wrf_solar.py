@@ -1,5 +1,6 @@
 from glob import glob
-import sys
+import argparse
+import os
 import time
 
 # joblib allows for parallel threads
@@ -11,8 +12,13 @@ from tqdm import tqdm
 import xarray as xr
 import wrf
 # from farms.disc import disc
-from utils.disc import disc
-from utils.sza import solar_zenith_and_azimuth_angle as sza_saa
+from utils.disc import disc_fused
+from utils.cells import compress_cells, plant_sites, region_mask
+from utils.checkpoint import Checkpoint, file_digest
+from utils.netcdf import (assign_time_regions, create_time_store, finish_time_store,
+                          time_chunked_encoding, time_store_status, write_time_region)
+from utils.solar_geometry import SolarGeometryCache
+from utils.sza import solar_position_grid
 
 import warnings
 
@@ -23,26 +29,37 @@ warnings.filterwarnings("ignore")
 # output_dir = '/global/cfs/cdirs/m2702/gsharing/solar-wind/met_data_fullgrid/historical'
 
 
-def estimate_dni(ghi, psfc):
+def estimate_dni(ghi, psfc, geometry=None):
   """
   Compute direct normal irradiance (DNI) from global horizontal irradiance (GHI)
-  (aka downward shortwave radiation) using the NREL DISC model. 
+  (aka downward shortwave radiation) using the NREL DISC model. The solar
+  zenith is read from geometry (a utils.solar_geometry.SolarGeometryCache)
+  if given.
   """
-  ghi_stacked = ghi.stack(s=('Time', ...))
-  psfc_stacked = psfc.stack(s=('Time', ...))
-  datetime = pd.DatetimeIndex(ghi_stacked['Time'])
-  sza, saa = sza_saa(longitude=ghi_stacked['XLONG'], latitude=ghi_stacked['XLAT'], time_utc=datetime)
+  # time first, then the dimensions of the cell coordinates, either
+  # (south_north, west_east) or (cell)
+  dims = ('Time',) + ghi['XLONG'].dims
+  ghi = ghi.transpose(*dims)
+  datetime = pd.DatetimeIndex(ghi['Time'])
+  if geometry is None:
+    sza, saa = solar_position_grid(longitude=ghi['XLONG'], latitude=ghi['XLAT'], time_utc=datetime)
+  elif 'cell' in dims:
+    sza, saa = geometry.lookup(datetime, ghi['i'].to_numpy(), ghi['j'].to_numpy())
+  else:
+    sza, saa = geometry.lookup(datetime)
 
-  dni = disc(ghi_stacked,
-             sza,
-             datetime.day_of_year.to_numpy(),
-             pressure=psfc_stacked)
-  return dni.unstack()
+  # float32 in and out, single pass if numba is installed
+  dni = disc_fused(ghi.to_numpy(),
+                   sza,
+                   datetime.day_of_year.to_numpy(),
+                   pressure=psfc.transpose(*dims).to_numpy())
+  return ghi.copy(data=dni)
 
 
-def process_file(f):
+def process_file(f, timeidx=wrf.ALL_TIMES, mask=None, geometry=None):
   """
-  Extract data for a solar power model from a single WRF output file. 
+  Extract data for a solar power model from a single WRF output file. If a
+  mask is given only the cells in it are kept, see utils.cells.
   """
   ds = Dataset(f)
   data = {
@@ -51,15 +68,18 @@ def process_file(f):
       'PSFC': None,
       'SWDOWN': None,
   }
-  cache = wrf.extract_vars(ds, wrf.ALL_TIMES, ("PSFC", "SWDOWN", "WSPD", "T2"))
+  cache = wrf.extract_vars(ds, timeidx, ("PSFC", "SWDOWN", "WSPD", "T2"))
   for v in data.keys():
     # cache makes repeated access of variables faster, not totally sure if it helps here
-    data[v] = wrf.getvar(wrfin=ds, varname=v, squeeze=False, timeidx=wrf.ALL_TIMES, cache=cache)
+    data[v] = wrf.getvar(wrfin=ds, varname=v, squeeze=False, timeidx=timeidx, cache=cache)
   merged = xr.merge([v for v in data.values()])
   merged['PSFC'] = merged['PSFC'] / 100.0  # convert to mb/hPa
   merged['T2'] = merged['T2'] - 273.15  # convert to C
+  if mask is not None:
+    # drop cells outside the region before the expensive dni estimate
+    merged = compress_cells(merged, mask)
   # start = time.time()
-  merged['dni'] = estimate_dni(merged['SWDOWN'], merged['PSFC'])
+  merged['dni'] = estimate_dni(merged['SWDOWN'], merged['PSFC'], geometry)
   # end = time.time()
   # print(end - start)
   merged = merged.rename({
@@ -70,44 +90,165 @@ def process_file(f):
   return merged
 
 
+def file_times(f):
+  """
+  Time steps in a single WRF output file, without reading any other data.
+  """
+  return pd.DatetimeIndex(wrf.extract_times(Dataset(f), wrf.ALL_TIMES))
+
+
+def process_file_region(f, times, t0, output_fn, checkpoint=None, mask=None, geometry=None):
+  """
+  Process a single WRF output file and write the time steps in times into
+  the yearly file output_fn, starting at time step t0. Returns the number of
+  time steps written. The file is recorded in checkpoint once its time steps
+  are written.
+  """
+  merged = process_file(f, mask=mask, geometry=geometry).sel(Time=times)
+  merged['Time'] = merged['Time'].astype(np.int64)
+  write_time_region(output_fn, merged, t0)
+  if checkpoint is not None:
+    checkpoint.save(os.path.basename(f))
+  return len(times)
+
+
 def process_year(
     year,
     wrf_dir='/global/cfs/cdirs/m2702/gsharing/tgw-wrf-conus/historic_1980_2019/three_hourly',
     # 52 files per year so 13 divides them evenly into 4 chunks
     tasks=13,
     output_dir='./',
+    chunk_tile=None,
+    checkpoint_dir=None,
+    mask_spec=None,
+    mask_buffer=1,
+    site_configs=None,
+    solar_geometry_dir=None,
 ):
   start = time.time()
   print(f'OMP enabled: {wrf.omp_enabled()}, procs: {wrf.omp_get_num_procs()}')
   # The number of threads available to process
   wrf.omp_set_num_threads(16)
   wrf_files = sorted(glob(f'{wrf_dir}/*{year}*.nc'))
-  data = Parallel(
+  output_fn = f'{output_dir}/wrf_solar_{year}.nc'
+
+  # consecutive files overlap, each time step is written by the first file
+  # that has it
+  time_axis, regions = assign_time_regions([file_times(f) for f in wrf_files])
+
+  # the sun position on the grid is the same every run, build the cache for
+  # the years in these files up front so workers only read it
+  geometry = None
+  if solar_geometry_dir is not None:
+    geometry = SolarGeometryCache(solar_geometry_dir)
+    for y in np.unique(time_axis.year):
+      geometry.build(y)
+
+  # optionally only process and store the cells in a region, or in sites
+  # mode only the cell nearest to each plant in the site config files
+  mask = None
+  sites = None
+  if mask_spec is not None or site_configs is not None:
+    grid = Dataset(wrf_files[0])
+    lat = wrf.getvar(grid, 'XLAT', meta=False)
+    lon = wrf.getvar(grid, 'XLONG', meta=False)
+    if site_configs is not None:
+      mask, sites = plant_sites(lat, lon, site_configs)
+    else:
+      mask = region_mask(mask_spec, lat, lon, buffer=mask_buffer)
+    print(f'Keeping {mask.sum()} of {mask.size} cells')
+
+  # weekly files that are already written to the yearly file are recorded in
+  # the checkpoint, a restarted run only processes the rest
+  checkpoint = None
+  if checkpoint_dir is not None:
+    checkpoint = Checkpoint(f'{checkpoint_dir}/wrf_solar_{year}',
+                            {'files': wrf_files, 'chunk_tile': chunk_tile,
+                             'mask_spec': mask_spec, 'mask_buffer': mask_buffer,
+                             'sites': [file_digest(fn) for fn in site_configs or []]})
+  # the yearly file is only reused if it can be opened, and is either still
+  # being filled in or was finished by this run (killed before the
+  # checkpoint was removed)
+  status = time_store_status(output_fn) if checkpoint is not None else None
+  if status == 'complete' and len(checkpoint.units()) == len(wrf_files):
+    print(f'{output_fn} is already complete')
+    checkpoint.remove()
+    return
+  resume = status == 'partial' and len(checkpoint.units()) > 0
+  if resume:
+    print(f'Resuming, {len(checkpoint.units())} of {len(wrf_files)} files already done')
+  elif checkpoint is not None:
+    checkpoint.reset()
+
+  # create the yearly file up front from one time step of the first file,
+  # then each worker writes the time steps of its own file as soon as it is
+  # done so only a few weeks of data are ever in memory
+  if not resume:
+    template = process_file(wrf_files[0], timeidx=0, mask=mask, geometry=geometry)
+    template['Time'] = template['Time'].astype(np.int64)
+    # hold onto the projection information
+    template.attrs['projection'] = str(template.attrs['projection'])
+    del template.attrs['description']
+    del template.attrs['units']
+    for var in template.data_vars:
+      if 'projection' in template[var].attrs:
+        del template[var].attrs['projection']
+    if sites is not None:
+      # which site each plant uses
+      template = template.merge(sites)
+    # compression takes longer for little gain
+    # encoding={var: dict(zlib=True, complevel=5) for var in template.data_vars}
+    # optionally store each variable in chunks holding the whole year for small
+    # tiles of cells, so reading one cell or tile at a time is cheap. while
+    # the regions are written the chunks are about one file long, the file
+    # is rechunked to the whole year once at the end
+    encoding = None
+    if chunk_tile is not None:
+      region_steps = max(len(times) for times, _ in regions)
+      encoding = time_chunked_encoding(template, tile=chunk_tile, time_chunk=region_steps)
+    create_time_store(output_fn, template, time_axis.to_numpy().astype(np.int64), encoding=encoding)
+
+  n_written = Parallel(
       n_jobs=tasks,
       # prefer='threads',
-  )(delayed(process_file)(f) for f in tqdm(wrf_files))
-  # merge all the data into one xarray
-  merged = xr.concat(data, dim='Time').drop_duplicates('Time')
-  merged['Time'] = merged['Time'].astype(np.int64)
-  # hold onto the projection information
-  merged.attrs['projection'] = str(merged.attrs['projection'])
-  del merged.attrs['description']
-  del merged.attrs['units']
-  for var in merged.data_vars:
-    if 'projection' in merged[var].attrs:
-      del merged[var].attrs['projection']
-  # compression takes longer for little gain
-  # merged.to_netcdf(f'{output_dir}/wrf_wind_{year}.nc',
-  # encoding={var: dict(zlib=True, complevel=5) for var in merged.data_vars})
-  merged.to_netcdf(f'{output_dir}/wrf_solar_{year}.nc')
+  )(delayed(process_file_region)(f, times, t0, output_fn, checkpoint, mask, geometry)
+    for f, (times, t0) in tqdm(zip(wrf_files, regions), total=len(wrf_files))
+    if checkpoint is None or not checkpoint.done(os.path.basename(f)))
+  finish_time_store(output_fn, time_chunk=len(time_axis) if chunk_tile is not None else None)
+  print(f'Wrote {sum(n_written)} of {len(time_axis)} time steps')
+  if checkpoint is not None:
+    checkpoint.remove()
   end = time.time()
   print(f'Total time: {end - start}s')
 
 
 if __name__ == "__main__":
-  year = sys.argv[1]
-  wrf_dir = sys.argv[2]
-  output_dir = sys.argv[3]
+  parser = argparse.ArgumentParser(
+      description='Extract solar met data for one year from WRF output.',
+      usage='python wrf_solar.py year wrf_dir output_dir [--chunk-tile n] [--checkpoint-dir dir] [--mask bbox|csv|nc] [--mask-buffer k] [--sites config_csv ...] [--solar-geometry-dir dir]')
+  parser.add_argument('year')
+  parser.add_argument('wrf_dir')
+  parser.add_argument('output_dir')
+  # write time contiguous chunks of n x n cells, e.g. 16
+  parser.add_argument('--chunk-tile', type=int, default=None)
+  # record finished weekly files here so a rerun of a killed job picks up
+  # where it left off
+  parser.add_argument('--checkpoint-dir', default=None)
+  # only keep cells in a region: a lon_min,lat_min,lon_max,lat_max bounding
+  # box, a plant config csv (cells within --mask-buffer cells of a plant) or
+  # a netCDF file with a boolean mask
+  parser.add_argument('--mask', default=None)
+  parser.add_argument('--mask-buffer', type=int, default=1)
+  # only keep the cell nearest to each plant in these plant config csvs
+  parser.add_argument('--sites', nargs='+', default=None)
+  # cache of the sun position on the grid, see utils.solar_geometry
+  parser.add_argument('--solar-geometry-dir', default=None)
+  args = parser.parse_args()
+  if args.mask is not None and args.sites is not None:
+    parser.error('use only one of --mask and --sites')
 
-  print(f'Processing year {year}...')
-  process_year(year, wrf_dir=wrf_dir, output_dir=output_dir)
+  print(f'Processing year {args.year}...')
+  process_year(args.year, wrf_dir=args.wrf_dir, output_dir=args.output_dir,
+               chunk_tile=args.chunk_tile, checkpoint_dir=args.checkpoint_dir,
+               mask_spec=args.mask, mask_buffer=args.mask_buffer, site_configs=args.sites,
+               solar_geometry_dir=args.solar_geometry_dir)
@@ -1,5 +1,6 @@
 from glob import glob
-import sys
+import argparse
+import os
 import time
 
 # joblib allows for parallel threads
@@ -10,6 +11,11 @@ import pandas as pd
 from tqdm import tqdm
 import xarray as xr
 import wrf
+from utils.cells import compress_cells, plant_sites, region_mask
+from utils.checkpoint import Checkpoint, file_digest
+from utils.netcdf import (assign_time_regions, create_time_store, finish_time_store,
+                          time_chunked_encoding, time_store_status, write_time_region)
+from utils.vinterp import apply_weights, interp_weights
 
 #wrf_dir = '/global/cfs/cdirs/m2702/gsharing/tgw-wrf-conus/historical_1980_2019/three_hourly'
 #output_dir = '/global/cfs/cdirs/m2702/gsharing/solar-wind/met_data_fullgrid/historical'
@@ -25,37 +31,39 @@ def direction(a, b):
   return xr.apply_ufunc(func, a, b)
 
 
-def process_file(f, heights):
+def on_levels(var, values, heights):
+  """DataArray for var interpolated to heights, with an interp_level dimension like wrf.vinterp."""
+  coords = {name: c for name, c in var.coords.items() if 'bottom_top' not in c.dims}
+  coords['interp_level'] = heights
+  dims = ('Time', 'interp_level') + var.dims[2:]
+  return xr.DataArray(values, dims=dims, coords=coords, name=var.name, attrs=var.attrs)
+
+
+def process_file(f, heights, timeidx=wrf.ALL_TIMES, mask=None):
   ds = Dataset(f)
-  data = {
-      'ua': None,
-      'va': None,
-      'tc': None,
-      'pressure': None,
-  }
   cache = wrf.extract_vars(
       ds,
-      wrf.ALL_TIMES,
+      timeidx,
       # why all these variables?
       ("P", "PSFC", "PB", "PH", "PHB", "T", "QVAPOR", "HGT", "U", "V", "W")
   )
-  for v in data.keys():
-    # what does cache do?
-    var = wrf.getvar(wrfin=ds, varname=v, squeeze=False, timeidx=wrf.ALL_TIMES, cache=cache)
-    data[v] = wrf.vinterp(
-        wrfin=ds,
-        field=var,
-        vert_coord="ght_agl",
-        interp_levels=heights,
-        extrapolate=True,
-        timeidx=wrf.ALL_TIMES,
-        squeeze=False,
-        cache=cache
-    )
-  hourly = pd.date_range(data['ua'].Time[0].values, data['ua'].Time[-1].values, freq='H')
+  fields = {v: wrf.getvar(wrfin=ds, varname=v, squeeze=False, timeidx=timeidx, cache=cache)
+            for v in ('ua', 'va', 'tc', 'pressure')}
+  height = wrf.getvar(wrfin=ds, varname='height_agl', squeeze=False, timeidx=timeidx, cache=cache)
+  if mask is not None:
+    # only keep the cells in the region, see utils.cells
+    fields = {v: compress_cells(var, mask) for v, var in fields.items()}
+    height = compress_cells(height, mask)
+  # same as wrf.vinterp(vert_coord="ght_agl", extrapolate=True) for each
+  # variable, but the bracketing levels are only found once
+  index, weight = interp_weights(height.to_numpy(), np.asarray(heights) * 1000)
+  data = {v: on_levels(var, apply_weights(var.to_numpy(), index, weight), heights)
+          for v, var in fields.items()}
+  hourly = pd.date_range(data['ua'].Time[0].values, data['ua'].Time[-1].values, freq='h')
   merged = xr.merge([v for v in data.values()])
   # so much easier than how I did it
-  merged = merged.interp(Time=hourly, assume_sorted=True)
+  if merged.sizes['Time'] > 1:
+    merged = merged.interp(Time=hourly, assume_sorted=True)
   merged['windspeed'] = magnitude(merged['ua'], merged['va'])
   merged['winddirection'] = direction(merged['ua'], merged['va'])
   merged['pressure'] = merged['pressure'] * 100.0
@@ -67,6 +75,30 @@ def process_file(f, heights):
   return merged
 
 
+def file_times(f):
+  """
+  Hourly time steps that process_file returns for a single WRF output file,
+  without reading any other data.
+  """
+  times = wrf.extract_times(Dataset(f), wrf.ALL_TIMES)
+  return pd.date_range(times[0], times[-1], freq='h')
+
+
+def process_file_region(f, heights, times, t0, output_fn, checkpoint=None, mask=None):
+  """
+  Process a single WRF output file and write the time steps in times into
+  the yearly file output_fn, starting at time step t0. Returns the number of
+  time steps written. The file is recorded in checkpoint once its time steps
+  are written.
+  """
+  merged = process_file(f, heights, mask=mask).sel(Time=times)
+  merged['Time'] = merged['Time'].astype(np.int64)
+  write_time_region(output_fn, merged, t0)
+  if checkpoint is not None:
+    checkpoint.save(os.path.basename(f))
+  return len(times)
+
+
 def process_year(
     year,
     wrf_dir='/global/cfs/cdirs/m2702/gsharing/tgw-wrf-conus/historical_1980_2019/three_hourly/',
@@ -74,37 +106,124 @@ def process_year(
     # 52 files per year so 13 divides them evenly into 4 chunks
     tasks=13,
     output_dir='./',
+    chunk_tile=None,
+    checkpoint_dir=None,
+    mask_spec=None,
+    mask_buffer=1,
+    site_configs=None,
 ):
   start = time.time()
   print(f'OMP enabled: {wrf.omp_enabled()}, procs: {wrf.omp_get_num_procs()}')
   # The number of threads available to process
   wrf.omp_set_num_threads(16)
   wrf_files = sorted(glob(f'{wrf_dir}/*{year}*.nc'))
-  data = Parallel(
+  output_fn = f'{output_dir}/wrf_wind_{year}.nc'
+
+  # consecutive files overlap, each time step is written by the first file
+  # that has it
+  time_axis, regions = assign_time_regions([file_times(f) for f in wrf_files])
+
+  # optionally only process and store the cells in a region, or in sites
+  # mode only the cell nearest to each plant in the site config files
+  mask = None
+  sites = None
+  if mask_spec is not None or site_configs is not None:
+    grid = Dataset(wrf_files[0])
+    lat = wrf.getvar(grid, 'XLAT', meta=False)
+    lon = wrf.getvar(grid, 'XLONG', meta=False)
+    if site_configs is not None:
+      mask, sites = plant_sites(lat, lon, site_configs)
+    else:
+      mask = region_mask(mask_spec, lat, lon, buffer=mask_buffer)
+    print(f'Keeping {mask.sum()} of {mask.size} cells')
+
+  # weekly files that are already written to the yearly file are recorded in
+  # the checkpoint, a restarted run only processes the rest
+  checkpoint = None
+  if checkpoint_dir is not None:
+    checkpoint = Checkpoint(f'{checkpoint_dir}/wrf_wind_{year}',
+                            {'files': wrf_files, 'chunk_tile': chunk_tile,
+                             'mask_spec': mask_spec, 'mask_buffer': mask_buffer,
+                             'sites': [file_digest(fn) for fn in site_configs or []]})
+  # the yearly file is only reused if it can be opened, and is either still
+  # being filled in or was finished by this run (killed before the
+  # checkpoint was removed)
+  status = time_store_status(output_fn) if checkpoint is not None else None
+  if status == 'complete' and len(checkpoint.units()) == len(wrf_files):
+    print(f'{output_fn} is already complete')
+    checkpoint.remove()
+    return
+  resume = status == 'partial' and len(checkpoint.units()) > 0
+  if resume:
+    print(f'Resuming, {len(checkpoint.units())} of {len(wrf_files)} files already done')
+  elif checkpoint is not None:
+    checkpoint.reset()
+
+  # create the yearly file up front from one time step of the first file,
+  # then each worker writes the time steps of its own file as soon as it is
+  # done so only a few weeks of data are ever in memory
+  if not resume:
+    template = process_file(wrf_files[0], heights, timeidx=0, mask=mask)
+    template['Time'] = template['Time'].astype(np.int64)
+    template.attrs['projection'] = str(template.attrs['projection'])
+    del template.attrs['description']
+    del template.attrs['units']
+    for var in template.data_vars:
+      if 'projection' in template[var].attrs:
+        del template[var].attrs['projection']
+    if sites is not None:
+      # which site each plant uses
+      template = template.merge(sites)
+    # compression takes longer for little gain
+    # encoding={var: dict(zlib=True, complevel=5) for var in template.data_vars}
+    # optionally store each variable in chunks holding the whole year for small
+    # tiles of cells, so reading one cell or tile at a time is cheap. while
+    # the regions are written the chunks are about one file long, the file
+    # is rechunked to the whole year once at the end
+    encoding = None
+    if chunk_tile is not None:
+      region_steps = max(len(times) for times, _ in regions)
+      encoding = time_chunked_encoding(template, tile=chunk_tile, time_chunk=region_steps)
+    create_time_store(output_fn, template, time_axis.to_numpy().astype(np.int64), encoding=encoding)
+
+  n_written = Parallel(
       n_jobs=tasks,
       # prefer='threads',
-  )(delayed(process_file)(f, heights) for f in tqdm(wrf_files))
-  # ?
-  merged = xr.concat(data, dim='Time').drop_duplicates('Time')
-  merged['Time'] = merged['Time'].astype(np.int64)
-  merged.attrs['projection'] = str(merged.attrs['projection'])
-  del merged.attrs['description']
-  del merged.attrs['units']
-  for var in merged.data_vars:
-    if 'projection' in merged[var].attrs:
-      del merged[var].attrs['projection']
-  # compression takes longer for little gain
-  # merged.to_netcdf(f'{output_dir}/wrf_wind_{year}.nc',
-  # encoding={var: dict(zlib=True, complevel=5) for var in merged.data_vars})
-  merged.to_netcdf(f'{output_dir}/wrf_wind_{year}.nc')
+  )(delayed(process_file_region)(f, heights, times, t0, output_fn, checkpoint, mask)
+    for f, (times, t0) in tqdm(zip(wrf_files, regions), total=len(wrf_files))
+    if checkpoint is None or not checkpoint.done(os.path.basename(f)))
+  finish_time_store(output_fn, time_chunk=len(time_axis) if chunk_tile is not None else None)
+  print(f'Wrote {sum(n_written)} of {len(time_axis)} time steps')
+  if checkpoint is not None:
+    checkpoint.remove()
   end = time.time()
   print(f'Total time: {end - start}s')
 
 
 if __name__ == "__main__":
-  year = sys.argv[1]
-  wrf_dir = sys.argv[2]
-  output_dir = sys.argv[3]
+  parser = argparse.ArgumentParser(
+      description='Extract wind met data for one year from WRF output.',
+      usage='python wrf_wind.py year wrf_dir output_dir [--chunk-tile n] [--checkpoint-dir dir] [--mask bbox|csv|nc] [--mask-buffer k] [--sites config_csv ...]')
+  parser.add_argument('year')
+  parser.add_argument('wrf_dir')
+  parser.add_argument('output_dir')
+  # write time contiguous chunks of n x n cells, e.g. 16
+  parser.add_argument('--chunk-tile', type=int, default=None)
+  # record finished weekly files here so a rerun of a killed job picks up
+  # where it left off
+  parser.add_argument('--checkpoint-dir', default=None)
+  # only keep cells in a region: a lon_min,lat_min,lon_max,lat_max bounding
+  # box, a plant config csv (cells within --mask-buffer cells of a plant) or
+  # a netCDF file with a boolean mask
+  parser.add_argument('--mask', default=None)
+  parser.add_argument('--mask-buffer', type=int, default=1)
+  # only keep the cell nearest to each plant in these plant config csvs
+  parser.add_argument('--sites', nargs='+', default=None)
+  args = parser.parse_args()
+  if args.mask is not None and args.sites is not None:
+    parser.error('use only one of --mask and --sites')
 
-  print(f'Processing year {year}...')
-  process_year(year, wrf_dir=wrf_dir, output_dir=output_dir)
+  print(f'Processing year {args.year}...')
+  process_year(args.year, wrf_dir=args.wrf_dir, output_dir=args.output_dir,
+               chunk_tile=args.chunk_tile, checkpoint_dir=args.checkpoint_dir,
+               mask_spec=args.mask, mask_buffer=args.mask_buffer, site_configs=args.sites)